@@ -0,0 +1,106 @@
+"""Process-wide cache of per-user analytics aggregates.
+
+The Analytics tab used to load every chat with all its messages and rescan
+them on each rerun. Now every user has ChatAggregates
+(backend/analytics_service.py) built from per-chat stats records that are
+stored with the user: users/{id}/stats documents on Firestore (a header
+and the records spread over STATS_PARTITIONS partitions), the counter
+columns of the chats table on SQLite. This cache keeps one
+ChatAggregates per user for the whole server process (via
+@st.cache_resource):
+
+- Chat saves and deletes update a cached entry write-through, in O(1).
+- Entries older than CACHE_TTL_SECONDS are reloaded from the stored records,
+  which picks up changes made by other processes.
+- Aggregates are rebuilt from the full chats only when the stored records
+  are missing or incomplete (e.g. chats saved before they existed), or on
+  request.
+"""
+import threading
+import time
+
+import streamlit as st
+
+from backend import metrics
+from backend.analytics_service import ChatAggregates, chat_record
+from backend.lru import LRUCache
+from backend.user_data_cache import CACHE_MAX_USERS, CACHE_TTL_SECONDS
+
+
+class AnalyticsCache:
+    """ChatAggregates per user id, expiring after `ttl` seconds, LRU-bounded."""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_users=CACHE_MAX_USERS):
+        self.ttl = ttl
+        self._entries = LRUCache(max_users)  # user_id -> (ChatAggregates, loaded_at)
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id):
+        """The user's live aggregates, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                self._entries.pop(user_id)
+                return None
+            return entry[0]
+
+    def store(self, user_id, aggregates):
+        with self._lock:
+            self._entries.put(user_id, (aggregates, time.monotonic()))
+
+    def update_chat(self, user_id, chat_id, record):
+        """Write-through for a saved chat."""
+        entry = self._entries.peek(user_id)
+        if entry is not None:
+            entry[0].set_chat(chat_id, record)
+
+    def remove_chats(self, user_id, chat_ids):
+        """Write-through for deleted or archived chats."""
+        entry = self._entries.peek(user_id)
+        if entry is not None:
+            for chat_id in chat_ids:
+                entry[0].remove_chat(chat_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id)
+
+
+@st.cache_resource
+def get_analytics_cache():
+    """Process-wide AnalyticsCache shared by all sessions."""
+    return AnalyticsCache()
+
+
+def load_aggregates(user_id, rebuild=False):
+    """The user's ChatAggregates: cached, else from the stored records.
+
+    Args:
+        user_id: User's unique ID
+        rebuild: Recompute the records from every chat's messages (archived
+            chats from the archive index) and store them again, instead of
+            trusting the stored ones.
+    """
+    from backend.storage_service import get_storage
+
+    cache = get_analytics_cache()
+    aggregates = None if rebuild else cache.lookup(user_id)
+    if aggregates is not None:
+        return aggregates
+    storage = get_storage()
+    storage.flush()
+    records = None if rebuild else storage.load_chat_stats(user_id)
+    if records is None:
+        metrics.incr("analytics.rebuilds")
+        started = time.perf_counter()
+        archived = storage.load_archived_chat_stats(user_id)
+        hot = {chat_id: chat_record(chat) for chat_id, chat in storage.load_chats(user_id).items()}
+        records = {**(archived or {}), **hot}  # a chat left in both tiers by an interrupted archive run is hot
+        if archived is not None:
+            storage.save_chat_stats(user_id, records)
+        metrics.record_timing("analytics.rebuild", time.perf_counter() - started)
+    aggregates = ChatAggregates.from_records(records)
+    cache.store(user_id, aggregates)
+    return aggregates
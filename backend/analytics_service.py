@@ -1,142 +1,216 @@
 """Analytics service - computes usage stats from chat session data."""
 import datetime
+import threading
 from collections import defaultdict
 
+from backend.timeutil import from_ms
+
+# Per-chat counters stored with every chat, so headline numbers can be summed
+# by the storage backend (aggregation queries) without reading messages.
+CHAT_COUNTER_FIELDS = ("user_message_count", "assistant_message_count", "user_chars", "assistant_chars", "user_words")
+
+
+def chat_counters(messages) -> dict:
+    """Counters of one chat, stored alongside it on every save."""
+    counters = dict.fromkeys(CHAT_COUNTER_FIELDS, 0)
+    for msg in messages:
+        role = msg.get("role", "")
+        content = msg.get("content", "")
+        if role == "user":
+            counters["user_message_count"] += 1
+            counters["user_chars"] += len(content)
+            counters["user_words"] += len(content.split())
+        elif role == "assistant":
+            counters["assistant_message_count"] += 1
+            counters["assistant_chars"] += len(content)
+    return counters
 
-def compute_analytics(chat_sessions: dict) -> dict:
-    """
-    Compute analytics from the user's chat_sessions dict.
-    Returns a dict with all computed metrics.
-    """
-    if not chat_sessions:
-        return _empty_analytics()
-
-    now = datetime.datetime.now()
-    today = now.date()
-
-    total_chats = len(chat_sessions)
-    total_user_msgs = 0
-    total_assistant_msgs = 0
-    total_user_chars = 0
-    total_assistant_chars = 0
-    total_user_words = 0
-    msgs_per_chat = []
-    chats_by_date = defaultdict(int)
-    msgs_by_date = defaultdict(int)
-    msgs_by_weekday = defaultdict(int)  # 0=Mon, 6=Sun
-    msgs_by_hour = defaultdict(int)
-    persona_usage = defaultdict(int)
-    longest_chat_title = ""
-    longest_chat_len = 0
-
-    for session_id, session_data in chat_sessions.items():
-        messages = session_data.get("messages", [])
-        timestamp = _parse_timestamp(session_data.get("timestamp"))
-        persona = session_data.get("persona", "Default")
-        persona_usage[persona] += 1
-
-        user_count = 0
-        assistant_count = 0
-
-        for msg in messages:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            if role == "user":
-                user_count += 1
-                total_user_chars += len(content)
-                total_user_words += len(content.split())
-            elif role == "assistant":
-                assistant_count += 1
-                total_assistant_chars += len(content)
-
-        total_user_msgs += user_count
-        total_assistant_msgs += assistant_count
-        msgs_per_chat.append(user_count + assistant_count)
-
-        if (user_count + assistant_count) > longest_chat_len:
-            longest_chat_len = user_count + assistant_count
-            longest_chat_title = session_data.get("title", "Untitled")
-
-        # Group by date
-        if timestamp:
-            chat_date = timestamp.date()
-            chats_by_date[chat_date] += 1
-            msgs_by_date[chat_date] += user_count + assistant_count
-            msgs_by_weekday[timestamp.weekday()] += user_count + assistant_count
-            msgs_by_hour[timestamp.hour] += user_count + assistant_count
-
-    # Build last 7 days activity
-    last_7_days = {}
-    for i in range(6, -1, -1):
-        d = today - datetime.timedelta(days=i)
-        last_7_days[d.strftime("%a")] = chats_by_date.get(d, 0)
-
-    # Messages last 7 days
-    msgs_last_7 = {}
-    for i in range(6, -1, -1):
-        d = today - datetime.timedelta(days=i)
-        msgs_last_7[d.strftime("%a")] = msgs_by_date.get(d, 0)
-
-    # Most active day of week
-    weekday_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-    most_active_day = ""
-    if msgs_by_weekday:
-        best_day_idx = max(msgs_by_weekday, key=msgs_by_weekday.get)
-        most_active_day = weekday_names[best_day_idx]
-
-    # Most active hour
-    most_active_hour = ""
-    if msgs_by_hour:
-        best_hour = max(msgs_by_hour, key=msgs_by_hour.get)
-        most_active_hour = f"{best_hour:02d}:00"
-
-    avg_msgs = round(sum(msgs_per_chat) / len(msgs_per_chat), 1) if msgs_per_chat else 0
-
-    # Today's stats
-    today_chats = chats_by_date.get(today, 0)
-    today_msgs = msgs_by_date.get(today, 0)
 
+def headline_stats(totals, today_totals):
+    """Top-row metrics from StorageBackend.chat_totals() results.
+
+    Returns None when the totals are unavailable or some chats were saved
+    before counters existed; the caller then waits for the full aggregates.
+    """
+    if not totals or not today_totals or totals["counted"] < totals["chats"]:
+        return None
+    chats = totals["chats"]
+    messages = totals["user_message_count"] + totals["assistant_message_count"]
     return {
-        "total_chats": total_chats,
-        "total_user_msgs": total_user_msgs,
-        "total_assistant_msgs": total_assistant_msgs,
-        "total_messages": total_user_msgs + total_assistant_msgs,
-        "total_user_chars": total_user_chars,
-        "total_assistant_chars": total_assistant_chars,
-        "avg_msgs_per_chat": avg_msgs,
-        "longest_chat_title": longest_chat_title,
-        "longest_chat_len": longest_chat_len,
-        "chats_last_7_days": last_7_days,
-        "msgs_last_7_days": msgs_last_7,
-        "most_active_day": most_active_day,
-        "most_active_hour": most_active_hour,
-        "persona_usage": dict(persona_usage),
-        "today_chats": today_chats,
-        "today_msgs": today_msgs,
-        "total_user_words": total_user_words,
+        "total_chats": chats,
+        "total_user_msgs": totals["user_message_count"],
+        "total_assistant_msgs": totals["assistant_message_count"],
+        "total_messages": messages,
+        "total_user_chars": totals["user_chars"],
+        "total_user_words": totals["user_words"],
+        "avg_msgs_per_chat": round(messages / chats, 1) if chats else 0,
+        "today_chats": today_totals["chats"],
+        "today_msgs": today_totals["user_message_count"] + today_totals["assistant_message_count"],
     }
 
 
-def _parse_timestamp(ts):
-    """Parse a timestamp from various formats."""
-    if ts is None:
-        return None
-    if isinstance(ts, datetime.datetime):
-        return ts
-    if isinstance(ts, str):
-        try:
-            return datetime.datetime.fromisoformat(ts)
-        except Exception:
-            return None
-    if hasattr(ts, 'timestamp'):
-        try:
-            return datetime.datetime.fromtimestamp(ts.timestamp())
-        except Exception:
-            return None
-    return None
-
-
-def _empty_analytics():
+# Stats record of one chat, a list in this order. Records are all the
+# analytics need, so aggregates never touch message bodies once built.
+RECORD_FIELDS = ("updated_ms", "persona", "title") + CHAT_COUNTER_FIELDS
+
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# From this many records on, ChatAggregates are built by the pandas engine
+# (python -m backend.benchmarks analytics shows the crossover)
+FRAME_MIN_RECORDS = 5000
+
+
+def chat_record(chat) -> list:
+    """Stats record of a chat dict, from its stored counters or its messages."""
+    if all(chat.get(field) is not None for field in CHAT_COUNTER_FIELDS):
+        counters = [chat[field] for field in CHAT_COUNTER_FIELDS]
+    else:
+        counters = list(chat_counters(chat.get("messages", [])).values())
+    return [chat.get("updated_ms"), chat.get("persona") or "Default", chat.get("title", "Untitled"), *counters]
+
+
+class ChatAggregates:
+    """Running analytics aggregates of one user's chats.
+
+    Holds the stats record of every chat plus totals, per-day, per-weekday,
+    per-hour and per-persona buckets. set_chat() and remove_chat() adjust
+    them in O(1) by taking the chat's previous record out and the new one
+    in; only the longest chat is recomputed from the records, and only when
+    the current longest one shrinks or goes away. Day, weekday and hour
+    buckets use the chat's last update time, in local time.
+    """
+
+    def __init__(self, records=None):
+        self.records = {}
+        self.totals = dict.fromkeys(CHAT_COUNTER_FIELDS, 0)
+        self.chats_by_date = defaultdict(int)
+        self.msgs_by_date = defaultdict(int)
+        self.msgs_by_weekday = [0] * 7  # 0=Mon, 6=Sun
+        self.msgs_by_hour = [0] * 24
+        self.dated_chats = 0
+        self.persona_usage = defaultdict(int)
+        self._longest = None  # (message count, updated_ms, chat_id); recomputed when None
+        self._lock = threading.Lock()
+        for chat_id, record in (records or {}).items():
+            self.set_chat(chat_id, record)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from {chat_id: record}, columnar from FRAME_MIN_RECORDS records on."""
+        if len(records) >= FRAME_MIN_RECORDS:
+            try:
+                from backend.analytics_frame import fill_aggregates
+            except ImportError:  # pandas is optional for the backend
+                pass
+            else:
+                return fill_aggregates(cls(), records)
+        return cls(records)
+
+    @classmethod
+    def from_chats(cls, chat_sessions):
+        """Build from scratch out of {chat_id: chat dict}."""
+        return cls.from_records({chat_id: chat_record(chat) for chat_id, chat in chat_sessions.items()})
+
+    def _apply(self, record, sign):
+        updated_ms, persona, _title, user_msgs, assistant_msgs, *_ = record
+        for index, field in enumerate(CHAT_COUNTER_FIELDS, start=3):
+            self.totals[field] += sign * record[index]
+        self.persona_usage[persona] += sign
+        if not self.persona_usage[persona]:
+            del self.persona_usage[persona]
+        if updated_ms:
+            timestamp = from_ms(updated_ms)
+            day = timestamp.date()
+            msgs = user_msgs + assistant_msgs
+            self.chats_by_date[day] += sign
+            self.msgs_by_date[day] += sign * msgs
+            if not self.chats_by_date[day]:
+                del self.chats_by_date[day], self.msgs_by_date[day]
+            self.msgs_by_weekday[timestamp.weekday()] += sign * msgs
+            self.msgs_by_hour[timestamp.hour] += sign * msgs
+            self.dated_chats += sign
+
+    @staticmethod
+    def _length_key(chat_id, record):
+        return (record[3] + record[4], record[0] or 0, chat_id)
+
+    def set_chat(self, chat_id, record):
+        """Add a chat or replace its previous record."""
+        record = list(record)
+        with self._lock:
+            old = self.records.get(chat_id)
+            if old is not None:
+                self._apply(old, -1)
+            self.records[chat_id] = record
+            self._apply(record, 1)
+            if self._longest is not None:
+                if self._longest[2] == chat_id:
+                    self._longest = None
+                else:
+                    self._longest = max(self._longest, self._length_key(chat_id, record))
+
+    def remove_chat(self, chat_id):
+        with self._lock:
+            old = self.records.pop(chat_id, None)
+            if old is None:
+                return
+            self._apply(old, -1)
+            if self._longest is not None and self._longest[2] == chat_id:
+                self._longest = None
+
+    def _longest_chat(self):
+        if self._longest is None and self.records:
+            self._longest = max(self._length_key(chat_id, record) for chat_id, record in self.records.items())
+        return self._longest
+
+    def analytics(self, today=None) -> dict:
+        """The compute_analytics result dict."""
+        with self._lock:
+            if not self.records:
+                return empty_analytics()
+            today = today or datetime.date.today()
+            days = [today - datetime.timedelta(days=i) for i in range(6, -1, -1)]
+            totals = self.totals
+            total_chats = len(self.records)
+            total_messages = totals["user_message_count"] + totals["assistant_message_count"]
+            longest_len, _, longest_id = self._longest_chat()
+            most_active_day = most_active_hour = ""
+            if self.dated_chats:
+                most_active_day = WEEKDAY_NAMES[self.msgs_by_weekday.index(max(self.msgs_by_weekday))]
+                most_active_hour = f"{self.msgs_by_hour.index(max(self.msgs_by_hour)):02d}:00"
+            return {
+                "total_chats": total_chats,
+                "total_user_msgs": totals["user_message_count"],
+                "total_assistant_msgs": totals["assistant_message_count"],
+                "total_messages": total_messages,
+                "total_user_chars": totals["user_chars"],
+                "total_assistant_chars": totals["assistant_chars"],
+                "avg_msgs_per_chat": round(total_messages / total_chats, 1),
+                "longest_chat_title": self.records[longest_id][2] if longest_len else "",
+                "longest_chat_len": longest_len,
+                "chats_last_7_days": {day.strftime("%a"): self.chats_by_date.get(day, 0) for day in days},
+                "msgs_last_7_days": {day.strftime("%a"): self.msgs_by_date.get(day, 0) for day in days},
+                "most_active_day": most_active_day,
+                "most_active_hour": most_active_hour,
+                "persona_usage": dict(self.persona_usage),
+                "today_chats": self.chats_by_date.get(today, 0),
+                "today_msgs": self.msgs_by_date.get(today, 0),
+                "total_user_words": totals["user_words"],
+            }
+
+
+def compute_analytics(data) -> dict:
+    """
+    Compute analytics from a ChatAggregates, or from a chat_sessions dict
+    (aggregated from scratch, which reads every message).
+    Returns a dict with all computed metrics.
+    """
+    if isinstance(data, ChatAggregates):
+        return data.analytics()
+    return ChatAggregates.from_chats(data or {}).analytics()
+
+
+def empty_analytics():
     """Return empty analytics dict."""
     return {
         "total_chats": 0,
@@ -0,0 +1,184 @@
+"""Asyncio access to Firestore on a shared background event loop.
+
+Streamlit script runs are synchronous, so independent Firestore calls made
+from them run one after another. This module keeps one event loop running on
+a daemon thread for the whole process, with one Firestore AsyncClient (and so
+one pooled gRPC channel) bound to it. Script runs and worker threads submit
+coroutines to the loop and wait for them with a timeout; independent reads
+and writes are gathered and overlap on the wire:
+
+    loop = get_background_loop()
+    chats, personas = loop.gather(load_chat_list(user_id), load_personas(user_id))
+
+Used for hydration (see StorageBackend.hydration_loaders), for commits that
+span several batches and for listing the subcollections of chats being
+deleted. With the `firestore_async = "off"` setting every caller uses the
+synchronous client instead. With the in-memory backend the client is an
+AsyncFakeFirestore over the same data (backend/fake_firestore.py).
+
+Queries are built by the same helpers as the synchronous code in
+backend/firebase_service.py, so both paths return identical results.
+"""
+import asyncio
+import concurrent.futures
+import threading
+
+import streamlit as st
+
+from backend import metrics
+from backend.config import get_setting
+from backend.write_buffer import BATCH_LIMIT
+
+DEFAULT_TIMEOUT_SECONDS = 30
+
+
+class BackgroundLoop:
+    """An asyncio event loop running forever on a daemon thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="firestore-async", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """Schedule `coro` on the loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=DEFAULT_TIMEOUT_SECONDS):
+        """Run `coro` on the loop and wait for its result.
+
+        Raises TimeoutError after `timeout` seconds, cancelling the coroutine.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("BackgroundLoop.run() called from the loop itself; await instead")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            metrics.incr("firestore.async.timeouts")
+            raise TimeoutError(f"Firestore operation timed out after {timeout}s") from None
+
+    def gather(self, *coros, timeout=DEFAULT_TIMEOUT_SECONDS, return_exceptions=False):
+        """Run coroutines concurrently; returns their results in order."""
+        async def gathered():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return self.run(gathered(), timeout)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+@st.cache_resource
+def get_background_loop():
+    """Process-wide event loop for Firestore coroutines."""
+    return BackgroundLoop()
+
+
+def enabled():
+    """Whether the async path is used (the `firestore_async` setting, default on)."""
+    return str(get_setting("firestore_async", "on")).lower() != "off"
+
+
+@st.cache_resource
+def get_async_db():
+    """Process-wide Firestore AsyncClient, created on the background loop."""
+    from backend.fake_firestore import AsyncFakeFirestore, FakeFirestore
+    from backend.firebase_service import get_db
+
+    db = get_db()  # initializes the Firebase app, or returns the in-memory fake
+    if isinstance(db, FakeFirestore):
+        return AsyncFakeFirestore(db)
+
+    async def create():
+        from firebase_admin import firestore_async
+        return firestore_async.client()  # its gRPC channel binds to this loop
+    return get_background_loop().run(create())
+
+
+def run(coro, timeout=DEFAULT_TIMEOUT_SECONDS):
+    """Run one coroutine on the background loop (see BackgroundLoop.run)."""
+    return get_background_loop().run(coro, timeout)
+
+
+# --- reads ---
+
+async def load_chat_list(user_id, page_size=None, cursor=None, since=None):
+    """Async firebase_service.load_chat_list."""
+    from backend import firebase_service as fs
+    try:
+        query, page_size = fs._listing_query(
+            get_async_db(), user_id, "chats", fs.CHAT_LIST_FIELDS, page_size or fs.CHAT_PAGE_SIZE, cursor, since
+        )
+        return fs._listing_page([chat async for chat in query.stream()], page_size, dict)
+    except Exception as e:
+        print(f"Error loading chat list: {e}")
+        return {}, None
+
+
+async def load_flashcard_list(user_id, page_size=None, cursor=None, since=None):
+    """Async firebase_service.load_flashcard_list."""
+    from backend import firebase_service as fs
+    try:
+        query, page_size = fs._listing_query(
+            get_async_db(), user_id, "flashcards", fs.FLASHCARD_LIST_FIELDS,
+            page_size or fs.FLASHCARD_PAGE_SIZE, cursor, since,
+        )
+        return fs._listing_page([item async for item in query.stream()], page_size, fs._flashcard_metadata)
+    except Exception as e:
+        print(f"Error loading flashcard list: {e}")
+        return {}, None
+
+
+async def load_personas(user_id, since=None):
+    """Async firebase_service.load_user_personas."""
+    from backend import firebase_service as fs
+    try:
+        return fs._personas_by_name([persona async for persona in fs._personas_query(get_async_db(), user_id, since).stream()])
+    except Exception as e:
+        print(f"Error loading personas: {e}")
+        return {}
+
+
+async def get_documents(paths, field_paths=None):
+    """Fetch many documents in one request; returns {path: data or None}."""
+    db = get_async_db()
+    refs = [db.document(path) for path in paths]
+    return {snapshot.reference.path: snapshot.to_dict() async for snapshot in db.get_all(refs, field_paths=field_paths)}
+
+
+async def list_documents(collection_paths):
+    """Paths of the documents in each collection, listed concurrently."""
+    db = get_async_db()
+
+    async def listing(path):
+        collection = db.collection(path)
+        return [ref.path async for ref in collection.list_documents()]
+
+    paths = await asyncio.gather(*(listing(path) for path in collection_paths))
+    return dict(zip(collection_paths, paths))
+
+
+# --- writes ---
+
+async def commit_writes(writes):
+    """Commit (op, path, data) writes (see firebase_service.commit_in_batches).
+
+    Batches of BATCH_LIMIT are committed concurrently; each one is atomic,
+    the whole set is not.
+    """
+    db = get_async_db()
+
+    async def commit(chunk):
+        batch = db.batch()
+        for op, path, data in chunk:
+            ref = db.document(path)
+            if op == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, data, merge=(op == "set"))
+        await batch.commit()
+
+    chunks = [writes[start:start + BATCH_LIMIT] for start in range(0, len(writes), BATCH_LIMIT)]
+    await asyncio.gather(*(commit(chunk) for chunk in chunks))
+    metrics.incr("firestore.async.batches", len(chunks))
@@ -1,14 +1,43 @@
-"""Google OAuth authentication service."""
+"""Google OAuth authentication service.
+
+HTTP calls go through one pooled requests.Session (get_http_session) with
+timeouts and retries. ID tokens are verified locally against Google's
+signing certificates, which CertCache keeps for as long as the response's
+Cache-Control max-age allows, so a login costs no certificate fetch. When
+the certificate endpoint fails, recently expired certificates stay in use for
+up to CERTS_STALE_SECONDS.
+"""
+import re
+import threading
+import time
+
 import requests
-from google.oauth2 import id_token
-from google.auth.transport import requests as auth_requests
+from google.auth import exceptions as auth_exceptions
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 
+from backend import metrics
+
 
 GOOGLE_CLIENT_ID = None
 GOOGLE_CLIENT_SECRET = None
 REDIRECT_URI = "http://localhost:8501"
 
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# (connect, read) seconds
+HTTP_TIMEOUT = (3.05, 10)
+# Certificates are kept this long when the response has no max-age
+CERTS_DEFAULT_MAX_AGE = 3600
+# How long expired certificates may be used while the endpoint is failing
+CERTS_STALE_SECONDS = 24 * 60 * 60
+# Minimum gap between fetches triggered by an unknown key id or after a failure
+CERTS_REFETCH_SECONDS = 60
+
 
 def init_google_oauth():
     """Initialize Google OAuth configuration."""
@@ -18,11 +47,88 @@ def init_google_oauth():
     REDIRECT_URI = st.secrets.get("google_oauth_redirect_uri", REDIRECT_URI)
 
 
+@st.cache_resource
+def get_http_session():
+    """Process-wide requests.Session with pooled connections and retries.
+
+    Connection failures are retried for every method. Read errors and 429/5xx
+    responses are retried for GET only, so an authorization code is never
+    sent twice to a server that may already have redeemed it.
+    """
+    retry = Retry(
+        total=3, connect=3, read=2, status=2, backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"GET"}),
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _max_age(cache_control):
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    return int(match.group(1)) if match else CERTS_DEFAULT_MAX_AGE
+
+
+class CertCache:
+    """Google's ID token signing certificates {key_id: PEM}, cached per max-age."""
+
+    def __init__(self, url=CERTS_URL, session=None, clock=time.monotonic):
+        self.url = url
+        self._session = session
+        self._clock = clock
+        self._certs = {}
+        self._expires = 0.0
+        self._fetched = None
+        self._retry_at = 0.0  # after a failed fetch, stale certs are served until then
+        self._lock = threading.Lock()
+
+    def get(self, key_id=None):
+        """Current certificates; refetched when expired or missing `key_id`."""
+        with self._lock:
+            now = self._clock()
+            stale = now >= self._expires and now >= self._retry_at
+            unknown = key_id is not None and key_id not in self._certs and (
+                self._fetched is None or now - self._fetched >= CERTS_REFETCH_SECONDS
+            )
+            if stale or unknown:
+                try:
+                    self._fetch(now)
+                except (requests.RequestException, ValueError) as e:
+                    metrics.incr("auth.certs.fetch_errors")
+                    if not self._certs or now - self._expires > CERTS_STALE_SECONDS:
+                        raise
+                    self._retry_at = now + CERTS_REFETCH_SECONDS
+                    print(f"Error fetching Google certificates, using cached ones: {e}")
+            else:
+                metrics.incr("auth.certs.cache_hits")
+            return self._certs
+
+    def _fetch(self, now):
+        started = time.perf_counter()
+        response = (self._session or get_http_session()).get(self.url, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        certs = response.json()
+        if not isinstance(certs, dict) or not certs:
+            raise ValueError("Unexpected certificate response")
+        self._certs = certs
+        self._fetched = now
+        self._expires = now + _max_age(response.headers.get("Cache-Control"))
+        metrics.record_timing("auth.certs.fetch", time.perf_counter() - started)
+
+
+@st.cache_resource
+def get_cert_cache():
+    """Process-wide CertCache shared by all logins."""
+    return CertCache()
+
+
 def get_authorization_url():
     """Get Google OAuth authorization URL."""
     if GOOGLE_CLIENT_ID is None:
         init_google_oauth()
-    
+
     return (
         f"https://accounts.google.com/o/oauth2/v2/auth?"
         f"client_id={GOOGLE_CLIENT_ID}&"
@@ -37,8 +143,7 @@ def exchange_code_for_token(code):
     """Exchange authorization code for access token."""
     if GOOGLE_CLIENT_ID is None:
         init_google_oauth()
-    
-    token_url = "https://oauth2.googleapis.com/token"
+
     payload = {
         "client_id": GOOGLE_CLIENT_ID,
         "client_secret": GOOGLE_CLIENT_SECRET,
@@ -46,8 +151,10 @@ def exchange_code_for_token(code):
         "grant_type": "authorization_code",
         "redirect_uri": REDIRECT_URI,
     }
-    
-    response = requests.post(token_url, data=payload)
+
+    started = time.perf_counter()
+    response = get_http_session().post(TOKEN_URL, data=payload, timeout=HTTP_TIMEOUT)
+    metrics.record_timing("auth.token_exchange", time.perf_counter() - started)
     return response.json()
 
 
@@ -55,17 +162,21 @@ def verify_google_token(id_token_str):
     """Verify Google ID token and extract user info."""
     if GOOGLE_CLIENT_ID is None:
         init_google_oauth()
-    
+
     try:
-        user_info = id_token.verify_oauth2_token(
+        key_id = jwt.decode_header(id_token_str).get("kid")
+        user_info = jwt.decode(
             id_token_str,
-            auth_requests.Request(),
+            certs=get_cert_cache().get(key_id),
+            audience=GOOGLE_CLIENT_ID,
             clock_skew_in_seconds=300,
         )
+        if user_info.get('iss') not in GOOGLE_ISSUERS:
+            raise auth_exceptions.GoogleAuthError(f"Wrong issuer: {user_info.get('iss')}")
         # Verify the token audience matches our client ID
         if user_info.get('aud') != GOOGLE_CLIENT_ID:
             raise ValueError('Token audience does not match client ID')
-        
+
         return user_info
     except Exception as e:
         print(f"Token verification error: {e}")
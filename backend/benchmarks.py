@@ -0,0 +1,269 @@
+"""Persistence benchmarks run against the in-memory Firestore stand-in.
+
+Usage:
+    python -m backend.benchmarks codec [--chats 20] [--turns 30] [--latency-ms 0]
+    python -m backend.benchmarks flashcards [--latency-ms 0]
+    python -m backend.benchmarks analytics [--chats 1000 10000 100000]
+
+Every benchmark forces `firestore_backend = "memory"` (and turns the local
+write journal off), so no credentials or network access are needed. Byte counts use Firestore's storage size rules
+(see backend/fake_firestore.py); latencies are wall-clock times including
+the simulated per-operation latency. The analytics benchmark runs in memory
+only.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+_WORDS = (
+    "the a of to and in is that for it as with be on this are by or an from at which can you your "
+    "function value data model return example use using when each step first then also note more "
+    "result error file list state session user request response memory cache query index time "
+    "method class object string number table row column key page chat message answer question "
+    "important however because therefore instead simple different following section approach"
+).split()
+
+_CODE = [
+    "def load(path):\n    with open(path) as f:\n        return json.load(f)\n",
+    "for item in items:\n    if item.is_valid():\n        results.append(item.value)\n",
+    "SELECT id, title FROM chats WHERE user_id = ? ORDER BY updated_at DESC;\n",
+]
+
+
+def _sentence(rng):
+    words = rng.choices(_WORDS, k=rng.randint(8, 22))
+    return " ".join(words).capitalize() + "."
+
+
+def sample_answer(rng):
+    """A markdown assistant answer shaped like typical Gemini output."""
+    parts = [" ".join(_sentence(rng) for _ in range(rng.randint(2, 4)))]
+    for section in range(rng.randint(1, 4)):
+        parts.append(f"### {_sentence(rng)[:40].rstrip('.')}")
+        parts.append("\n".join(f"- **{rng.choice(_WORDS)}**: {_sentence(rng)}" for _ in range(rng.randint(2, 6))))
+        if rng.random() < 0.4:
+            parts.append(f"```python\n{rng.choice(_CODE)}```")
+        parts.append(" ".join(_sentence(rng) for _ in range(rng.randint(1, 3))))
+    return "\n\n".join(parts)
+
+
+def sample_transcript(rng, turns):
+    messages = []
+    for _ in range(turns):
+        messages.append({"role": "user", "content": _sentence(rng)})
+        messages.append({"role": "assistant", "content": sample_answer(rng)})
+    return messages
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def bench_codec(chats=20, turns=30, seed=7):
+    """Compare message codecs on the same transcripts, saved turn by turn."""
+    from backend import firebase_service, message_codec
+
+    db = firebase_service.get_db()
+    codecs = ["none", "zlib"] + (["zstd"] if message_codec.zstandard is not None else [])
+    rows = []
+    for codec in codecs:
+        message_codec.configure(codec)
+        rng = random.Random(seed)
+        transcripts = {f"chat-{i}": sample_transcript(rng, turns) for i in range(chats)}
+        user_id = f"bench-codec-{codec}"
+
+        db.reset_stats()
+        save_times = []
+        for chat_id, messages in transcripts.items():
+            for end in range(2, len(messages) + 1, 2):
+                started = time.perf_counter()
+                firebase_service.save_chat_to_firestore(user_id, chat_id, messages[:end], chat_id)
+                firebase_service.flush_pending_writes()
+                save_times.append(time.perf_counter() - started)
+        bytes_written = db.stats["bytes_written"]
+
+        db.reset_stats()
+        started = time.perf_counter()
+        loaded = firebase_service.load_user_chats(user_id)
+        read_time = time.perf_counter() - started
+        assert all(loaded[chat_id]["messages"] == messages for chat_id, messages in transcripts.items())
+
+        rows.append({
+            "codec": codec,
+            "stored_bytes": db.stored_bytes(f"users/{user_id}/"),
+            "bytes_written": bytes_written,
+            "bytes_read": db.stats["bytes_read"],
+            "save_p50_ms": statistics.median(save_times) * 1000,
+            "save_p95_ms": _percentile(save_times, 0.95) * 1000,
+            "load_all_ms": read_time * 1000,
+        })
+    message_codec.configure()
+    return rows
+
+
+def sample_cards(rng, count):
+    return [{"question": _sentence(rng).rstrip(".") + "?", "answer": " ".join(_sentence(rng) for _ in range(2))}
+            for _ in range(count)]
+
+
+def _round_trips(stats):
+    return sum(stats.get(f"{operation}_calls", 0) for operation in ("get", "query", "write", "commit"))
+
+
+def _save_per_card(db, set_path, cards, title):
+    """Former layout: set document, then one sequential .set() per card."""
+    db.document(set_path).set({"title": title, "card_count": len(cards)}, merge=True)
+    for index, card in enumerate(cards):
+        db.document(f"{set_path}/cards/{index:05d}").set(card)
+
+
+def _save_subcollection(db, set_path, cards, title):
+    """Cards as a subcollection, written with one batch."""
+    batch = db.batch()
+    batch.set(db.document(set_path), {"title": title, "card_count": len(cards)}, merge=True)
+    for index, card in enumerate(cards):
+        batch.set(db.document(f"{set_path}/cards/{index:05d}"), card)
+    batch.commit()
+
+
+def _load_subcollection(db, set_path):
+    return [card.to_dict() for card in db.collection(f"{set_path}/cards").order_by("question").stream()]
+
+
+def bench_flashcards(deck_sizes=(10, 30, 100, 500), seed=7):
+    """Write and read cost of the candidate flashcard layouts."""
+    from backend import firebase_service
+
+    db = firebase_service.get_db()
+    rows = []
+    for size in deck_sizes:
+        cards = sample_cards(random.Random(seed), size)
+        for layout in ("per-card", "subcollection", "embedded"):
+            user_id = f"bench-flashcards-{layout}"
+            set_id = f"deck-{size}"
+            set_path = f"users/{user_id}/flashcards/{set_id}"
+
+            save_stats = []
+            for _ in range(2):  # first save, then an edit of the same deck
+                db.reset_stats()
+                started = time.perf_counter()
+                if layout == "per-card":
+                    _save_per_card(db, set_path, cards, set_id)
+                elif layout == "subcollection":
+                    _save_subcollection(db, set_path, cards, set_id)
+                else:
+                    firebase_service.save_flashcards_to_firestore(user_id, set_id, cards, set_id)
+                save_ms = (time.perf_counter() - started) * 1000
+                save_stats.append(dict(db.stats))
+
+            db.reset_stats()
+            started = time.perf_counter()
+            if layout == "embedded":
+                snapshot = db.document(set_path).get()
+                loaded = firebase_service._read_cards(snapshot.reference, snapshot.to_dict())
+            else:
+                loaded = _load_subcollection(db, set_path)
+            load_ms = (time.perf_counter() - started) * 1000
+            assert len(loaded) == size
+
+            rows.append({
+                "cards": size,
+                "layout": layout,
+                "save_trips": _round_trips(save_stats[0]),
+                "resave_trips": _round_trips(save_stats[1]),
+                "docs_written": save_stats[1]["documents_written"],
+                "bytes_written": save_stats[1]["bytes_written"],
+                "resave_ms": save_ms,
+                "load_trips": _round_trips(db.stats),
+                "docs_read": db.stats["documents_read"],
+                "bytes_read": db.stats["bytes_read"],
+                "load_ms": load_ms,
+            })
+    return rows
+
+
+def sample_chats(rng, count, max_turns=6):
+    """{chat_id: chat} with short transcripts, spread over the last 90 days."""
+    from backend.timeutil import DAY_MS, now_ms
+
+    now = now_ms()
+    personas = ["Default", "Academic", "Friendly", "Personal Therapist"]
+    chats = {}
+    for i in range(count):
+        messages = []
+        for _ in range(rng.randint(1, max_turns)):
+            messages.append({"role": "user", "content": _sentence(rng)})
+            messages.append({"role": "assistant", "content": " ".join(_sentence(rng) for _ in range(3))})
+        chats[f"chat-{i}"] = {
+            "title": _sentence(rng)[:30], "persona": rng.choice(personas), "messages": messages,
+            "updated_ms": now - rng.randint(0, 90 * DAY_MS),
+        }
+    return chats
+
+
+def bench_analytics(sizes=(1000, 10000, 100000), seed=7):
+    """Cold Analytics page: stored records to compute_analytics(), per-record loop vs columnar."""
+    from backend.analytics_frame import fill_aggregates
+    from backend.analytics_service import ChatAggregates, chat_record, compute_analytics
+
+    rows = []
+    for size in sizes:
+        chats = sample_chats(random.Random(seed), size)
+        records = {chat_id: chat_record(chat) for chat_id, chat in chats.items()}
+
+        started = time.perf_counter()
+        aggregates = ChatAggregates(records)
+        expected = compute_analytics(aggregates)
+        loop_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        result = compute_analytics(fill_aggregates(ChatAggregates(), records))
+        frame_ms = (time.perf_counter() - started) * 1000
+        assert result == expected
+
+        started = time.perf_counter()
+        compute_analytics(aggregates)
+        read_ms = (time.perf_counter() - started) * 1000
+
+        rows.append({
+            "chats": size,
+            "loop_ms": loop_ms,
+            "frame_ms": frame_ms,
+            "speedup": loop_ms / frame_ms,
+            "aggregates_ms": read_ms,
+        })
+    return rows
+
+
+def _print_table(rows):
+    columns = list(rows[0])
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{v:>14.2f}" if isinstance(v, float) else f"{v:>14}" for v in row.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmark", choices=["codec", "flashcards", "analytics"])
+    parser.add_argument("--chats", type=int, nargs="+", default=None,
+                        help="Chats per user (codec, default 20) or sizes to compare (analytics)")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Simulated latency per Firestore operation")
+    args = parser.parse_args()
+
+    os.environ["BUDDY_FIRESTORE_BACKEND"] = "memory"
+    os.environ["BUDDY_WRITE_JOURNAL"] = "off"  # measure the Firestore writes themselves
+    os.environ["BUDDY_FIRESTORE_FAKE_LATENCY_MS"] = str(args.latency_ms)
+    if args.benchmark == "codec":
+        _print_table(bench_codec(args.chats[0] if args.chats else 20, args.turns))
+    elif args.benchmark == "flashcards":
+        _print_table(bench_flashcards())
+    elif args.benchmark == "analytics":
+        _print_table(bench_analytics(args.chats or (1000, 10000, 100000)))
+
+
+if __name__ == "__main__":
+    main()
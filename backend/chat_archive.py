@@ -0,0 +1,94 @@
+"""Cold archive tier for chats nobody has opened in a long time.
+
+Usage:
+    python -m backend.chat_archive [--days 90] [--user <user_id>]
+
+Chats last saved more than `archive_after_days` days ago (default 90) are
+moved out of users/{id}/chats, so the sidebar listing, hydration and
+analytics only ever touch recent chats:
+
+    users/{id}/archives/{archive_id}     many chats in one document:
+        chat_ids[], chat_count, raw_bytes, archived_ms,
+        data: zlib-compressed JSON {chat_id: {title, persona, messages,
+              updated_ms, gemini_files}} with a message_codec version tag
+    users/{id}/archived_chats/{chat_id}  index entry, no messages:
+        title, persona, message_count, updated_ms, archive_id and the
+        analytics counters, so totals and stats rebuilds keep counting it
+
+Chats are packed into archives of at most ARCHIVE_MAX_BYTES compressed, so
+chats of one user share one compression window. Opening or searching an
+archived chat decompresses its archive; opening also moves the chat back to
+users/{id}/chats. The Firestore side lives in backend/firebase_service.py;
+backends without a cold tier (SQLite) keep all chats hot.
+"""
+import argparse
+import json
+import time
+import zlib
+
+from backend.message_codec import ZLIB_V1, decode_content
+
+ARCHIVE_AFTER_DAYS = 90
+
+# Compressed size limit of one archive document (Firestore allows 1 MiB)
+ARCHIVE_MAX_BYTES = 900_000
+
+# Uncompressed JSON collected before an archive is packed
+ARCHIVE_RAW_BYTES = 2_000_000
+
+INDEX_FIELDS = ("title", "persona", "message_count", "updated_ms")
+
+
+def pack_chats(chats):
+    """Compress {chat_id: chat} into archives of at most ARCHIVE_MAX_BYTES.
+
+    Returns (archives, too_large): archives is a list of (chat_ids, data,
+    raw_bytes); too_large lists chats that do not fit even on their own.
+    """
+    raw = json.dumps(chats, separators=(",", ":")).encode("utf-8")
+    data = bytes([ZLIB_V1]) + zlib.compress(raw, 9)
+    if len(data) <= ARCHIVE_MAX_BYTES:
+        return [(list(chats), data, len(raw))], []
+    if len(chats) == 1:
+        return [], list(chats)
+    chat_ids = list(chats)
+    middle = len(chat_ids) // 2
+    first, first_skipped = pack_chats({chat_id: chats[chat_id] for chat_id in chat_ids[:middle]})
+    second, second_skipped = pack_chats({chat_id: chats[chat_id] for chat_id in chat_ids[middle:]})
+    return first + second, first_skipped + second_skipped
+
+
+def unpack_chats(data):
+    """Inverse of pack_chats for one archive's `data`."""
+    return json.loads(decode_content(data))
+
+
+def chat_matches(chat, text):
+    """Whether `text` occurs in a chat's title or messages (case-insensitive)."""
+    text = text.lower()
+    if text in (chat.get("title") or "").lower():
+        return True
+    return any(text in str(message.get("content", "")).lower() for message in chat.get("messages", []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=None, help="Inactivity threshold (default: archive_after_days)")
+    parser.add_argument("--user", action="append", dest="users", help="Only archive this user's chats (repeatable)")
+    args = parser.parse_args()
+
+    from backend.storage_service import get_storage
+
+    storage = get_storage()
+    user_ids = args.users or storage.list_user_ids()
+    total = 0
+    for count, user_id in enumerate(user_ids, 1):
+        started = time.perf_counter()
+        archived = storage.archive_chats(user_id, args.days)
+        total += archived
+        print(f"[{count}/{len(user_ids)}] {user_id}: {archived} chats archived ({time.perf_counter() - started:.2f}s)")
+    print(f"Archived {total} chats")
+
+
+if __name__ == "__main__":
+    main()
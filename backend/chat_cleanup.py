@@ -0,0 +1,78 @@
+"""Background bulk deletion of chats.
+
+The sidebar starts a job and polls it for progress. The deletion runs on a
+worker thread, so the UI stays responsive while many chats are removed
+together with their shards, blobs and the Gemini files uploaded in them.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from backend import metrics
+from backend.storage_service import get_storage
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-cleanup")
+
+
+class ChatDeletionJob:
+    """State of one bulk deletion, read by the UI while the job runs.
+
+    Either `chat_ids` or `before` selects the chats; with neither, the job
+    deletes nothing. `state` goes "running" -> "deleting_files" -> "done",
+    or "failed" with `error` set. `deleted_ids` lists the chats that are gone.
+    """
+
+    def __init__(self, user_id, chat_ids=None, before=None):
+        self.user_id = user_id
+        self.chat_ids = list(chat_ids) if chat_ids is not None else None
+        self.before = before
+        self.total = len(self.chat_ids) if self.chat_ids is not None else 0
+        self.done = 0
+        self.deleted_ids = []
+        self.files_deleted = 0
+        self.state = "running"
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 0.0
+
+    def _progress(self, done, total):
+        self.done, self.total = done, total
+
+    def run(self, ctx=None):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        storage = get_storage()
+        started = time.perf_counter()
+        chat_ids = self.chat_ids or []
+        try:
+            if self.chat_ids is None and self.before is not None:
+                chat_ids = storage.list_chat_ids(self.user_id, self.before)
+            self.total = len(chat_ids)
+            file_names = storage.delete_chats(self.user_id, chat_ids, self._progress)
+            self.deleted_ids = chat_ids
+            if file_names:
+                self.state = "deleting_files"
+                from backend.gemini_service import delete_gemini_files
+                self.files_deleted = delete_gemini_files(file_names)
+            self.state = "done"
+        except Exception as e:
+            print(f"Error deleting chats: {e}")
+            self.deleted_ids = chat_ids[:self.done]
+            self.error = str(e)
+            self.state = "failed"
+        metrics.incr("chats.bulk_deleted", len(self.deleted_ids))
+        metrics.record_timing("chats.bulk_delete", time.perf_counter() - started)
+
+
+def start_chat_deletion(user_id, chat_ids=None, before=None):
+    """Delete the given chats, or all chats last saved before `before`, in the background."""
+    job = ChatDeletionJob(user_id, chat_ids, before)
+    _executor.submit(job.run, get_script_run_ctx())
+    return job
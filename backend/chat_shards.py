@@ -0,0 +1,168 @@
+"""Layout of long conversations across several Firestore documents.
+
+A chat used to be one document holding the whole `messages` array, which
+slows down every read and write as the chat grows and fails outright at
+Firestore's 1 MiB document limit. Chats are now stored as:
+
+    chats/{chat_id}                   title, persona, timestamp, message_count,
+                                      shard_count, shard_hashes, shard_blobs,
+                                      shard_counters
+    chats/{chat_id}/shards/{00000}    {"index": 0, "messages": [...]}
+    chats/{chat_id}/blobs/{hash}-{n}  {"content": "..."}
+
+Each shard holds SHARD_SIZE messages. Long message content is compressed
+(see backend/message_codec.py); content still larger than BLOB_THRESHOLD_BYTES
+is spilled into content-addressed blob documents, so a shard stays far below
+the document limit. `shard_hashes` records a hash per
+shard: a save only rewrites shards whose hash changed, so appending a message
+touches the tail shard and the chat document, whatever the chat's length.
+`shard_blobs` lists the blobs each shard references ("{shard}/{blob}"), so
+blobs an edit leaves unreferenced are deleted without reading old shards.
+`shard_counters` keeps the analytics counters of every shard, so the chat's
+counters are updated from the changed shards only.
+
+The functions here are storage-agnostic; backend/firebase_service.py issues
+the writes and reads.
+"""
+import hashlib
+import json
+
+from backend.analytics_service import CHAT_COUNTER_FIELDS, chat_counters
+from backend.message_codec import decode_content, encode_content, encoded_size
+
+SHARD_SIZE = 40
+BLOB_THRESHOLD_BYTES = 16 * 1024
+# Characters per blob document; 4-byte UTF-8 characters still fit in 1 MiB.
+BLOB_CHUNK_CHARS = 200_000
+# Bytes per blob document for compressed content.
+BLOB_CHUNK_BYTES = 800_000
+
+
+def shard_id(index):
+    return f"{index:05d}"
+
+
+def _spill(message, blobs):
+    """Encode content and replace it by a blob reference if still oversized."""
+    content = message.get("content")
+    if not isinstance(content, str):
+        return message
+    encoded = encode_content(content)
+    if encoded_size(encoded) <= BLOB_THRESHOLD_BYTES:
+        return message if encoded is content else {**message, "content": encoded}
+    blob_id = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    chunk = BLOB_CHUNK_BYTES if isinstance(encoded, bytes) else BLOB_CHUNK_CHARS
+    parts = [encoded[i:i + chunk] for i in range(0, len(encoded), chunk)]
+    for part_index, part in enumerate(parts):
+        blobs[f"{blob_id}-{part_index}"] = {"content": part}
+    spilled = {k: v for k, v in message.items() if k != "content"}
+    spilled.update({"content_blob": blob_id, "content_parts": len(parts)})
+    return spilled
+
+
+def _hash(shard):
+    return hashlib.sha1(json.dumps(shard, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def build_chat_writes(chat_path, messages, previous_hashes=None, previous_blobs=None):
+    """Plan the document writes that store `messages` under `chat_path`.
+
+    Args:
+        chat_path: Path of the chat document, e.g. "users/u/chats/c"
+        messages: Full list of messages
+        previous_hashes: `shard_hashes` of the stored chat, if known
+        previous_blobs: `shard_blobs` of the stored chat, if known
+
+    Returns:
+        tuple: (writes, shard_hashes, shard_blobs). writes is a list of
+        (op, path, data) with op "replace" or "delete", including deletes of
+        blobs no shard references any more; the chat document itself is not
+        included.
+    """
+    previous_hashes = previous_hashes or []
+    previous_blobs = previous_blobs or []
+    kept_blobs = {}
+    for ref in previous_blobs:
+        kept_blobs.setdefault(ref.split("/", 1)[0], []).append(ref)
+    writes = []
+    hashes = []
+    shard_blobs = []
+    for index in range((len(messages) + SHARD_SIZE - 1) // SHARD_SIZE):
+        raw_messages = messages[index * SHARD_SIZE:(index + 1) * SHARD_SIZE]
+        shard_hash = _hash(raw_messages)
+        hashes.append(shard_hash)
+        if index < len(previous_hashes) and previous_hashes[index] == shard_hash:
+            shard_blobs.extend(kept_blobs.get(shard_id(index), []))
+            continue
+        # Only changed shards pay for compression and blob spilling
+        blobs = {}
+        shard_messages = [_spill(m, blobs) for m in raw_messages]
+        for blob_doc_id, blob in blobs.items():
+            writes.append(("replace", f"{chat_path}/blobs/{blob_doc_id}", blob))
+            shard_blobs.append(f"{shard_id(index)}/{blob_doc_id}")
+        writes.append(("replace", f"{chat_path}/shards/{shard_id(index)}", {
+            "index": index,
+            "messages": shard_messages,
+        }))
+    for index in range(len(hashes), len(previous_hashes)):
+        writes.append(("delete", f"{chat_path}/shards/{shard_id(index)}", None))
+    referenced = {ref.split("/", 1)[1] for ref in shard_blobs}
+    for blob_doc_id in sorted({ref.split("/", 1)[1] for ref in previous_blobs} - referenced):
+        writes.append(("delete", f"{chat_path}/blobs/{blob_doc_id}", None))
+    return writes, hashes, shard_blobs
+
+
+def count_shards(messages, shard_hashes, previous_hashes=None, previous_counters=None):
+    """Per-shard counters (CHAT_COUNTER_FIELDS, flattened shard after shard).
+
+    Shards whose hash is unchanged reuse `previous_counters`, the stored
+    `shard_counters`; only changed shards, or all of them when the stored
+    counters are missing, are counted from their messages.
+    """
+    previous_hashes = previous_hashes or []
+    previous_counters = previous_counters or []
+    width = len(CHAT_COUNTER_FIELDS)
+    reusable = len(previous_counters) == len(previous_hashes) * width
+    counters = []
+    for index, shard_hash in enumerate(shard_hashes):
+        if reusable and index < len(previous_hashes) and previous_hashes[index] == shard_hash:
+            counters.extend(previous_counters[index * width:(index + 1) * width])
+        else:
+            counters.extend(chat_counters(messages[index * SHARD_SIZE:(index + 1) * SHARD_SIZE]).values())
+    return counters
+
+
+def sum_counters(shard_counters):
+    """{field: total} of flattened per-shard counters."""
+    width = len(CHAT_COUNTER_FIELDS)
+    return {field: sum(shard_counters[i::width]) for i, field in enumerate(CHAT_COUNTER_FIELDS)}
+
+
+def blob_ids(shard_messages):
+    """Blob document ids referenced by a shard's messages."""
+    return [
+        f"{m['content_blob']}-{part}"
+        for m in shard_messages if "content_blob" in m
+        for part in range(m.get("content_parts", 1))
+    ]
+
+
+def restore_messages(shard_messages, blobs):
+    """Inline blob contents and decode messages. `blobs` maps blob doc id -> content.
+
+    Decoding is per chat, on read: listings never load messages, and a chat's
+    messages are read when it is opened or by whole-history jobs (recount,
+    export, archive) that use every body. Message dicts always hold str
+    content, which rendering, the Gemini history, shard hashing and JSON
+    serialization rely on.
+    """
+    restored = []
+    for message in shard_messages:
+        if "content_blob" in message:
+            parts = [blobs.get(f"{message['content_blob']}-{i}", "") for i in range(message.get("content_parts", 1))]
+            message = {k: v for k, v in message.items() if k not in ("content_blob", "content_parts")}
+            message["content"] = b"".join(parts) if parts and isinstance(parts[0], bytes) else "".join(parts)
+        if isinstance(message.get("content"), bytes):
+            message = {**message, "content": decode_content(message["content"])}
+        restored.append(message)
+    return restored
@@ -0,0 +1,20 @@
+"""Runtime settings read from the environment or .streamlit/secrets.toml."""
+import os
+
+import streamlit as st
+
+
+def get_setting(name: str, default=None):
+    """Look up a setting.
+
+    An environment variable named BUDDY_<NAME> (upper-cased) wins over the
+    `name` key in st.secrets, so benchmarks and scripts can run without a
+    secrets file.
+    """
+    env_value = os.environ.get(f"BUDDY_{name.upper()}")
+    if env_value is not None:
+        return env_value
+    try:
+        return st.secrets.get(name, default)
+    except FileNotFoundError:
+        return default
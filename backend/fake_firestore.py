@@ -0,0 +1,577 @@
+"""In-memory stand-in for the Firestore client, for tests and benchmarks.
+
+Implements the subset of the google-cloud-firestore API this project uses:
+nested collections and documents, set (with merge), update, delete, get,
+get_all, where/order_by/select/limit/start_after queries (also on the
+document id, `__name__`), count/sum/avg aggregation queries, stream and
+write batches.
+
+AsyncFakeFirestore exposes the same store through the interface of
+Firestore's AsyncClient (see backend/async_firestore.py).
+
+Every operation sleeps for a configurable latency and is counted in `stats`,
+so write amplification, query counts and bytes moved per user action can be
+measured deterministically without network access. Byte counts follow
+Firestore's documented storage size rules. Select it with the
+`firestore_backend = "memory"` setting (see backend/config.py).
+"""
+import asyncio
+import copy
+import datetime
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+try:
+    from google.api_core.exceptions import NotFound
+    from google.cloud.firestore_v1.transforms import DELETE_FIELD, SERVER_TIMESTAMP
+except ImportError:  # keep the fake usable without the Firestore client installed
+    class NotFound(Exception):
+        pass
+    DELETE_FIELD = object()
+    SERVER_TIMESTAMP = object()
+
+# Field path of the document id, as FieldPath.document_id() returns it
+DOCUMENT_ID = "__name__"
+
+# Seconds slept per operation type; override per client with `latency=`.
+DEFAULT_LATENCY = {"get": 0.0, "query": 0.0, "write": 0.0, "commit": 0.0}
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+def _resolve(value):
+    """Replace write sentinels the way the server would."""
+    if value is SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items() if v is not DELETE_FIELD}
+    if isinstance(value, list):
+        return [_resolve(v) for v in value]
+    return copy.deepcopy(value)
+
+
+def _has_delete_field(value):
+    if value is DELETE_FIELD:
+        return True
+    return isinstance(value, dict) and any(_has_delete_field(v) for v in value.values())
+
+
+def _check_set(document_data, merge):
+    """Reject DELETE_FIELD in a replacing set, as the real client does."""
+    if not merge and _has_delete_field(document_data):
+        raise ValueError(
+            "Cannot apply DELETE_FIELD in a set request without "
+            "specifying 'merge=True' or 'merge=[field_paths]'."
+        )
+
+
+def _merge(base, update):
+    merged = dict(base)
+    for key, value in update.items():
+        if value is DELETE_FIELD:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = _resolve(value)
+    return merged
+
+
+def _sort_key(value):
+    """Order values of mixed types roughly the way Firestore does."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    return (6, str(value))
+
+
+def _document_id(value):
+    """Cursor and filter values on the document id may be ids or references."""
+    return getattr(value, "id", value)
+
+
+def _field(item, field):
+    doc_id, data = item
+    return doc_id if field == DOCUMENT_ID else data[field]
+
+
+def _value_size(value):
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime.datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode("utf-8")) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(k.encode("utf-8")) + 1 + _value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(v) for v in value)
+    return 8
+
+
+def document_size(path, data):
+    """Storage size of a document: name + fields + 32 bytes of overhead."""
+    if data is None:
+        return 0
+    name_size = sum(len(segment.encode("utf-8")) + 1 for segment in path.split("/")) + 16
+    return name_size + _value_size(data) + 32
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+        self._fields = fields
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._fields is not None:
+            return {k: copy.deepcopy(v) for k, v in self._data.items() if k in self._fields}
+        return copy.deepcopy(self._data)
+
+    @property
+    def size(self):
+        return document_size(self.reference.path, self.to_dict())
+
+    def get(self, field):
+        return copy.deepcopy((self._data or {}).get(field))
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def collections(self):
+        prefix = self.path + "/"
+        names = {p[len(prefix):] for p in self._client._collections if p.startswith(prefix) and "/" not in p[len(prefix):]}
+        return [self.collection(name) for name in sorted(names) if self._client._collections[f"{prefix}{name}"]]
+
+    def get(self, field_paths=None):
+        self._client._tick("get")
+        self._client.stats["documents_read"] += 1
+        snapshot = DocumentSnapshot(self, self._client._read(self.path), fields=field_paths)
+        self._client.stats["bytes_read"] += snapshot.size
+        return snapshot
+
+    def set(self, document_data, merge=False):
+        _check_set(document_data, merge)
+        self._client._tick("write")
+        self._client._apply([("set", self.path, document_data, merge)])
+
+    def update(self, field_updates):
+        self._client._tick("write")
+        self._client._apply([("update", self.path, field_updates, True)])
+
+    def delete(self):
+        self._client._tick("write")
+        self._client._apply([("delete", self.path, None, False)])
+
+
+class Query:
+    DESCENDING = "DESCENDING"
+    ASCENDING = "ASCENDING"
+
+    def __init__(self, client, collection_path, filters=(), orders=(), fields=None, limit=None, start_after=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._fields = fields
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters, "orders": self._orders, "fields": self._fields,
+            "limit": self._limit, "start_after": self._start_after,
+        }
+        state.update(changes)
+        return Query(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction == "DESCENDING"),))
+
+    def select(self, field_paths):
+        return self._copy(fields=set(field_paths))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self._filters:
+            if field == DOCUMENT_ID:
+                if not _OPERATORS[op](doc_id, _document_id(value)):
+                    return False
+            elif field not in data or not _OPERATORS[op](data[field], value):
+                return False
+        # Documents missing an order_by field are excluded, as in Firestore
+        return all(field == DOCUMENT_ID or field in data for field, _ in self._orders)
+
+    def _ordered(self):
+        docs = [(doc_id, data) for doc_id, data in self._client._list(self._collection_path) if self._matches(doc_id, data)]
+        docs.sort(key=lambda item: item[0])
+        for field, descending in reversed(self._orders):
+            docs.sort(key=lambda item: _sort_key(_field(item, field)), reverse=descending)
+        return docs
+
+    def _cursor_position(self, docs):
+        cursor = self._start_after
+        if isinstance(cursor, DocumentSnapshot):
+            for index, (doc_id, _) in enumerate(docs):
+                if doc_id == cursor.id:
+                    return index + 1
+            cursor = cursor._data or {}
+        values = tuple(_sort_key(_document_id(cursor.get(field)) if field == DOCUMENT_ID else cursor.get(field))
+                       for field, _ in self._orders)
+        for index, item in enumerate(docs):
+            current = tuple(_sort_key(_field(item, field)) for field, _ in self._orders)
+            past = False
+            for (field, descending), a, b in zip(self._orders, current, values):
+                if a != b:
+                    past = a < b if descending else a > b
+                    break
+            if past:
+                return index
+        return len(docs)
+
+    def stream(self):
+        self._client._tick("query")
+        self._client.stats["queries"] += 1
+        docs = self._ordered()
+        if self._start_after is not None:
+            docs = docs[self._cursor_position(docs):]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        self._client.stats["documents_read"] += max(len(docs), 1)
+        for doc_id, data in docs:
+            ref = DocumentReference(self._client, f"{self._collection_path}/{doc_id}")
+            snapshot = DocumentSnapshot(ref, data, fields=self._fields)
+            self._client.stats["bytes_read"] += snapshot.size
+            yield snapshot
+
+    def get(self):
+        return list(self.stream())
+
+    def count(self, alias=None):
+        return AggregationQuery(self).count(alias)
+
+    def sum(self, field_ref, alias=None):
+        return AggregationQuery(self).sum(field_ref, alias)
+
+    def avg(self, field_ref, alias=None):
+        return AggregationQuery(self).avg(field_ref, alias)
+
+
+class AggregationResult:
+    def __init__(self, alias, value, read_time=None):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class AggregationQuery:
+    """count()/sum()/avg() over a query, evaluated without returning documents.
+
+    Billed like Firestore: one document read per 1000 index entries matched.
+    """
+
+    def __init__(self, query):
+        self._query = query
+        self._aggregations = []  # (kind, field, alias)
+
+    def _add(self, kind, field, alias):
+        self._aggregations.append((kind, field, alias or f"field_{len(self._aggregations) + 1}"))
+        return self
+
+    def count(self, alias=None):
+        return self._add("count", None, alias)
+
+    def sum(self, field_ref, alias=None):
+        return self._add("sum", field_ref, alias)
+
+    def avg(self, field_ref, alias=None):
+        return self._add("avg", field_ref, alias)
+
+    def get(self):
+        client = self._query._client
+        client._tick("query")
+        client.stats["aggregation_queries"] += 1
+        docs = self._query._ordered()
+        if self._query._limit is not None:
+            docs = docs[:self._query._limit]
+        client.stats["documents_read"] += max((len(docs) + 999) // 1000, 1)
+        results = []
+        for kind, field, alias in self._aggregations:
+            if kind == "count":
+                value = len(docs)
+            else:
+                numbers = [data[field] for _, data in docs
+                           if isinstance(data.get(field), (int, float)) and not isinstance(data.get(field), bool)]
+                if kind == "sum":
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+            results.append(AggregationResult(alias, value))
+        return [results]
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id, _ in self._client._list(self.path)]
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        _check_set(document_data, merge)
+        self._writes.append(("set", reference.path, document_data, merge))
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference.path, field_updates, True))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, False))
+
+    def commit(self):
+        self._client._tick("commit")
+        self._client.stats["batches"] += 1
+        self._client._apply(self._writes)
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class FakeFirestore:
+    """In-memory Firestore client.
+
+    Args:
+        latency: Optional overrides of DEFAULT_LATENCY (seconds per operation).
+    """
+
+    def __init__(self, latency=None):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.stats = defaultdict(int)
+        self._collections = defaultdict(dict)  # collection path -> {doc id: data}
+        self._lock = threading.RLock()
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._tick("get")
+        self.stats["documents_read"] += len(references)
+        for ref in references:
+            snapshot = DocumentSnapshot(ref, self._read(ref.path), fields=field_paths)
+            self.stats["bytes_read"] += snapshot.size
+            yield snapshot
+
+    def reset_stats(self):
+        self.stats.clear()
+
+    def _tick(self, operation):
+        self.stats[f"{operation}_calls"] += 1
+        delay = self.latency.get(operation, 0)
+        if delay:
+            time.sleep(delay)
+
+    def _read(self, path):
+        collection_path, doc_id = path.rsplit("/", 1)
+        with self._lock:
+            data = self._collections.get(collection_path, {}).get(doc_id)
+            return copy.deepcopy(data)
+
+    def _list(self, collection_path):
+        with self._lock:
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in self._collections.get(collection_path, {}).items()]
+
+    def _apply(self, writes):
+        """Apply writes atomically; an update of a missing document aborts all."""
+        with self._lock:
+            for op, path, _, _ in writes:
+                collection_path, doc_id = path.rsplit("/", 1)
+                if op == "update" and doc_id not in self._collections.get(collection_path, {}):
+                    raise NotFound(f"No document to update: {path}")
+            for op, path, data, merge in writes:
+                collection_path, doc_id = path.rsplit("/", 1)
+                docs = self._collections[collection_path]
+                self.stats["documents_written"] += 1
+                if op == "delete":
+                    docs.pop(doc_id, None)
+                    continue
+                if merge and doc_id in docs:
+                    docs[doc_id] = _merge(docs[doc_id], data)
+                else:
+                    docs[doc_id] = _resolve(data)
+                self.stats["bytes_written"] += document_size(path, docs[doc_id])
+
+    def stored_bytes(self, prefix=""):
+        """Total storage size of documents whose path starts with `prefix`."""
+        with self._lock:
+            return sum(
+                document_size(f"{collection_path}/{doc_id}", data)
+                for collection_path, docs in self._collections.items()
+                for doc_id, data in docs.items()
+                if f"{collection_path}/{doc_id}".startswith(prefix)
+            )
+
+
+class _AsyncQuery:
+    """Async view of a Query: builders chain, stream() is an async iterator."""
+
+    def __init__(self, query):
+        self._query = query
+
+    def __getattr__(self, name):
+        attribute = getattr(self._query, name)
+        if name in ("where", "order_by", "select", "limit", "start_after"):
+            return lambda *args, **kwargs: _AsyncQuery(attribute(*args, **kwargs))
+        return attribute
+
+    async def stream(self):
+        # Run the blocking query (and its simulated latency) off the event loop
+        for snapshot in await asyncio.to_thread(self._query.get):
+            yield snapshot
+
+    async def get(self):
+        return await asyncio.to_thread(self._query.get)
+
+
+class _AsyncCollection(_AsyncQuery):
+    def __init__(self, collection):
+        super().__init__(collection)
+        self.path = collection.path
+        self.id = collection.id
+
+    def document(self, document_id=None):
+        return _AsyncDocument(self._query.document(document_id))
+
+    async def list_documents(self):
+        for ref in await asyncio.to_thread(self._query.list_documents):
+            yield _AsyncDocument(ref)
+
+
+class _AsyncDocument:
+    def __init__(self, reference):
+        self._reference = reference
+        self.path = reference.path
+        self.id = reference.id
+
+    def collection(self, name):
+        return _AsyncCollection(self._reference.collection(name))
+
+    async def get(self, field_paths=None):
+        return await asyncio.to_thread(self._reference.get, field_paths)
+
+    async def set(self, document_data, merge=False):
+        await asyncio.to_thread(self._reference.set, document_data, merge)
+
+    async def update(self, field_updates):
+        await asyncio.to_thread(self._reference.update, field_updates)
+
+    async def delete(self):
+        await asyncio.to_thread(self._reference.delete)
+
+
+class _AsyncBatch:
+    def __init__(self, batch):
+        self._batch = batch
+
+    def set(self, reference, document_data, merge=False):
+        self._batch.set(reference, document_data, merge)
+
+    def update(self, reference, field_updates):
+        self._batch.update(reference, field_updates)
+
+    def delete(self, reference):
+        self._batch.delete(reference)
+
+    async def commit(self):
+        await asyncio.to_thread(self._batch.commit)
+
+    def __len__(self):
+        return len(self._batch)
+
+
+class AsyncFakeFirestore:
+    """AsyncClient-style access to a FakeFirestore, sharing its data and stats."""
+
+    def __init__(self, client):
+        self.sync_client = client
+
+    def collection(self, name):
+        return _AsyncCollection(self.sync_client.collection(name))
+
+    def document(self, path):
+        return _AsyncDocument(self.sync_client.document(path))
+
+    def batch(self):
+        return _AsyncBatch(self.sync_client.batch())
+
+    async def get_all(self, references, field_paths=None):
+        references = [DocumentReference(self.sync_client, ref.path) for ref in references]
+        for snapshot in await asyncio.to_thread(lambda: list(self.sync_client.get_all(references, field_paths))):
+            yield snapshot
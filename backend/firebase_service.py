@@ -2,11 +2,63 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
 import streamlit as st
-import datetime
+import atexit
+import sqlite3
+import time
+import zlib
+from backend.config import get_setting
+from backend.write_buffer import WriteBehindBuffer, BATCH_LIMIT
+from backend.write_journal import WriteJournal
+from backend import async_firestore, metrics
+from backend.personas import get_persona_registry
+from backend.user_data_cache import get_user_data_cache
+from backend.storage_service import CHAT_PAGE_SIZE, FLASHCARD_PAGE_SIZE
+from backend.chat_shards import build_chat_writes, blob_ids, count_shards, restore_messages, shard_id, sum_counters
+from backend.chat_archive import ARCHIVE_AFTER_DAYS, ARCHIVE_RAW_BYTES, INDEX_FIELDS, chat_matches, pack_chats, unpack_chats
+from backend.lru import LRUCache
+from backend.analytics_cache import get_analytics_cache
+from backend.analytics_service import CHAT_COUNTER_FIELDS, chat_counters, chat_record
+from backend.timeutil import DAY_MS, now_ms, to_ms, utc_datetime
+
+# Sidebar listing: fields fetched by the projection query
+CHAT_LIST_FIELDS = ["title", "updated_ms", "persona", "message_count"]
+
+# Flashcard listing: fields fetched by the projection query
+FLASHCARD_LIST_FIELDS = ["title", "card_count", "updated_ms"]
+
+# Field path of the document id (FieldPath.document_id())
+DOCUMENT_ID = "__name__"
+
+# Subcollections under a chat document, removed together with the chat
+CHAT_SUBCOLLECTIONS = ("shards", "blobs")
+
+# Chats handled per round of bulk deletion (one get_all + batched commits)
+DELETE_CHUNK = 50
+
+# Documents the per-chat stats records are spread over, by hash of the chat id.
+# A record costs ~8 index entries and ~150 bytes, so one document holds ~5k
+# chats before Firestore's 40k index entries (or 1 MiB) per document limit.
+STATS_PARTITIONS = 32
+
+# Cards embedded in a flashcard set document; larger decks continue in
+# flashcards/{id}/chunks/{n}. ~1 KB per card keeps documents far below 1 MiB.
+CARDS_PER_DOC = 200
+
+# chunk_count of flashcard sets seen by this process, so re-saves skip the read
+_flashcard_chunks = LRUCache(2000)
 
 @st.cache_resource
 def init_firebase():
-    """Initialize Firebase Admin SDK."""
+    """Initialize Firebase Admin SDK.
+
+    With the `firestore_backend = "memory"` setting an in-memory fake is
+    returned instead, with `firestore_fake_latency_ms` of simulated latency
+    per operation (for offline tests and benchmarks).
+    """
+    if get_setting("firestore_backend", "firebase") == "memory":
+        from backend.fake_firestore import FakeFirestore, DEFAULT_LATENCY
+        latency = float(get_setting("firestore_fake_latency_ms", 0)) / 1000
+        return FakeFirestore(latency={operation: latency for operation in DEFAULT_LATENCY})
     if not firebase_admin._apps:
         firebase_creds = dict(st.secrets["firebase_credentials"])
         cred = credentials.Certificate(firebase_creds)
@@ -19,65 +71,854 @@ def get_db():
     return init_firebase()
 
 
-def save_user_to_firestore(user_info):
-    """Save or update user in Firestore."""
+@st.cache_resource
+def get_write_buffer():
+    """Process-wide write-behind buffer for chat and profile saves."""
+    buffer = WriteBehindBuffer(get_db)
+    atexit.register(buffer.close)
+    return buffer
+
+
+@st.cache_resource
+def get_write_journal():
+    """Process-wide local journal of chat saves (backend/write_journal.py).
+
+    Opt-in: returns None unless the `write_journal` setting is "on", or when
+    the journal file cannot be opened; chat saves then go straight to the
+    write buffer.
+    """
+    if str(get_setting("write_journal", "off")).lower() != "on":
+        return None
+    path = get_setting("write_journal_path", "buddy_journal.db")
+    try:
+        journal = WriteJournal(path, {"chat": _replay_chat})
+    except sqlite3.Error as e:
+        # Typically another process holds the file's exclusive lock
+        metrics.incr("journal.open_failures")
+        print(f"ERROR: write journal {path} could not be opened ({e}). Chat saves in this process are NOT "
+              f"journaled and go straight to Firestore. Give every server process its own write_journal_path.")
+        return None
+    atexit.register(journal.close)
+    return journal
+
+
+def flush_pending_writes(timeout=10):
+    """Block until journaled and buffered writes are committed (sign-out, session restore)."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    journal = get_write_journal()
+    replayed = journal is None or journal.flush(timeout)
+    remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+    return get_write_buffer().flush(remaining) and replayed
+
+
+def _chat_path(user_id, session_id):
+    return f"users/{user_id}/chats/{session_id}"
+
+
+def commit_in_batches(writes, ordered=True):
+    """Commit (op, path, data) writes with batched writes of at most BATCH_LIMIT.
+
+    op is "set" (merge), "replace" (set without merge) or "delete". Batches
+    are committed one after another, so later writes never land before
+    earlier ones. With ordered=False they are committed concurrently on the
+    async Firestore loop; use that only when no batch depends on another.
+    """
+    if not ordered and len(writes) > BATCH_LIMIT and async_firestore.enabled():
+        async_firestore.run(async_firestore.commit_writes(writes))
+        return
     db = get_db()
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for op, path, data in writes[start:start + BATCH_LIMIT]:
+            ref = db.document(path)
+            if op == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, data, merge=(op == "set"))
+        batch.commit()
+
+
+def save_user_to_firestore(user_info):
+    """Save or update user in Firestore (buffered)."""
     user_id = user_info.get('user_id') or user_info.get('sub')
     if user_id:
-        db.collection("users").document(user_id).set(user_info, merge=True)
+        get_write_buffer().set(f"users/{user_id}", user_info, merge=True)
 
 
-def save_chat_to_firestore(user_id, session_id, messages, title):
-    """Save chat messages to Firestore."""
+# Users whose documents are known to carry updated_ms (see ensure_timestamps)
+_timestamped_users = LRUCache(10000)
+
+
+def ensure_timestamps(user_id):
+    """Backfill updated_ms on the user's legacy documents before they are queried.
+
+    Listings, delta syncs, archiving and date-based deletes order or filter on
+    updated_ms, which skips documents written before it existed. The first
+    call per user and process checks the marker backend/migrate_timestamps.py
+    sets on the user document, and migrates the user if it is missing.
+    """
+    if _timestamped_users.get(user_id):
+        return
+    from backend.migrate_timestamps import MIGRATED_FIELD, Checkpoint, migrate_user
     db = get_db()
-    db.collection("users").document(user_id).collection("chats").document(session_id).set({
-        "messages": messages,
+    try:
+        snapshot = db.collection("users").document(user_id).get(field_paths=[MIGRATED_FIELD])
+        if not (snapshot.to_dict() or {}).get(MIGRATED_FIELD):
+            counts = migrate_user(db, Checkpoint(None), user_id)
+            if any(counts.values()):
+                print(f"Backfilled updated_ms for user {user_id}: {counts}")
+        _timestamped_users.put(user_id, True)
+    except Exception as e:
+        print(f"Error backfilling timestamps: {e}")
+
+
+def _stored_shards(chat_path):
+    """Return (shard_hashes, shard_blobs, shard_counters, is_legacy) of the chat document.
+
+    A save of the chat still queued in the write buffer wins over the stored
+    document; otherwise the stored one is read, so saves by other workers
+    are never mistaken for unchanged shards.
+    """
+    write = get_write_buffer().pending(chat_path)
+    if write is not None and write["op"] == "delete":
+        return [], [], [], False
+    if write is not None and "shard_hashes" in write["data"]:
+        data = write["data"]
+        return data["shard_hashes"], data.get("shard_blobs", []), data.get("shard_counters", []), False
+    snapshot = get_db().document(chat_path).get(field_paths=["shard_hashes", "shard_blobs", "shard_counters"])
+    if not snapshot.exists:
+        return [], [], [], False
+    data = snapshot.to_dict() or {}
+    if "shard_hashes" not in data:
+        return [], [], [], True  # single-document chat written before sharding
+    return data["shard_hashes"], data.get("shard_blobs", []), data.get("shard_counters", []), False
+
+
+def _chat_document(message_count, title, persona, shard_hashes, shard_counters, updated_ms,
+                   timestamp=firestore.SERVER_TIMESTAMP, shard_blobs=()):
+    chat_data = {
+        "message_count": message_count,
+        **sum_counters(shard_counters),
+        "shard_count": len(shard_hashes),
+        "shard_hashes": shard_hashes,
+        "shard_blobs": list(shard_blobs),
+        "shard_counters": shard_counters,
         "title": title,
-        "timestamp": __import__('datetime').datetime.now()
-    }, merge=True)
+        "updated_ms": updated_ms,
+        "timestamp": timestamp
+    }
+    if persona:
+        chat_data["persona"] = persona
+    return chat_data
+
+
+def _chat_writes(user_id, chat_id, messages, title, persona, updated_ms):
+    """Plan the (op, path, data) writes of a chat save.
+
+    Returns (writes, chat_data). The chat document follows its shards and
+    the chat's stats record comes last, so both are committed together.
+    Counters of unchanged shards are reused from the stored chat.
+    """
+    chat_path = _chat_path(user_id, chat_id)
+    previous_hashes, previous_blobs, previous_counters, is_legacy = _stored_shards(chat_path)
+    writes, hashes, shard_blobs = build_chat_writes(chat_path, messages, previous_hashes, previous_blobs)
+    shard_counters = count_shards(messages, hashes, previous_hashes, previous_counters)
+    chat_data = _chat_document(len(messages), title, persona, hashes, shard_counters, updated_ms,
+                               shard_blobs=shard_blobs)
+    if is_legacy:
+        chat_data["messages"] = firestore.DELETE_FIELD
+    stats_writes = _stats_writes(user_id, {chat_id: chat_record(chat_data)})
+    return writes + [("set", chat_path, chat_data)] + stats_writes, chat_data
+
+
+def save_chat_to_firestore(user_id, session_id, messages, title, persona=None):
+    """Save chat messages to Firestore.
+
+    Messages are stored in shard documents (see backend/chat_shards.py) and
+    only shards whose content changed are rewritten, so an append touches the
+    tail shard and the chat document. The save is appended to the local write
+    journal and applied from there in the background, so it survives a slow
+    or unreachable Firestore. Without a journal the writes are buffered:
+    back-to-back saves of the same chat within the flush window are merged.
+    """
+    chat_path = _chat_path(user_id, session_id)
+    updated_ms = now_ms()
+    metadata = {"title": title, "updated_ms": updated_ms, "message_count": len(messages)}
+    if persona:
+        metadata["persona"] = persona
+    journal = get_write_journal()
+    if journal is not None:
+        try:
+            journal.append("chat", chat_path, {
+                "user_id": user_id, "chat_id": session_id, "messages": messages,
+                "title": title, "persona": persona, "updated_ms": updated_ms,
+            })
+        except (sqlite3.Error, RuntimeError, TypeError, ValueError) as e:
+            print(f"Error journaling chat save, writing it directly: {e}")
+        else:
+            get_user_data_cache().update_chat(user_id, session_id, metadata)
+            return
+
+    buffer = get_write_buffer()
+    writes, chat_data = _chat_writes(user_id, session_id, messages, title, persona, updated_ms)
+    for op, path, data in writes:
+        if op == "delete":
+            buffer.delete(path)
+        else:
+            buffer.set(path, data, merge=(op == "set"))
+    get_user_data_cache().update_chat(user_id, session_id, metadata)
+    _cache_chat_stats(user_id, {session_id: chat_record(chat_data)})
+
+
+def _replay_chat(payload):
+    """Journal applier: commit one chat save now, raising if it fails."""
+    user_id, chat_id = payload["user_id"], payload["chat_id"]
+    writes, chat_data = _chat_writes(
+        user_id, chat_id, payload["messages"], payload["title"], payload.get("persona"), payload["updated_ms"]
+    )
+    commit_in_batches(writes)
+    _cache_chat_stats(user_id, {chat_id: chat_record(chat_data)})
+
+
+def _discard_journaled(chat_paths):
+    """Forget unreplayed saves of chats being deleted, so they stay deleted."""
+    journal = get_write_journal()
+    if journal is not None:
+        journal.discard(chat_paths)
+
+
+def _iter_shards(chat_ref, chat_data):
+    """Yield a chat's messages shard by shard, in order."""
+    if "shard_hashes" not in chat_data:
+        yield chat_data.get("messages", [])
+        return
+    db = get_db()
+    for shard in chat_ref.collection("shards").order_by("index").stream():
+        shard_messages = shard.to_dict().get("messages", [])
+        blobs = {}
+        ids = blob_ids(shard_messages)
+        if ids:
+            refs = [chat_ref.collection("blobs").document(blob_id) for blob_id in ids]
+            for blob in db.get_all(refs):
+                if blob.exists:
+                    blobs[blob.id] = blob.to_dict().get("content", "")
+        yield restore_messages(shard_messages, blobs)
+
+
+def _read_messages(chat_ref, chat_data):
+    return [message for shard in _iter_shards(chat_ref, chat_data) for message in shard]
 
 
 def load_user_chats(user_id):
-    """Load user's chat history from Firestore."""
+    """Load user's full chat history (including messages) from Firestore.
+
+    Chats saved before per-chat counters existed get them written back
+    (buffered), so later headline numbers come from load_chat_totals().
+    """
+    ensure_timestamps(user_id)
     db = get_db()
     try:
         chats_ref = db.collection("users").document(user_id).collection("chats")
-        chats = chats_ref.order_by("timestamp", direction="DESCENDING").stream()
-        return {chat.id: chat.to_dict() for chat in chats}
+        chats = {}
+        for chat in chats_ref.order_by("updated_ms", direction="DESCENDING").stream():
+            chat_data = chat.to_dict()
+            chat_data["messages"] = _read_messages(chat.reference, chat_data)
+            chat_data.pop("shard_hashes", None)
+            chat_data.pop("shard_blobs", None)
+            chat_data.pop("shard_counters", None)
+            if "user_message_count" not in chat_data:
+                get_write_buffer().set(chat.reference.path, chat_counters(chat_data["messages"]), merge=True)
+            chats[chat.id] = chat_data
+        return chats
     except Exception as e:
         print(f"Error loading chats: {e}")
         return {}
 
 
+def load_chat_totals(user_id, since=None):
+    """Sum the per-chat counters with aggregation queries (see StorageBackend.chat_totals).
+
+    Archived chats are summed from their index entries, so totals do not
+    drop as chats are archived. Billed as one read per 1000 chats; no chat
+    documents are transferred.
+    """
+    user_ref = get_db().collection("users").document(user_id)
+    try:
+        totals = dict.fromkeys(("chats", "counted", *CHAT_COUNTER_FIELDS), 0)
+        for collection in ("chats", "archived_chats"):
+            query = user_ref.collection(collection)
+            if since is not None:
+                query = query.where(filter=firestore.FieldFilter("updated_ms", ">=", to_ms(since)))
+            aggregation = query.count(alias="chats")
+            for field in CHAT_COUNTER_FIELDS:
+                aggregation = aggregation.sum(field, alias=field)
+            for result in aggregation.get()[0]:
+                totals[result.alias] += int(result.value or 0)
+            if since is None:
+                counted = query.where(filter=firestore.FieldFilter("user_message_count", ">=", 0)).count(alias="counted")
+                totals["counted"] += int(counted.get()[0][0].value)
+        if since is not None:
+            totals["counted"] = totals["chats"]  # recent saves are assumed to carry counters
+        return totals
+    except Exception as e:
+        print(f"Error aggregating chat totals: {e}")
+        return None
+
+
+def _stats_path(user_id):
+    """Header of the stats records: complete, partitions, rebuilt_ms."""
+    return f"users/{user_id}/stats/chats"
+
+
+def _stats_partition_path(user_id, index):
+    return f"users/{user_id}/stats/chats-{index:02d}"
+
+
+def _partition_records(records):
+    """Group {chat_id: record} by stats partition index (a stable hash of the chat id)."""
+    partitions = {}
+    for chat_id, record in records.items():
+        partitions.setdefault(zlib.crc32(chat_id.encode("utf-8")) % STATS_PARTITIONS, {})[chat_id] = record
+    return partitions
+
+
+def _stats_writes(user_id, records):
+    """Merge writes of chat stats records ({chat_id: record, or None when removed}).
+
+    Only the changed entries are merged into their partition documents, so
+    a save costs the same whatever the number of chats.
+    """
+    return [
+        ("set", _stats_partition_path(user_id, index), {"chats": {
+            chat_id: firestore.DELETE_FIELD if record is None else record for chat_id, record in entries.items()
+        }})
+        for index, entries in _partition_records(records).items()
+    ]
+
+
+def _record_chat_stats(user_id, records):
+    """Write-through of chat stats records: buffered partition writes plus the analytics cache."""
+    buffer = get_write_buffer()
+    for _, path, data in _stats_writes(user_id, records):
+        buffer.set(path, data, merge=True)
+    _cache_chat_stats(user_id, records)
+
+
+def _cache_chat_stats(user_id, records):
+    """Apply chat stats records to the cached analytics aggregates."""
+    cache = get_analytics_cache()
+    cache.remove_chats(user_id, [chat_id for chat_id, record in records.items() if record is None])
+    for chat_id, record in records.items():
+        if record is not None:
+            cache.update_chat(user_id, chat_id, record)
+
+
+def load_chat_stats(user_id):
+    """Stats records of all chats from the stats documents, or None if they are not complete.
+
+    One query returns the header and the partitions that hold records.
+    """
+    try:
+        stats_ref = get_db().collection("users").document(user_id).collection("stats")
+        docs = {doc.id: doc.to_dict() for doc in stats_ref.stream()}
+        header = docs.pop("chats", None)
+        if not header or not header.get("complete") or header.get("partitions") != STATS_PARTITIONS:
+            return None
+        records = {}
+        for data in docs.values():
+            records.update(data.get("chats", {}))
+        return records
+    except Exception as e:
+        print(f"Error loading chat stats: {e}")
+        return None
+
+
+def save_chat_stats(user_id, records):
+    """Replace every stats partition with records rebuilt from every chat, then mark them complete."""
+    buffer = get_write_buffer()
+    partitions = _partition_records(records)
+    for index in range(STATS_PARTITIONS):
+        if index in partitions:
+            buffer.set(_stats_partition_path(user_id, index), {"chats": partitions[index]}, merge=False)
+        else:
+            buffer.delete(_stats_partition_path(user_id, index))
+    buffer.set(_stats_path(user_id), {"complete": True, "partitions": STATS_PARTITIONS, "rebuilt_ms": now_ms()},
+               merge=False)
+
+
+def load_chat_list(user_id, page_size=CHAT_PAGE_SIZE, cursor=None, since=None):
+    """Load one page of chat metadata (no messages), newest first.
+
+    Args:
+        user_id: User's unique ID
+        page_size: Number of chats per page
+        cursor: Value returned by the previous call, or None for the first page
+        since: Only return chats saved after this epoch ms (delta sync);
+            all of them are returned, without paging
+
+    Returns:
+        tuple: ({chat_id: metadata}, next_cursor). next_cursor is None when
+        there are no more pages.
+    """
+    ensure_timestamps(user_id)
+    try:
+        query, page_size = _listing_query(get_db(), user_id, "chats", CHAT_LIST_FIELDS, page_size, cursor, since)
+        return _listing_page(list(query.stream()), page_size, dict)
+    except Exception as e:
+        print(f"Error loading chat list: {e}")
+        return {}, None
+
+
+def _listing_query(db, user_id, collection, fields, page_size, cursor, since):
+    """Build the query of a newest-first listing; works on sync and async clients.
+
+    Returns (query, page_size); page_size is None for unpaged delta queries.
+    """
+    # The document id breaks updated_ms ties, so a {"updated_ms", "__name__"}
+    # cursor (see backend/session_snapshots.py) resumes exactly like a snapshot
+    query = (
+        db.collection("users").document(user_id).collection(collection)
+        .select(fields)
+        .order_by("updated_ms", direction=firestore.Query.DESCENDING)
+        .order_by(DOCUMENT_ID, direction=firestore.Query.DESCENDING)
+    )
+    if since is not None:
+        query = query.where(filter=firestore.FieldFilter("updated_ms", ">", to_ms(since)))
+        page_size = None
+    else:
+        query = query.limit(page_size)
+    if cursor is not None:
+        query = query.start_after(cursor)
+    return query, page_size
+
+
+def _listing_page(snapshots, page_size, convert):
+    """({id: convert(data)}, next_cursor) of one listing page."""
+    items = {snapshot.id: convert(snapshot.to_dict()) for snapshot in snapshots}
+    next_cursor = snapshots[-1] if page_size and len(snapshots) == page_size else None
+    return items, next_cursor
+
+
+def load_chat_messages(user_id, session_id):
+    """Fetch the messages of a single chat, streaming its shards in order."""
+    db = get_db()
+    try:
+        journal = get_write_journal()
+        pending = journal.pending(_chat_path(user_id, session_id)) if journal is not None else None
+        if pending is not None:
+            return pending["messages"]  # saved locally, not yet replayed
+        chat_ref = db.document(_chat_path(user_id, session_id))
+        snapshot = chat_ref.get()
+        if not snapshot.exists:
+            return []
+        return _read_messages(chat_ref, snapshot.to_dict())
+    except Exception as e:
+        print(f"Error loading chat messages: {e}")
+        return []
+
+
 def delete_chat_from_firestore(user_id, session_id):
-    """Delete a chat from Firestore."""
+    """Delete a chat, its shards and blobs from Firestore.
+
+    Unreplayed journal entries of the chat are dropped, and the deletes go
+    through the write buffer so they supersede any save still queued.
+    """
+    chat_path = _chat_path(user_id, session_id)
+    _discard_journaled([chat_path])
+    chat_ref = get_db().document(chat_path)
+    buffer = get_write_buffer()
+    for subcollection in CHAT_SUBCOLLECTIONS:
+        for ref in chat_ref.collection(subcollection).list_documents():
+            buffer.delete(ref.path)
+    buffer.delete(chat_path)
+    get_user_data_cache().remove_chat(user_id, session_id)
+    _record_chat_stats(user_id, {session_id: None})
+
+
+def link_chat_files(user_id, session_id, file_names):
+    """Record Gemini files uploaded in a chat, so deleting it can remove them."""
+    if file_names:
+        get_write_buffer().set(_chat_path(user_id, session_id), {
+            "gemini_files": {name.rsplit("/", 1)[-1]: name for name in file_names}
+        }, merge=True)
+
+
+def list_chat_ids(user_id, before=None):
+    """Ids of all chats, or of those last saved before `before` (epoch ms or datetime).
+
+    Archived chats are included.
+    """
+    ensure_timestamps(user_id)
+    user_ref = get_db().collection("users").document(user_id)
+    chat_ids = []
+    for collection in ("chats", "archived_chats"):
+        query = user_ref.collection(collection).select(["updated_ms"])
+        if before is not None:
+            query = query.where(filter=firestore.FieldFilter("updated_ms", "<", to_ms(before)))
+        chat_ids.extend(chat.id for chat in query.stream() if chat.id not in chat_ids)
+    return chat_ids
+
+
+def delete_chats(user_id, chat_ids, progress=None):
+    """Delete many chats with their shards and blobs using batched writes.
+
+    Unreplayed journal entries of the chats are dropped and the user's
+    buffered writes flushed first, so a queued save cannot recreate a
+    deleted chat.
+
+    Args:
+        user_id: User's unique ID
+        chat_ids: Chats to delete
+        progress: Optional callback(done, total), called after each chunk
+
+    Returns:
+        list: Names of Gemini files linked to the deleted chats
+    """
+    db = get_db()
+    chat_ids = list(chat_ids)
+    _discard_journaled([_chat_path(user_id, chat_id) for chat_id in chat_ids])
+    get_write_buffer().flush(timeout=10, prefix=f"users/{user_id}/")
+    file_names = []
+    for start in range(0, len(chat_ids), DELETE_CHUNK):
+        chunk = chat_ids[start:start + DELETE_CHUNK]
+        chat_paths = [_chat_path(user_id, chat_id) for chat_id in chunk]
+        linked, subdocuments = _chats_to_delete(chat_paths)
+        for chat_data in linked.values():
+            file_names.extend(((chat_data or {}).get("gemini_files") or {}).values())
+        # Shards and blobs go first, so a failure never leaves them without their chat
+        commit_in_batches([("delete", path, None) for paths in subdocuments.values() for path in paths], ordered=False)
+        commit_in_batches([("delete", path, None) for path in chat_paths])
+        for chat_id in chunk:
+            get_user_data_cache().remove_chat(user_id, chat_id)
+        _record_chat_stats(user_id, dict.fromkeys(chunk))
+        file_names.extend(_delete_archived_chats(user_id, chunk))
+        if progress:
+            progress(start + len(chunk), len(chat_ids))
+    return file_names
+
+
+def _chats_to_delete(chat_paths):
+    """({chat_path: gemini_files data}, {subcollection path: [document paths]}).
+
+    On the async path the lookup and all subcollection listings run concurrently.
+    """
+    subcollections = [f"{path}/{name}" for path in chat_paths for name in CHAT_SUBCOLLECTIONS]
+    if async_firestore.enabled():
+        return async_firestore.get_background_loop().gather(
+            async_firestore.get_documents(chat_paths, field_paths=["gemini_files"]),
+            async_firestore.list_documents(subcollections),
+        )
+    db = get_db()
+    refs = [db.document(path) for path in chat_paths]
+    linked = {snapshot.reference.path: snapshot.to_dict() for snapshot in db.get_all(refs, field_paths=["gemini_files"])}
+    return linked, {path: [ref.path for ref in db.collection(path).list_documents()] for path in subcollections}
+
+
+def _archived_path(user_id, chat_id):
+    return f"users/{user_id}/archived_chats/{chat_id}"
+
+
+def _archive_path(user_id, archive_id):
+    return f"users/{user_id}/archives/{archive_id}"
+
+
+def _archive_writes(user_id, chats):
+    """Plan archive documents and index entries for {chat_id: chat}.
+
+    Returns (writes, archived_ids); chats too large to archive are left out.
+    """
+    archives, too_large = pack_chats(chats)
+    for chat_id in too_large:
+        print(f"Chat {chat_id} is too large to archive; keeping it hot")
+    writes, archived_ids = [], []
+    archived_ms = now_ms()
+    archives_ref = get_db().collection("users").document(user_id).collection("archives")
+    for chat_ids, data, raw_bytes in archives:
+        archive_ref = archives_ref.document()
+        archive_id = archive_ref.id
+        writes.append(("replace", archive_ref.path, {
+            "chat_ids": chat_ids, "chat_count": len(chat_ids), "raw_bytes": raw_bytes,
+            "archived_ms": archived_ms, "data": data,
+        }))
+        for chat_id in chat_ids:
+            entry = {field: chats[chat_id].get(field) for field in INDEX_FIELDS}
+            entry.update(chat_counters(chats[chat_id]["messages"]))
+            writes.append(("replace", _archived_path(user_id, chat_id), {**entry, "archive_id": archive_id}))
+        archived_ids.extend(chat_ids)
+    return writes, archived_ids
+
+
+def archive_inactive_chats(user_id, days=None):
+    """Move chats last saved more than `days` days ago into the cold archive.
+
+    Archives and index entries are committed before the hot documents are
+    deleted, so an interruption leaves a chat in both places, never in none.
+    Archived chats keep their stats records, so analytics totals do not
+    change. See backend/chat_archive.py for the layout.
+
+    Returns:
+        int: Number of chats archived
+    """
+    days = days if days is not None else int(get_setting("archive_after_days", ARCHIVE_AFTER_DAYS))
+    cutoff = now_ms() - days * DAY_MS
+    ensure_timestamps(user_id)
+    db = get_db()
+    flush_pending_writes()
+    journal = get_write_journal()
+    chats_ref = db.collection("users").document(user_id).collection("chats")
+    query = chats_ref.where(filter=firestore.FieldFilter("updated_ms", "<", cutoff)).order_by("updated_ms")
+    archived = 0
+    group, group_refs, group_bytes = {}, {}, 0
+
+    def archive_group():
+        writes, archived_ids = _archive_writes(user_id, group)
+        for chat_id in archived_ids:
+            chat_ref = group_refs[chat_id]
+            for subcollection in CHAT_SUBCOLLECTIONS:
+                writes.extend(("delete", ref.path, None) for ref in chat_ref.collection(subcollection).list_documents())
+            writes.append(("delete", chat_ref.path, None))
+        commit_in_batches(writes)
+        for chat_id in archived_ids:
+            get_user_data_cache().remove_chat(user_id, chat_id)
+        return len(archived_ids)
+
+    try:
+        for chat in query.stream():
+            if journal is not None and journal.pending(chat.reference.path) is not None:
+                continue  # saved again meanwhile
+            chat_data = chat.to_dict()
+            messages = _read_messages(chat.reference, chat_data)
+            group[chat.id] = {
+                "title": chat_data.get("title", "Untitled"),
+                "persona": chat_data.get("persona"),
+                "message_count": len(messages),
+                "updated_ms": chat_data.get("updated_ms"),
+                "gemini_files": chat_data.get("gemini_files") or {},
+                "messages": messages,
+            }
+            group_refs[chat.id] = chat.reference
+            group_bytes += sum(len(str(message.get("content", ""))) for message in messages)
+            if group_bytes >= ARCHIVE_RAW_BYTES:
+                archived += archive_group()
+                group, group_refs, group_bytes = {}, {}, 0
+        if group:
+            archived += archive_group()
+    except Exception as e:
+        print(f"Error archiving chats: {e}")
+    return archived
+
+
+def load_archived_chat_list(user_id):
+    """Return {chat_id: metadata} from the archive index, newest first."""
+    try:
+        query = (
+            get_db().collection("users").document(user_id).collection("archived_chats")
+            .order_by("updated_ms", direction=firestore.Query.DESCENDING)
+        )
+        return {entry.id: entry.to_dict() for entry in query.stream()}
+    except Exception as e:
+        print(f"Error loading archived chats: {e}")
+        return {}
+
+
+def load_archived_chat_stats(user_id):
+    """Stats records {chat_id: record} of archived chats, from the archive index.
+
+    Entries archived before the index carried counters are counted from
+    their archives, and the counters are written back (buffered). Returns
+    None on errors, so a rebuild does not store records without them.
+    """
+    try:
+        entries = get_db().collection("users").document(user_id).collection("archived_chats").stream()
+        records, uncounted = {}, {}
+        for entry in entries:
+            data = entry.to_dict()
+            if all(data.get(field) is not None for field in CHAT_COUNTER_FIELDS):
+                records[entry.id] = chat_record(data)
+            else:
+                uncounted.setdefault(data["archive_id"], []).append(entry.id)
+        for archive_id, chat_ids in uncounted.items():
+            chats = _load_archive(user_id, archive_id)
+            for chat_id in chat_ids:
+                if chat_id in chats:
+                    records[chat_id] = chat_record(chats[chat_id])
+                    get_write_buffer().set(_archived_path(user_id, chat_id),
+                                           chat_counters(chats[chat_id]["messages"]), merge=True)
+        return records
+    except Exception as e:
+        print(f"Error loading archived chat stats: {e}")
+        return None
+
+
+def _load_archive(user_id, archive_id):
+    snapshot = get_db().document(_archive_path(user_id, archive_id)).get()
+    return unpack_chats(snapshot.to_dict()["data"]) if snapshot.exists else {}
+
+
+def search_archived_chats(user_id, text):
+    """Return {chat_id: metadata} of archived chats whose title or messages contain `text`."""
+    db = get_db()
+    matches = {}
+    try:
+        archives = db.collection("users").document(user_id).collection("archives").stream()
+        for archive in archives:
+            for chat_id, chat in unpack_chats(archive.to_dict()["data"]).items():
+                if chat_id not in matches and chat_matches(chat, text):
+                    matches[chat_id] = {field: chat.get(field) for field in INDEX_FIELDS}
+    except Exception as e:
+        print(f"Error searching archived chats: {e}")
+    return matches
+
+
+def _remove_from_archives(user_id, entries):
+    """Writes that drop archived chats from their archives and the index.
+
+    `entries` maps chat_id -> archive_id. Returns (writes, {chat_id: chat}).
+    """
+    by_archive = {}
+    for chat_id, archive_id in entries.items():
+        by_archive.setdefault(archive_id, []).append(chat_id)
+    writes, removed = [], {}
+    for archive_id, chat_ids in by_archive.items():
+        chats = _load_archive(user_id, archive_id)
+        for chat_id in chat_ids:
+            if chat_id in chats:
+                removed[chat_id] = chats.pop(chat_id)
+            writes.append(("delete", _archived_path(user_id, chat_id), None))
+        if chats:
+            archives, _ = pack_chats(chats)
+            (remaining_ids, data, raw_bytes), = archives
+            writes.append(("set", _archive_path(user_id, archive_id), {
+                "chat_ids": remaining_ids, "chat_count": len(remaining_ids), "raw_bytes": raw_bytes, "data": data,
+            }))
+        else:
+            writes.append(("delete", _archive_path(user_id, archive_id), None))
+    return writes, removed
+
+
+def restore_archived_chat(user_id, chat_id):
+    """Move an archived chat back into users/{id}/chats.
+
+    Returns:
+        (metadata, messages), or None if the chat is not archived
+    """
     db = get_db()
-    db.collection("users").document(user_id).collection("chats").document(session_id).delete()
+    try:
+        entry = db.document(_archived_path(user_id, chat_id)).get()
+        if not entry.exists:
+            return None
+        writes, removed = _remove_from_archives(user_id, {chat_id: entry.to_dict()["archive_id"]})
+        chat = removed.get(chat_id)
+        chat_path = _chat_path(user_id, chat_id)
+        hot = db.document(chat_path).get(field_paths=CHAT_LIST_FIELDS)
+        if chat is None or hot.exists:
+            commit_in_batches(writes)  # dangling entry, or left over from an interrupted archive run
+            return (hot.to_dict(), load_chat_messages(user_id, chat_id)) if hot.exists else None
+        chat_writes, chat_data = _chat_writes(user_id, chat_id, chat["messages"], chat["title"],
+                                              chat.get("persona"), now_ms())
+        if chat.get("gemini_files"):
+            chat_data["gemini_files"] = chat["gemini_files"]
+        # The chat is written before it leaves the archive
+        commit_in_batches(chat_writes + writes)
+        metadata = {k: v for k, v in chat_data.items() if k in CHAT_LIST_FIELDS}
+        get_user_data_cache().update_chat(user_id, chat_id, metadata)
+        _cache_chat_stats(user_id, {chat_id: chat_record(chat_data)})
+        return metadata, chat["messages"]
+    except Exception as e:
+        print(f"Error restoring archived chat: {e}")
+        return None
+
+
+def _delete_archived_chats(user_id, chat_ids):
+    """Remove archived chats among `chat_ids`; returns their Gemini file names."""
+    db = get_db()
+    refs = [db.document(_archived_path(user_id, chat_id)) for chat_id in chat_ids]
+    entries = {entry.id: entry.to_dict()["archive_id"] for entry in db.get_all(refs, field_paths=["archive_id"])
+               if entry.exists}
+    if not entries:
+        return []
+    writes, removed = _remove_from_archives(user_id, entries)
+    commit_in_batches(writes)
+    return [name for chat in removed.values() for name in (chat.get("gemini_files") or {}).values()]
+
+
+def _flashcard_path(user_id, set_id):
+    return f"users/{user_id}/flashcards/{set_id}"
+
+
+def _flashcard_writes(set_path, cards, title, updated_ms, previous_chunks=0, created_ms=None,
+                      server_time=True):
+    """Plan the (op, path, data) writes that store a flashcard set.
+
+    The set document embeds the first CARDS_PER_DOC cards; larger decks
+    continue in chunks/{n} documents. Chunks left over from a previously
+    larger deck are deleted. With server_time=False the datetime fields are
+    derived from the ms values instead of the server clock (imports).
+    """
+    chunks = [cards[i:i + CARDS_PER_DOC] for i in range(0, len(cards), CARDS_PER_DOC)] or [[]]
+    set_data = {
+        'title': title,
+        'cards': chunks[0],
+        'card_count': len(cards),
+        'chunk_count': len(chunks),
+        'updated_ms': updated_ms,
+        'updated_at': firestore.SERVER_TIMESTAMP if server_time else utc_datetime(updated_ms),
+    }
+    if created_ms is not None:
+        set_data['created_ms'] = created_ms
+        set_data['created_at'] = firestore.SERVER_TIMESTAMP if server_time else utc_datetime(created_ms)
+    writes = [("set", set_path, set_data)]
+    for index, chunk in enumerate(chunks[1:], 1):
+        writes.append(("replace", f"{set_path}/chunks/{shard_id(index)}", {"index": index, "cards": chunk}))
+    for index in range(len(chunks), previous_chunks):
+        writes.append(("delete", f"{set_path}/chunks/{shard_id(index)}", None))
+    return writes
+
+
+def _read_cards(set_ref, set_data):
+    """All cards of a set: the embedded ones plus any overflow chunks."""
+    cards = list(set_data.get('cards', []))
+    chunk_count = set_data.get('chunk_count', 1)
+    _flashcard_chunks.put(set_ref.path, chunk_count)
+    if chunk_count > 1:
+        refs = [set_ref.collection("chunks").document(shard_id(index)) for index in range(1, chunk_count)]
+        chunks = [chunk.to_dict() for chunk in get_db().get_all(refs) if chunk.exists]
+        for chunk in sorted(chunks, key=lambda chunk: chunk["index"]):
+            cards.extend(chunk.get("cards", []))
+    return cards
 
 
 def save_flashcards_to_firestore(user_id, session_id, flashcards, title):
-    """Save flashcard set to Firestore - WITH DEBUG OUTPUT."""
+    """Save a flashcard set in one or two round trips, whatever its size.
+
+    A single batched commit writes the set document and any overflow chunks
+    atomically. It is preceded by a read of the stored chunk count unless
+    this process already knows it. Cards are embedded in the set document
+    rather than stored one per document, which costs one document write and
+    read per deck instead of one per card; see
+    `python -m backend.benchmarks flashcards` for the measured costs.
+    """
     db = get_db()
     try:
-        flashcard_ref = db.collection("users").document(user_id).collection("flashcards").document(session_id)
-    
-        # Create the document data
-        flashcard_data = {
+        set_path = _flashcard_path(user_id, session_id)
+        now = now_ms()
+        previous_chunks = _flashcard_chunks.get(set_path)
+        if previous_chunks is None:
+            previous = db.document(set_path).get(field_paths=["chunk_count"])
+            previous_chunks = (previous.to_dict() or {}).get("chunk_count", 1) if previous.exists else 0
+        writes = _flashcard_writes(
+            set_path, flashcards, title, now, previous_chunks,
+            created_ms=now if previous_chunks == 0 else None,
+        )
+        commit_in_batches(writes)
+        _flashcard_chunks.put(set_path, writes[0][2]['chunk_count'])
+        get_user_data_cache().update_flashcard_set(user_id, session_id, {
             'title': title,
-            'cards': flashcards,  # This MUST be the full list of dictionaries
-            'card_count': len(flashcards) if isinstance(flashcards, list) else 0,
-            'updated_at': datetime.datetime.now(),
-            'created_at': datetime.datetime.now()
-        }
-    
-        # Save to Firestore
-        flashcard_ref.set(flashcard_data, merge=True)
-        
-        print(f"  Success!")
-        print("=" * 60)
-        
+            'card_count': len(flashcards),
+            'updated_ms': now
+        })
         return True
-    
+
     except Exception as e:
         print(f"ERROR saving flashcards: {str(e)}")
         import traceback
@@ -85,13 +926,20 @@ def save_flashcards_to_firestore(user_id, session_id, flashcards, title):
         return False
 
 
-def load_user_flashcards(user_id):
-    """Load all flashcard sets for a user from Firestore - WITH DEBUG OUTPUT."""
+def load_user_flashcards(user_id, since=None):
+    """Load flashcard sets for a user from Firestore.
+
+    With `since` (epoch ms), only sets updated after it are returned.
+    """
+    ensure_timestamps(user_id)
     db = get_db()
     try:
         
         flashcards_ref = db.collection("users").document(user_id).collection("flashcards")
-        flashcard_sets = flashcards_ref.order_by("updated_at", direction=firestore.Query.DESCENDING).stream()
+        query = flashcards_ref.order_by("updated_ms", direction=firestore.Query.DESCENDING)
+        if since is not None:
+            query = query.where(filter=firestore.FieldFilter("updated_ms", ">", to_ms(since)))
+        flashcard_sets = query.stream()
         
         user_flashcards = {}
         for flashcard_set in flashcard_sets:
@@ -99,8 +947,8 @@ def load_user_flashcards(user_id):
             
             user_flashcards[flashcard_set.id] = {
                 'title': flashcard_data.get('title', 'Untitled Flashcards'),
-                'cards': flashcard_data.get('cards', []),
-                'timestamp': flashcard_data.get('updated_at', __import__('datetime').datetime.now())
+                'cards': _read_cards(flashcard_set.reference, flashcard_data),
+                'updated_ms': flashcard_data.get('updated_ms', 0)
             }
         
         return user_flashcards
@@ -112,11 +960,55 @@ def load_user_flashcards(user_id):
         return {}
 
 
+def load_flashcard_list(user_id, page_size=FLASHCARD_PAGE_SIZE, cursor=None, since=None):
+    """Load one page of flashcard set metadata (no cards), newest first.
+
+    Works like load_chat_list: `cursor` is the value returned for the
+    previous page, and `since` returns every set updated after it, unpaged.
+    """
+    ensure_timestamps(user_id)
+    try:
+        query, page_size = _listing_query(
+            get_db(), user_id, "flashcards", FLASHCARD_LIST_FIELDS, page_size, cursor, since
+        )
+        return _listing_page(list(query.stream()), page_size, _flashcard_metadata)
+    except Exception as e:
+        print(f"Error loading flashcard list: {e}")
+        return {}, None
+
+
+def _flashcard_metadata(set_data):
+    return {
+        'title': set_data.get('title', 'Untitled Flashcards'),
+        'card_count': set_data.get('card_count', 0),
+        'updated_ms': set_data.get('updated_ms', 0),
+    }
+
+
+def load_flashcard_cards(user_id, session_id):
+    """Fetch the cards of one flashcard set."""
+    db = get_db()
+    try:
+        set_ref = db.document(_flashcard_path(user_id, session_id))
+        snapshot = set_ref.get()
+        if not snapshot.exists:
+            return []
+        return _read_cards(set_ref, snapshot.to_dict())
+    except Exception as e:
+        print(f"Error loading flashcards: {e}")
+        return []
+
+
 def delete_flashcards_from_firestore(user_id, session_id):
-    """Delete a flashcard set from Firestore."""
+    """Delete a flashcard set and its overflow chunks in one batch."""
     db = get_db()
     try:
-        db.collection("users").document(user_id).collection("flashcards").document(session_id).delete()
+        set_ref = db.document(_flashcard_path(user_id, session_id))
+        writes = [("delete", ref.path, None) for ref in set_ref.collection("chunks").list_documents()]
+        writes.append(("delete", set_ref.path, None))
+        commit_in_batches(writes)
+        _flashcard_chunks.pop(set_ref.path)
+        get_user_data_cache().remove_flashcard_set(user_id, session_id)
         return True
     except Exception as e:
         print(f"Error deleting flashcards: {str(e)}")
@@ -129,11 +1021,15 @@ def save_persona_to_firestore(user_id, persona_name, persona_instructions):
         persona_data = {
             'name': persona_name,
             'instructions': persona_instructions,
-            'created_at': __import__('datetime').datetime.now(),
-            'updated_at': __import__('datetime').datetime.now()
+            'created_ms': now_ms(),
+            'created_at': firestore.SERVER_TIMESTAMP,
+            'updated_ms': now_ms(),
+            'updated_at': firestore.SERVER_TIMESTAMP
         }
         
         persona_ref.set(persona_data, merge=True)
+        get_user_data_cache().update_persona(user_id, persona_name, persona_instructions)
+        get_persona_registry().update(user_id, persona_name, persona_instructions)
         return True
         
     except Exception as e:
@@ -143,41 +1039,50 @@ def save_persona_to_firestore(user_id, persona_name, persona_instructions):
         return False
 
 
-def load_user_personas(user_id):
+def load_user_personas(user_id, since=None):
     """Load all custom personas for a user from Firestore.
     
     Args:
         user_id: User's unique ID
+        since: Only return personas updated after this epoch ms
     
     Returns:
         dict: Dictionary of {persona_name: persona_instructions}
     """
     db = get_db()
     try:
-        print(f"Loading personas for user {user_id}")
-        
-        personas_ref = db.collection("users").document(user_id).collection("personas")
-        personas = personas_ref.stream()
-        
-        user_personas = {}
-        for persona in personas:
-            persona_data = persona.to_dict()
-            persona_name = persona_data.get('name', persona.id)
-            persona_instructions = persona_data.get('instructions', '')
-            user_personas[persona_name] = persona_instructions
-
-        return user_personas
+        return _personas_by_name(_personas_query(db, user_id, since).stream())
         
     except Exception as e:
         print(f"Error loading personas: {str(e)}")
         return {}
 
 
+def _personas_query(db, user_id, since=None):
+    """Query of load_user_personas; works on sync and async clients."""
+    personas_ref = db.collection("users").document(user_id).collection("personas")
+    if since is not None:
+        return personas_ref.where(filter=firestore.FieldFilter("updated_ms", ">", to_ms(since)))
+    return personas_ref
+
+
+def _personas_by_name(snapshots):
+    user_personas = {}
+    for persona in snapshots:
+        persona_data = persona.to_dict()
+        persona_name = persona_data.get('name', persona.id)
+        persona_instructions = persona_data.get('instructions', '')
+        user_personas[persona_name] = persona_instructions
+    return user_personas
+
+
 def delete_persona_from_firestore(user_id, persona_name):
     """Delete a custom persona from Firestore."""
     db = get_db()
     try:
         db.collection("users").document(user_id).collection("personas").document(persona_name).delete()
+        get_user_data_cache().remove_persona(user_id, persona_name)
+        get_persona_registry().remove(user_id, persona_name)
         return True
         
     except Exception as e:
@@ -194,11 +1099,95 @@ def update_persona_in_firestore(user_id, persona_name, persona_instructions):
         persona_ref = db.collection("users").document(user_id).collection("personas").document(persona_name)
         persona_ref.update({
             'instructions': persona_instructions,
-            'updated_at': __import__('datetime').datetime.now()
+            'updated_ms': now_ms(),
+            'updated_at': firestore.SERVER_TIMESTAMP
         })
+        get_user_data_cache().update_persona(user_id, persona_name, persona_instructions)
+        get_persona_registry().update(user_id, persona_name, persona_instructions)
 
         return True
         
     except Exception as e:
         print(f"Error updating persona: {str(e)}")
-        return save_persona_to_firestore(user_id, persona_name, persona_instructions)
\ No newline at end of file
+        return save_persona_to_firestore(user_id, persona_name, persona_instructions)
+
+
+def export_user_data(user_id):
+    """Read everything stored for a user (see StorageBackend.export_user)."""
+    db = get_db()
+    flush_pending_writes()
+    user_ref = db.collection("users").document(user_id)
+    profile = user_ref.get()
+    chats = {}
+    for chat in user_ref.collection("chats").stream():
+        chat_data = chat.to_dict()
+        chats[chat.id] = {
+            "title": chat_data.get("title", "Untitled"),
+            "persona": chat_data.get("persona"),
+            "messages": _read_messages(chat.reference, chat_data),
+            "updated_ms": chat_data.get("updated_ms") or to_ms(chat_data.get("timestamp")),
+        }
+    for archive in user_ref.collection("archives").stream():
+        for chat_id, chat in unpack_chats(archive.to_dict()["data"]).items():
+            chats.setdefault(chat_id, {field: chat.get(field) for field in ("title", "persona", "messages", "updated_ms")})
+    flashcards = {}
+    for flashcard_set in user_ref.collection("flashcards").stream():
+        set_data = flashcard_set.to_dict()
+        flashcards[flashcard_set.id] = {
+            "title": set_data.get("title", "Untitled Flashcards"),
+            "cards": _read_cards(flashcard_set.reference, set_data),
+            "updated_ms": set_data.get("updated_ms") or to_ms(set_data.get("updated_at")),
+        }
+    personas = {}
+    for persona in user_ref.collection("personas").stream():
+        persona_data = persona.to_dict()
+        personas[persona_data.get("name", persona.id)] = {
+            "instructions": persona_data.get("instructions", ""),
+            "updated_ms": persona_data.get("updated_ms") or to_ms(persona_data.get("updated_at")),
+        }
+    return {
+        "profile": profile.to_dict() if profile.exists else None,
+        "chats": chats,
+        "flashcards": flashcards,
+        "personas": personas,
+    }
+
+
+def import_user_data(user_id, data):
+    """Write an exported user into Firestore using batched writes."""
+    now = now_ms()
+    writes = []
+    if data.get("profile"):
+        writes.append(("set", f"users/{user_id}", data["profile"]))
+    for chat_id, chat in data.get("chats", {}).items():
+        chat_path = _chat_path(user_id, chat_id)
+        shard_writes, hashes, shard_blobs = build_chat_writes(chat_path, chat["messages"])
+        writes.extend(shard_writes)
+        updated_ms = chat.get("updated_ms") or now
+        writes.append(("replace", chat_path, _chat_document(
+            len(chat["messages"]), chat["title"], chat.get("persona"), hashes,
+            count_shards(chat["messages"], hashes), updated_ms, utc_datetime(updated_ms), shard_blobs,
+        )))
+    for set_id, flashcard_set in data.get("flashcards", {}).items():
+        updated_ms = flashcard_set.get("updated_ms") or now
+        (_, set_path, set_data), *chunk_writes = _flashcard_writes(
+            _flashcard_path(user_id, set_id), flashcard_set["cards"], flashcard_set["title"],
+            updated_ms, created_ms=updated_ms, server_time=False,
+        )
+        writes.append(("replace", set_path, set_data))
+        writes.extend(chunk_writes)
+    for name, persona in data.get("personas", {}).items():
+        updated_ms = persona.get("updated_ms") or now
+        writes.append(("replace", f"users/{user_id}/personas/{name}", {
+            "name": name,
+            "instructions": persona["instructions"],
+            "created_ms": updated_ms,
+            "created_at": utc_datetime(updated_ms),
+            "updated_ms": updated_ms,
+            "updated_at": utc_datetime(updated_ms),
+        }))
+    writes.append(("delete", _stats_path(user_id), None))  # rebuilt on the next analytics load
+    commit_in_batches(writes, ordered=False)
+    get_user_data_cache().invalidate(user_id)
+    get_persona_registry().invalidate(user_id)
+    get_analytics_cache().invalidate(user_id)
@@ -103,7 +103,10 @@ Return ONLY the JSON array, nothing else."""
 
 
 def save_flashcard_set(user_id, flashcard_set):
-    """Save a complete set of flashcards to Firestore.
+    """Save a complete set of flashcards through the configured storage backend.
+
+    Uses the same layout as sets saved from the flashcard page, so the set
+    shows up in the user's flashcard list.
     
     Args:
         user_id: The user's ID
@@ -116,26 +119,12 @@ def save_flashcard_set(user_id, flashcard_set):
                 'created_at': str (ISO format datetime)
             }
     """
-    from backend.firebase_service import get_db
-    import datetime
+    from backend.storage_service import get_storage
     
-    db = get_db()
     set_id = flashcard_set.get('set_id') or str(__import__('uuid').uuid4())
-    
-    # Save the set metadata
-    db.collection("users").document(user_id).collection("flashcard_sets").document(set_id).set({
-        "set_id": set_id,
-        "title": flashcard_set.get('title', 'Untitled Set'),
-        "topic": flashcard_set.get('topic', ''),
-        "card_count": len(flashcard_set.get('flashcards', [])),
-        "created_at": flashcard_set.get('created_at', datetime.datetime.now().isoformat()),
-        "updated_at": datetime.datetime.now().isoformat()
-    }, merge=True)
-    
-    # Save individual flashcards
-    for flashcard in flashcard_set.get('flashcards', []):
-        card_id = flashcard.get('id') or str(__import__('uuid').uuid4())
-        flashcard['set_id'] = set_id  # Link to the set
-        db.collection("users").document(user_id).collection("flashcards").document(card_id).set(
-            flashcard, merge=True
-        )
\ No newline at end of file
+    return get_storage().save_flashcard_set(
+        user_id,
+        set_id,
+        flashcard_set.get('flashcards', []),
+        flashcard_set.get('title', 'Untitled Set')
+    )
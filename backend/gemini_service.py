@@ -2,6 +2,13 @@
 import google.generativeai as genai
 import streamlit as st
 
+from backend.lru import LRUCache
+from backend.personas import instruction_hash
+
+MODEL_NAME = "gemini-2.5-flash"
+# Configured GenerativeModel objects kept for reuse, one per system instruction
+MODEL_POOL_SIZE = 64
+
 
 @st.cache_resource
 def get_gemini_client():
@@ -11,13 +18,31 @@ def get_gemini_client():
     return genai
 
 
-def get_response(question, client, uploaded_files=None, system_instruction=None):
+@st.cache_resource
+def _get_model_pool():
+    return LRUCache(MODEL_POOL_SIZE)
+
+
+def get_model(client, system_instruction=None, instruction_key=None):
+    """Pooled GenerativeModel for a system instruction.
+
+    instruction_key is the instruction's hash when the caller has it already
+    (see PersonaSet.instruction_key); otherwise it is computed here.
+    """
+    if instruction_key is None and system_instruction is not None:
+        instruction_key = instruction_hash(system_instruction)
+    pool = _get_model_pool()
+    model = pool.get((MODEL_NAME, instruction_key))
+    if model is None:
+        model = client.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
+        pool.put((MODEL_NAME, instruction_key), model)
+    return model
+
+
+def get_response(question, client, uploaded_files=None, system_instruction=None, instruction_key=None):
     """Get response from Gemini API."""
     try:
-        model = client.GenerativeModel(
-            "gemini-2.5-flash",
-            system_instruction=system_instruction
-        )
+        model = get_model(client, system_instruction, instruction_key)
         
         # Build content parts
         content_parts = []
@@ -35,17 +60,15 @@ def get_response(question, client, uploaded_files=None, system_instruction=None)
         return f"Error in Gemini API: {str(e)}"
 
 
-def get_response_streaming(question, client, uploaded_files=None, system_instruction=None, chat_history=None):
+def get_response_streaming(question, client, uploaded_files=None, system_instruction=None, chat_history=None,
+                           instruction_key=None):
     """Get streaming response from Gemini API - yields text chunks.
     
     Uses Gemini's multi-turn chat so the model sees the full conversation.
     chat_history should be a list of {"role": "user"|"assistant", "content": str}.
     """
     try:
-        model = client.GenerativeModel(
-            "gemini-2.5-flash",
-            system_instruction=system_instruction
-        )
+        model = get_model(client, system_instruction, instruction_key)
         
         # Convert chat history to Gemini format for multi-turn context
         gemini_history = []
@@ -97,3 +120,17 @@ def history_to_text(chat_history):
         role = "User" if msg["role"] == "user" else "Assistant"
         text += f"{role}: {msg['content']}\n"
     return text
+
+
+def delete_gemini_files(file_names):
+    """Delete uploaded Gemini files by name. Returns how many were deleted."""
+    client = get_gemini_client()
+    deleted = 0
+    for name in file_names:
+        try:
+            client.delete_file(name)
+            deleted += 1
+        except Exception as e:
+            # Files expire after 48 hours, so a missing file is expected
+            print(f"Could not delete Gemini file {name}: {e}")
+    return deleted
@@ -0,0 +1,211 @@
+"""Parallel hydration of a signed-in user's data from Firestore.
+
+Login and session restore need the chat list, flashcard sets and custom
+personas. The reads are independent, so they run concurrently and
+login-to-first-paint is bounded by the slowest query rather than the sum of
+all of them: on the shared async Firestore loop when the backend provides
+coroutine loaders (backend/async_firestore.py), otherwise on a thread pool.
+Identical loads that are already in flight for the same user (e.g. two tabs
+restoring at once) share one query.
+
+For remote backends, results go through the process-wide user data cache: a
+user seen recently is refreshed with delta queries instead of a full reload.
+Personas are not queried at all while the user's set in the persona registry
+(backend/personas.py) is live.
+
+A load that has not finished within HYDRATION_TIMEOUT_SECONDS is left out:
+the session starts with what did arrive (or the cached entry), the result
+lists it under 'incomplete', and nothing partial is cached.
+"""
+import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from backend import async_firestore, metrics
+from backend.personas import get_persona_registry
+from backend.storage_service import get_storage
+from backend.user_data_cache import UserDataCache, get_user_data_cache
+
+HYDRATION_TIMEOUT_SECONDS = 30
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hydrate")
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _timed(name, fn, args, ctx):
+    """Run one load on a pool thread. Returns (result, seconds)."""
+    add_script_run_ctx(threading.current_thread(), ctx)
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+    metrics.record_timing(f"hydration.{name}", elapsed)
+    return result, elapsed
+
+
+async def _timed_async(name, fn, args):
+    """Run one coroutine load on the background loop. Returns (result, seconds)."""
+    started = time.perf_counter()
+    result = await fn(*args)
+    elapsed = time.perf_counter() - started
+    metrics.record_timing(f"hydration.{name}", elapsed)
+    return result, elapsed
+
+
+def _submit(name, fn, *args):
+    """Submit a load, joining an identical one that is already running."""
+    key = (name, args)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            metrics.incr("hydration.deduplicated")
+            return future
+        if asyncio.iscoroutinefunction(fn):
+            future = async_firestore.get_background_loop().submit(_timed_async(name, fn, args))
+        else:
+            future = _executor.submit(_timed, name, fn, args, get_script_run_ctx())
+        _inflight[key] = future
+
+    def _done(_):
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+    future.add_done_callback(_done)
+    return future
+
+
+def hydrate_user(user: dict, save_profile: bool = False) -> dict:
+    """Load everything a signed-in user needs, concurrently.
+
+    Args:
+        user: User dict with at least 'user_id'
+        save_profile: Also write the user profile (OAuth login path)
+
+    Returns:
+        dict with 'chat_sessions', 'chat_list_cursor', 'flashcard_sets',
+        'flashcard_list_cursor', 'custom_personas', the sync 'watermark'
+        (epoch ms; see load_changes, None if incomplete), the names of the
+        loads that timed out ('incomplete') and per-load 'timings' in
+        seconds. Chats and flashcard sets carry listing metadata only.
+    """
+    user_id = user['user_id']
+    started = time.perf_counter()
+    storage = get_storage()  # initialize the backend once on the script thread
+
+    if save_profile:
+        storage.save_user(user)
+    storage.prepare_user(user_id)
+
+    cache = get_user_data_cache() if storage.remote else None
+    entry = cache.lookup(user_id) if cache else None
+    watermark = UserDataCache.new_watermark()
+    loaders = storage.hydration_loaders()
+    persona_set = get_persona_registry().lookup(user_id)
+    if entry is not None:
+        metrics.incr("hydration.delta_syncs")
+        since = entry["watermark"]
+        futures = {
+            "chats": _submit("chats_delta", loaders["chats"], user_id, None, None, since),
+            "flashcards": _submit("flashcards_delta", loaders["flashcards"], user_id, None, None, since),
+        }
+        if persona_set is None:
+            futures["personas"] = _submit("personas_delta", loaders["personas"], user_id, since)
+    else:
+        metrics.incr("hydration.full_loads")
+        futures = {
+            "chats": _submit("chats", loaders["chats"], user_id),
+            "flashcards": _submit("flashcards", loaders["flashcards"], user_id),
+        }
+        if persona_set is None:
+            futures["personas"] = _submit("personas", loaders["personas"], user_id)
+
+    results, timings = _collect(futures)
+    incomplete = [name for name in futures if name not in results]
+    chats, cursor = results.get("chats", ({}, None))
+    flashcards, flashcard_cursor = results.get("flashcards", ({}, None))
+    if persona_set is not None:
+        metrics.incr("hydration.persona_hits")
+        personas = dict(persona_set.custom)
+    else:
+        personas = results.get("personas", {})
+
+    data = None
+    if incomplete:
+        # Partial results must not replace cached data: keep serving the
+        # entry this refresh started from, if there was one.
+        watermark = None
+        if entry is not None:
+            data = cache.copy_entry(user_id)
+    elif cache is not None:
+        if entry is not None:
+            cache.apply_delta(user_id, chats, flashcards, personas, watermark)
+        else:
+            cache.store(user_id, chats, cursor, flashcards, personas, watermark, flashcard_cursor)
+        data = cache.copy_entry(user_id)
+    # Without the cache, deduplicated loads hand every caller the same result:
+    # copy it so one session's edits don't leak into another's state.
+    data = data or {
+        "chats": copy.deepcopy(chats), "chat_list_cursor": cursor,
+        "flashcards": copy.deepcopy(flashcards), "flashcard_list_cursor": flashcard_cursor,
+        "personas": dict(personas),
+    }
+    if persona_set is None and not incomplete:
+        get_persona_registry().store(user_id, data["personas"])
+    timings["total"] = time.perf_counter() - started
+    metrics.record_timing("hydration.total", timings["total"])
+
+    return {
+        "chat_sessions": data["chats"],
+        "chat_list_cursor": data["chat_list_cursor"],
+        "flashcard_sets": data["flashcards"],
+        "flashcard_list_cursor": data["flashcard_list_cursor"],
+        "custom_personas": data["personas"],
+        "watermark": watermark,
+        "incomplete": incomplete,
+        "timings": timings,
+    }
+
+
+def load_changes(user_id, since):
+    """Chats, flashcard sets and personas written after `since`, loaded concurrently.
+
+    Returns (chats, flashcards, personas, watermark); pass the watermark as
+    `since` next time. Personas are the user's full set when the persona
+    registry has a live one.
+    """
+    watermark = UserDataCache.new_watermark()
+    loaders = get_storage().hydration_loaders()
+    persona_set = get_persona_registry().lookup(user_id)
+    futures = {
+        "chats": _submit("chats_delta", loaders["chats"], user_id, None, None, since),
+        "flashcards": _submit("flashcards_delta", loaders["flashcards"], user_id, None, None, since),
+    }
+    if persona_set is None:
+        futures["personas"] = _submit("personas_delta", loaders["personas"], user_id, since)
+    results, _ = _collect(futures)
+    missing = [name for name in futures if name not in results]
+    if missing:
+        raise TimeoutError(f"Loading {', '.join(missing)} took longer than {HYDRATION_TIMEOUT_SECONDS}s")
+    personas = results["personas"] if persona_set is None else dict(persona_set.custom)
+    return results["chats"][0], results["flashcards"][0], personas, watermark
+
+
+def _collect(futures):
+    """Wait for {name: future} with one shared timeout.
+
+    Returns (results, timings); loads that timed out are missing from both.
+    """
+    timings = {}
+    results = {}
+    deadline = time.monotonic() + HYDRATION_TIMEOUT_SECONDS
+    for name, future in futures.items():
+        try:
+            results[name], timings[name] = future.result(max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            metrics.incr("hydration.timeouts")
+            print(f"Warning: loading {name} took longer than {HYDRATION_TIMEOUT_SECONDS}s, continuing without it")
+    return results, timings
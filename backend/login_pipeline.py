@@ -0,0 +1,139 @@
+"""Pipelined processing of the OAuth callback.
+
+Signing in used to run every step in sequence behind the "Signing you in…"
+animation. sign_in() overlaps them:
+
+    warm      Firestore, certificate and Gemini clients  ─┐ while the code
+    exchange  authorization code -> tokens (network)     ─┘ is exchanged
+    hydrate   chats, flashcards, personas, started from the token's subject
+              as soon as the exchange returns, concurrently with
+    verify    the ID token signature and claims (local, cached certs)
+    profile   user profile write, fire-and-forget
+
+Hydration results are discarded unless verification succeeds for the same
+user id. Every phase is timed (login.<phase> in backend/metrics.py) and the
+timings are returned for the session.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from google.auth import jwt
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from backend import metrics
+from backend.auth_service import exchange_code_for_token, get_cert_cache, verify_google_token
+from backend.hydration import hydrate_user
+from backend.storage_service import get_storage
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="login")
+
+
+def _in_thread(ctx, fn, *args):
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return fn(*args)
+
+
+def _submit(fn, *args):
+    return _executor.submit(_in_thread, get_script_run_ctx(), fn, *args)
+
+
+def _warm():
+    """Create the clients a fresh login needs, off the critical path. Returns seconds."""
+    from backend import async_firestore
+    from backend.gemini_service import get_gemini_client
+
+    def firestore_clients():
+        if get_storage().remote and async_firestore.enabled():  # get_storage() initializes the Firebase app
+            async_firestore.get_async_db()
+
+    started = time.perf_counter()
+    for warm_up in (firestore_clients, get_cert_cache().get, get_gemini_client):
+        try:
+            warm_up()
+        except Exception as e:
+            print(f"Error warming up clients for login: {e}")
+    elapsed = time.perf_counter() - started
+    metrics.record_timing("login.warm", elapsed)
+    return elapsed
+
+
+def _save_profile(user):
+    started = time.perf_counter()
+    try:
+        get_storage().save_user(user)
+    except Exception as e:
+        print(f"Error saving user profile: {e}")
+    metrics.record_timing("login.profile", time.perf_counter() - started)
+
+
+def user_from_claims(user_info):
+    """App user dict from verified ID token claims."""
+    return {
+        'user_id': user_info.get('sub', user_info.get('email')),
+        'email': user_info.get('email'),
+        'name': user_info.get('name', ''),
+        'picture': user_info.get('picture', ''),
+        'email_verified': user_info.get('email_verified', False)
+    }
+
+
+def sign_in(code):
+    """Exchange an authorization code and load the user's data.
+
+    Returns:
+        dict with 'user' and 'data' (a hydrate_user result), both None on
+        failure, 'error' ("exchange" or "verify") and per-phase 'timings'
+        in seconds.
+    """
+    started = time.perf_counter()
+    timings = {}
+
+    def phase(name, since):
+        timings[name] = time.perf_counter() - since
+        metrics.record_timing(f"login.{name}", timings[name])
+
+    warm = _submit(_warm)
+    try:
+        token_response = exchange_code_for_token(code)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Error exchanging authorization code: {e}")
+        token_response = None
+    phase("exchange", started)
+    id_token_str = (token_response or {}).get('id_token')
+    if not id_token_str:
+        metrics.incr("login.failures")
+        return {"user": None, "data": None, "error": "exchange", "timings": timings}
+
+    # The token comes straight from Google's token endpoint, so start loading
+    # for its subject now; nothing is shown until the signature checks out.
+    hydration = None
+    claims = {}
+    hydrate_started = time.perf_counter()
+    try:
+        claims = jwt.decode(id_token_str, verify=False)
+        hydration = _submit(hydrate_user, {'user_id': claims.get('sub', claims.get('email'))})
+    except ValueError:
+        pass
+
+    verify_started = time.perf_counter()
+    user_info = verify_google_token(id_token_str)
+    phase("verify", verify_started)
+    if not user_info:
+        metrics.incr("login.failures")
+        return {"user": None, "data": None, "error": "verify", "timings": timings}
+
+    user = user_from_claims(user_info)
+    _submit(_save_profile, user)  # buffered for Firestore; nobody waits for it
+
+    if hydration is None or claims.get('sub', claims.get('email')) != user['user_id']:
+        hydrate_started = time.perf_counter()
+        hydration = _submit(hydrate_user, user)
+    data = hydration.result()
+    phase("hydrate", hydrate_started)
+    if warm.done():
+        timings["warm"] = warm.result()
+    timings["total"] = time.perf_counter() - started
+    metrics.record_timing("login.total", timings["total"])
+    return {"user": user, "data": data, "error": None, "timings": timings}
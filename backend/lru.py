@@ -0,0 +1,99 @@
+"""Small thread-safe LRU cache used for bounded in-memory caches."""
+import threading
+from collections import OrderedDict
+
+
+def estimate_size(value) -> int:
+    """Rough in-memory footprint of plain data (dicts, lists, strings, scalars)."""
+    if isinstance(value, (str, bytes)):
+        return 49 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(estimate_size(v) for v in value)
+    return 32
+
+
+class LRUCache:
+    """Mapping with a maximum entry count; least recently used entries go first.
+
+    Args:
+        max_entries: Maximum number of entries kept.
+        max_bytes: Optional cap on the summed `sizeof` of all values.
+        sizeof: Function estimating a value's size (defaults to estimate_size).
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int | None = None, sizeof=estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value and mark it most recently used."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def peek(self, key, default=None):
+        """Return the cached value without changing its recency."""
+        with self._lock:
+            return self._data.get(key, default)
+
+    def keys(self):
+        """Snapshot of the keys, least recently used first."""
+        with self._lock:
+            return list(self._data)
+
+    def put(self, key, value):
+        """Insert or replace a value, evicting the oldest entries if needed."""
+        with self._lock:
+            self.pop(key)
+            self._data[key] = value
+            if self.max_bytes is not None:
+                self._sizes[key] = self._sizeof(value)
+                self.total_bytes += self._sizes[key]
+            self._evict()
+
+    def adjust_size(self, key, delta: int):
+        """Account for a value that was mutated in place and grew by `delta` bytes."""
+        with self._lock:
+            if self.max_bytes is None or key not in self._data:
+                return
+            self._sizes[key] += delta
+            self.total_bytes += delta
+            self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.max_entries or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes and len(self._data) > 1
+        ):
+            oldest = next(iter(self._data))
+            self.pop(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove and return a value."""
+        with self._lock:
+            self.total_bytes -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,92 @@
+"""Optional compression of message content in the persistence layer.
+
+Assistant answers are verbose markdown that compresses several times over.
+Message content of at least `message_compression_min_bytes` (default 1024)
+UTF-8 bytes is stored as bytes: a one-byte version tag followed by the
+compressed payload.
+
+    0x01  zlib, level 6
+    0x02  zstandard, level 3 (needs the optional `zstandard` package)
+
+Shorter content, and content that would not shrink, stays a plain string, so
+chats saved before compression existed need no migration. decode_content()
+accepts both forms, and runs only when a chat's messages are read (see
+chat_shards.restore_messages); chat listings never decompress anything. Pick the codec with the `message_compression` setting:
+"zlib" (default), "zstd" or "none". Reading always works for zlib data,
+whatever the setting.
+"""
+import zlib
+
+from backend import metrics
+from backend.config import get_setting
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+ZLIB_V1 = 0x01
+ZSTD_V1 = 0x02
+
+DEFAULT_MIN_BYTES = 1024
+
+_config = None
+
+
+def configure(codec=None, min_bytes=None):
+    """Override the codec settings for this process (benchmarks, scripts)."""
+    global _config
+    codec = codec or get_setting("message_compression", "zlib")
+    if min_bytes is None:
+        min_bytes = int(get_setting("message_compression_min_bytes", DEFAULT_MIN_BYTES))
+    if codec == "zstd" and zstandard is None:
+        print("message_compression = zstd but zstandard is not installed; using zlib")
+        codec = "zlib"
+    if codec not in ("zlib", "zstd", "none"):
+        raise ValueError(f"Unknown message codec: {codec}")
+    _config = (codec, min_bytes)
+    return _config
+
+
+def _settings():
+    return _config or configure()
+
+
+def encode_content(text):
+    """Return `text` compressed with a version tag, or unchanged if not worth it."""
+    codec, min_bytes = _settings()
+    if codec == "none" or not isinstance(text, str):
+        return text
+    raw = text.encode("utf-8")
+    if len(raw) < min_bytes:
+        return text
+    if codec == "zstd":
+        encoded = bytes([ZSTD_V1]) + zstandard.ZstdCompressor(level=3).compress(raw)
+    else:
+        encoded = bytes([ZLIB_V1]) + zlib.compress(raw, 6)
+    if len(encoded) >= len(raw):
+        return text
+    metrics.incr("codec.bytes_in", len(raw))
+    metrics.incr("codec.bytes_out", len(encoded))
+    return encoded
+
+
+def decode_content(value):
+    """Inverse of encode_content; plain strings pass through."""
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+    tag, payload = value[0], bytes(value[1:])
+    if tag == ZLIB_V1:
+        return zlib.decompress(payload).decode("utf-8")
+    if tag == ZSTD_V1:
+        if zstandard is None:
+            raise RuntimeError("Message was stored with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown message codec tag: {tag}")
+
+
+def encoded_size(value):
+    """Stored size in bytes of a plain or encoded content value."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(value.encode("utf-8")) if isinstance(value, str) else 0
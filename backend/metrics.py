@@ -0,0 +1,44 @@
+"""Process-wide counters and timings for persistence instrumentation.
+
+Module-level state lives for the lifetime of the Streamlit server process, so
+every script run and every background thread reports into the same registry.
+"""
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+
+def incr(name: str, amount: int = 1):
+    """Increment a named counter."""
+    with _lock:
+        _counters[name] += amount
+
+
+def record_timing(name: str, seconds: float):
+    """Record one duration sample (in seconds) for a named timing."""
+    with _lock:
+        stats = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+        stats["count"] += 1
+        stats["total"] += seconds
+        stats["last"] = seconds
+        stats["max"] = max(stats["max"], seconds)
+
+
+def set_gauge(name: str, value):
+    """Set a named gauge to its current value (e.g. live sessions)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def snapshot() -> dict:
+    """Return a copy of all counters, timings and gauges."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {name: dict(stats) for name, stats in _timings.items()},
+            "gauges": dict(_gauges),
+        }
@@ -0,0 +1,50 @@
+"""Copy all user data from one storage backend to another.
+
+Usage:
+    python -m backend.migrate_storage --from firestore --to sqlite --sqlite-path buddy.db
+    python -m backend.migrate_storage --from sqlite --to firestore --user <user_id>
+
+Firestore credentials are read from .streamlit/secrets.toml as usual. Data is
+copied user by user; re-running the migration overwrites what was copied
+before, so an interrupted run can simply be restarted.
+"""
+import argparse
+import time
+
+from backend.storage_service import create_storage
+
+
+def migrate(source, target, user_ids=None, log=print):
+    """Copy users from `source` to `target`. Returns the number of users copied."""
+    user_ids = user_ids or source.list_user_ids()
+    for count, user_id in enumerate(user_ids, 1):
+        started = time.perf_counter()
+        data = source.export_user(user_id)
+        target.import_user(user_id, data)
+        log(
+            f"[{count}/{len(user_ids)}] {user_id}: {len(data['chats'])} chats, "
+            f"{len(data['flashcards'])} flashcard sets, {len(data['personas'])} personas "
+            f"({time.perf_counter() - started:.2f}s)"
+        )
+    target.flush()
+    return len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="source", choices=["firestore", "sqlite"], required=True)
+    parser.add_argument("--to", dest="target", choices=["firestore", "sqlite"], required=True)
+    parser.add_argument("--sqlite-path", default=None, help="SQLite database file (default: sqlite_path setting)")
+    parser.add_argument("--user", action="append", dest="users", help="Only migrate this user id (repeatable)")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+
+    source = create_storage(args.source, args.sqlite_path)
+    target = create_storage(args.target, args.sqlite_path)
+    copied = migrate(source, target, args.users)
+    print(f"Migrated {copied} users from {args.source} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Add epoch-ms timestamps to Firestore documents written before they existed.
+
+Usage:
+    python -m backend.migrate_timestamps [--checkpoint migrate_timestamps.json] [--user <user_id>] [--dry-run]
+
+Chats, flashcard sets and personas are ordered and filtered on the integer
+`updated_ms` field (see backend/timeutil.py), so older documents that only
+have `timestamp` / `updated_at` (datetimes or ISO strings) drop out of the
+lists until they are migrated. For each such document the tool derives
+`updated_ms` (and `created_ms`) from the old fields and rewrites ISO strings
+as Firestore timestamps. Documents that already have the fields are skipped.
+
+A migrated user gets MIGRATED_FIELD set on their user document. The app
+migrates a user without it on first access (backend/firebase_service.py,
+ensure_timestamps), so nothing disappears before this tool has run; the
+tool just does the work ahead of time.
+
+Each collection is read in pages ordered by document id and every page is
+committed as batched writes. The position is saved to the checkpoint file
+after each commit, so an interrupted run continues where it stopped; delete
+the file to start over. The SQLite backend always stored epoch ms and needs
+no migration.
+"""
+import argparse
+import json
+import os
+import time
+
+from backend.timeutil import to_ms, utc_datetime
+
+PAGE_SIZE = 500
+MIGRATED_FIELD = "timestamps_ms"
+
+# collection -> (legacy updated field, legacy created field or None)
+COLLECTIONS = {
+    "chats": ("timestamp", None),
+    "flashcards": ("updated_at", "created_at"),
+    "personas": ("updated_at", "created_at"),
+}
+
+
+def _parse_ms(value):
+    try:
+        return to_ms(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_fields(data, updated_field, created_field=None):
+    """Fields to merge into a legacy document, or {} if it is already normalized."""
+    changes = {}
+    updated_ms = data.get("updated_ms")
+    if not isinstance(updated_ms, int):
+        # Unparseable or missing times sort last rather than disappearing
+        updated_ms = _parse_ms(data.get(updated_field)) or _parse_ms(data.get(created_field)) or 0
+        changes["updated_ms"] = updated_ms
+    if isinstance(data.get(updated_field), str):
+        changes[updated_field] = utc_datetime(updated_ms)
+
+    if created_field:
+        created_ms = data.get("created_ms")
+        if not isinstance(created_ms, int):
+            created_ms = _parse_ms(data.get(created_field)) or updated_ms
+            changes["created_ms"] = created_ms
+        if isinstance(data.get(created_field), str):
+            changes[created_field] = utc_datetime(created_ms)
+    return changes
+
+
+class Checkpoint:
+    """Migration progress, saved atomically to a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done_users = []
+        self.position = None  # {"user_id", "collection", "last_id"}
+        self.updated = 0
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.done_users = state.get("done_users", [])
+            self.position = state.get("position")
+            self.updated = state.get("updated", 0)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done_users": self.done_users, "position": self.position, "updated": self.updated}, f)
+        os.replace(tmp_path, self.path)
+
+    def resume_point(self, user_id, collection):
+        """Return (skip_collection, last_id) for where to continue in `collection`."""
+        position = self.position
+        if not position or position["user_id"] != user_id:
+            return False, None
+        names = list(COLLECTIONS)
+        if names.index(collection) < names.index(position["collection"]):
+            return True, None
+        if collection == position["collection"]:
+            return False, position["last_id"]
+        return False, None
+
+
+def _migrate_collection(db, checkpoint, user_id, collection, dry_run):
+    from google.cloud.firestore_v1.field_path import FieldPath
+    from backend.firebase_service import commit_in_batches
+
+    skip, last_id = checkpoint.resume_point(user_id, collection)
+    if skip:
+        return 0
+    updated_field, created_field = COLLECTIONS[collection]
+    collection_ref = db.collection("users").document(user_id).collection(collection)
+    fields = ["updated_ms", "created_ms", updated_field] + ([created_field] if created_field else [])
+    updated = 0
+    while True:
+        query = collection_ref.order_by(FieldPath.document_id()).select(fields).limit(PAGE_SIZE)
+        if last_id:
+            query = query.start_after({FieldPath.document_id(): last_id})
+        page = list(query.stream())
+        if not page:
+            return updated
+        writes = []
+        for doc in page:
+            changes = normalize_fields(doc.to_dict() or {}, updated_field, created_field)
+            if changes:
+                writes.append(("set", doc.reference.path, changes))
+        if writes and not dry_run:
+            commit_in_batches(writes)
+        updated += len(writes)
+        last_id = page[-1].id
+        if not dry_run:
+            checkpoint.updated += len(writes)
+            checkpoint.position = {"user_id": user_id, "collection": collection, "last_id": last_id}
+            checkpoint.save()
+        if len(page) < PAGE_SIZE:
+            return updated
+
+
+def migrate_user(db, checkpoint, user_id, dry_run=False):
+    """Normalize one user's documents and mark the user. Returns {collection: documents changed}."""
+    counts = {name: _migrate_collection(db, checkpoint, user_id, name, dry_run) for name in COLLECTIONS}
+    if not dry_run:
+        db.collection("users").document(user_id).set({MIGRATED_FIELD: True}, merge=True)
+    return counts
+
+
+def migrate(db, checkpoint, user_ids=None, dry_run=False, log=print):
+    """Normalize the timestamps of every user's documents. Returns documents changed."""
+    user_ids = user_ids or [ref.id for ref in db.collection("users").list_documents()]
+    total = 0
+    for count, user_id in enumerate(user_ids, 1):
+        if user_id in checkpoint.done_users:
+            continue
+        started = time.perf_counter()
+        counts = migrate_user(db, checkpoint, user_id, dry_run)
+        total += sum(counts.values())
+        if not dry_run:
+            checkpoint.done_users.append(user_id)
+            checkpoint.position = None
+            checkpoint.save()
+        log(
+            f"[{count}/{len(user_ids)}] {user_id}: {counts['chats']} chats, {counts['flashcards']} flashcard sets, "
+            f"{counts['personas']} personas ({time.perf_counter() - started:.2f}s)"
+        )
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkpoint", default="migrate_timestamps.json", help="Progress file for resuming")
+    parser.add_argument("--user", action="append", dest="users", help="Only migrate this user id (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Count documents to change without writing")
+    args = parser.parse_args()
+
+    from backend.firebase_service import get_db
+
+    checkpoint = Checkpoint(None if args.dry_run else args.checkpoint)
+    changed = migrate(get_db(), checkpoint, args.users, args.dry_run)
+    if args.dry_run:
+        print(f"Would update {changed} documents")
+    else:
+        print(f"Updated {changed} documents ({checkpoint.updated} over all runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Built-in personas and the process-wide registry of users' custom personas.
+
+Every script run needs the selectable personas ({**PERSONAS, **custom}) and
+the selected persona's instructions. PersonaRegistry keeps one PersonaSet per
+user for the whole server process (via @st.cache_resource), with the merged
+lookup and a hash of every persona's instructions precomputed. The hash is a
+stable key for anything built from the instructions, such as the pooled
+Gemini models in backend/gemini_service.py.
+
+Sets are never mutated: saving, updating or deleting a persona replaces the
+user's set with a new one carrying a higher version, so a session can tell
+whether anything changed by comparing versions. Hydration fills the registry
+and skips the personas query while a user's set is younger than
+CACHE_TTL_SECONDS; older sets are reloaded, which picks up changes made by
+other processes.
+"""
+import hashlib
+import itertools
+import textwrap
+import threading
+import time
+
+import streamlit as st
+
+from backend.lru import LRUCache
+from backend.user_data_cache import CACHE_MAX_USERS, CACHE_TTL_SECONDS
+
+DEFAULT_PERSONA = "Default"
+
+
+# Predefined personas - detailed descriptions from backup
+PERSONAS = {
+    "Default": textwrap.dedent("""
+        - You are Buddy, an advanced multimodal AI assistant functioning as an "Instant Second Brain."
+        - You can help with general questions, coding, problem-solving, explanations, and any topic the user needs assistance with.
+        - When users upload files (PDFs, videos, audio), you excel at analyzing them with specific timestamped references, direct citations, and page numbers.
+        - For video and audio files, include timestamps (e.g., "At 12:35") when referencing specific moments.
+        - For PDFs, cite page numbers and quote relevant text directly from the document.
+        - Be helpful, clear, and informative whether answering general questions or analyzing uploaded content.
+        - Use markdown formatting including headers (##), bullet points, code blocks, and emphasis.
+        - For general questions, provide concise yet thorough answers with examples when helpful.
+        - For uploaded content, be thorough and precise - users rely on you for accurate information extraction.
+        - Support analysis of large files: PDFs up to 100+ pages, videos up to 2 hours, and extensive audio files.
+        - Leverage multimodal capabilities for deep visual and audio understanding when files are provided.
+    """),
+    
+    "Academic": textwrap.dedent("""
+        - You are Professor Buddy, an academic AI assistant with expertise across multiple disciplines.
+        - Adopt a scholarly, formal tone with precise terminology and well-structured explanations.
+        - Always cite sources, provide references, and explain concepts with academic rigor.
+        - Break down complex topics into logical steps, define technical terms, and use examples from research.
+        - When analyzing documents, provide critical analysis, identify methodologies, and evaluate arguments.
+        - For PDFs and papers, reference page numbers, quote directly, and analyze academic writing style.
+        - Support students and researchers with literature reviews, study assistance, and research guidance.
+        - Use markdown for structured content: headers for sections, bullet points for key concepts, and code blocks for formulas.
+    """),
+    
+    "Friendly": textwrap.dedent("""
+        - You are Buddy, a warm and approachable AI friend who's here to help with anything!
+        - Use a casual, conversational tone - like chatting with a supportive friend over coffee.
+        - Be encouraging, empathetic, and add a touch of humor when appropriate (but never offensive).
+        - Use emojis occasionally to add personality and warmth to responses. ✨
+        - When explaining things, use everyday language and relatable analogies.
+        - Celebrate user's progress and achievements, offer encouragement during challenges.
+        - For document analysis, maintain thoroughness but present findings in an accessible, friendly way.
+        - Make learning fun and engaging - you're not just informative, you're a joy to interact with!
+    """),
+    
+    "Personal Therapist": textwrap.dedent("""
+        - You are Dr. Buddy, a compassionate and empathetic AI therapist providing emotional support.
+        - Use a gentle, understanding, and non-judgmental tone in all interactions.
+        - Practice active listening - acknowledge feelings, validate emotions, and show genuine care.
+        - Ask thoughtful questions to help users explore their thoughts and feelings deeper.
+        - Provide coping strategies, mindfulness techniques, and emotional regulation tools when appropriate.
+        - Maintain boundaries: remind users you're an AI and encourage professional help for serious concerns.
+        - Be patient, supportive, and create a safe space for users to express themselves.
+        - Use reflective statements and empathetic language: "I hear that...", "It sounds like...", "That must feel..."
+        - Note: For document analysis in this mode, maintain therapeutic tone while providing insights.
+    """)
+}
+
+
+def instruction_hash(instructions):
+    """Short stable hash of persona instructions, used as a cache key."""
+    return hashlib.sha256(instructions.encode("utf-8")).hexdigest()[:16]
+
+
+class PersonaSet:
+    """One version of a user's personas. Treat every attribute as read-only.
+
+    Attributes:
+        version: Process-wide increasing number; 0 for the built-ins alone.
+        custom: {name: instructions} of the user's own personas.
+        merged: {name: instructions} of built-in and custom personas.
+        names: Persona names in selectbox order.
+        hashes: {name: instruction_hash(instructions)}.
+    """
+
+    __slots__ = ("version", "custom", "merged", "names", "hashes")
+
+    def __init__(self, version, custom):
+        self.version = version
+        self.custom = dict(custom)
+        self.merged = {**PERSONAS, **self.custom}
+        self.names = tuple(self.merged)
+        self.hashes = {**_DEFAULT_HASHES, **{name: instruction_hash(text) for name, text in self.custom.items()}}
+
+    def instruction(self, name):
+        """Instructions of `name`, falling back to the default persona."""
+        return self.merged.get(name, PERSONAS[DEFAULT_PERSONA])
+
+    def instruction_key(self, name):
+        """Hash of instruction(name)."""
+        return self.hashes.get(name, self.hashes[DEFAULT_PERSONA])
+
+
+_DEFAULT_HASHES = {name: instruction_hash(instructions) for name, instructions in PERSONAS.items()}
+BUILT_IN = PersonaSet(0, {})
+
+
+class PersonaRegistry:
+    """PersonaSet per user id, expiring after `ttl` seconds, LRU-bounded."""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_users=CACHE_MAX_USERS):
+        self.ttl = ttl
+        self._entries = LRUCache(max_users)  # user_id -> (PersonaSet, loaded_at)
+        self._versions = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id):
+        """The user's live PersonaSet, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                self._entries.pop(user_id)
+                return None
+            return entry[0]
+
+    def store(self, user_id, custom):
+        """Record a full load of the user's custom personas. Returns the PersonaSet.
+
+        The version only changes if the personas did.
+        """
+        with self._lock:
+            entry = self._entries.peek(user_id)
+            if entry is not None and entry[0].custom == custom:
+                persona_set = entry[0]
+            else:
+                persona_set = PersonaSet(next(self._versions), custom)
+            self._entries.put(user_id, (persona_set, time.monotonic()))
+            return persona_set
+
+    def resolve(self, user_id, custom):
+        """The user's live PersonaSet, or one stored from the session's `custom`."""
+        if not user_id:
+            return BUILT_IN if not custom else PersonaSet(0, custom)
+        return self.lookup(user_id) or self.store(user_id, custom)
+
+    def _replace(self, user_id, change):
+        with self._lock:
+            entry = self._entries.peek(user_id)
+            if entry is None:
+                return
+            custom = dict(entry[0].custom)
+            change(custom)
+            self._entries.put(user_id, (PersonaSet(next(self._versions), custom), entry[1]))
+
+    def update(self, user_id, name, instructions):
+        """Write-through for a saved or updated persona."""
+        self._replace(user_id, lambda custom: custom.__setitem__(name, instructions))
+
+    def remove(self, user_id, name):
+        """Write-through for a deleted persona."""
+        self._replace(user_id, lambda custom: custom.pop(name, None))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id)
+
+
+@st.cache_resource
+def get_persona_registry():
+    """Process-wide PersonaRegistry shared by all sessions."""
+    return PersonaRegistry()
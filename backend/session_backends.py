@@ -0,0 +1,232 @@
+"""Session stores shared between server processes (see backend/session_store.py).
+
+SQLiteSessionStore keeps sessions in one SQLite file in WAL mode, so every
+Streamlit process on a host sees the same tokens. Expiry uses wall-clock
+epoch ms, which all processes agree on. Idle timers are refreshed at most
+once per TOUCH_INTERVAL_SECONDS per session, so a page load is a read, not
+a write, almost every time. The gauges of both stores are refreshed by the
+background sweep rather than on every call.
+
+KeyValueSessionStore keeps each session under its own key in a network
+key-value store with the redis-py interface (get / set with px / pexpire /
+delete / scan_iter). The key's TTL is the idle timeout, reset on every
+lookup and capped by the session's absolute lifetime; the server expires
+keys by itself and its `maxmemory-policy allkeys-lru` bounds the entry
+count. LocalKeyValue implements the same calls in process memory as a
+stand-in for tests, scripts and single-process development.
+"""
+import fnmatch
+import json
+import sqlite3
+import threading
+import time
+
+from backend import metrics
+from backend.session_store import (
+    SESSION_IDLE_SECONDS, SESSION_MAX_ENTRIES, SESSION_TTL_SECONDS, SWEEP_INTERVAL_SECONDS, SessionBackend, new_token,
+)
+from backend.timeutil import now_ms
+
+TOUCH_INTERVAL_SECONDS = 60
+KEY_PREFIX = "buddy:session:"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    created_ms INTEGER NOT NULL,
+    seen_ms INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_seen ON sessions (seen_ms);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_ms);
+"""
+
+
+class SQLiteSessionStore(SessionBackend):
+    """Session store in a SQLite file shared by every local process.
+
+    Args:
+        path: SQLite file, e.g. /dev/shm/buddy_sessions.db for shared memory.
+        ttl, idle_ttl, max_entries, sweep_interval: As for SessionStore.
+        clock: Wall-clock time source in epoch ms.
+    """
+
+    def __init__(self, path, ttl=SESSION_TTL_SECONDS, idle_ttl=SESSION_IDLE_SECONDS, max_entries=SESSION_MAX_ENTRIES,
+                 sweep_interval=SWEEP_INTERVAL_SECONDS, clock=now_ms):
+        self.ttl_ms = int(ttl * 1000)
+        self.idle_ms = int(idle_ttl * 1000)
+        self.max_entries = max_entries
+        self._clock = clock
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.expirations = 0
+        self.evictions = 0
+        self._start_sweeper(sweep_interval)
+
+    def create(self, user):
+        token = new_token()
+        now = self._clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO sessions (token, user, created_ms, seen_ms) VALUES (?, ?, ?, ?)",
+                    (token, json.dumps(user), now, now),
+                )
+                excess = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_entries
+                evicted = 0
+                if excess > 0:
+                    evicted = self._conn.execute(
+                        "DELETE FROM sessions WHERE token IN "
+                        "(SELECT token FROM sessions WHERE token != ? ORDER BY seen_ms LIMIT ?)",
+                        (token, excess),
+                    ).rowcount
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.evictions += evicted
+        if evicted:
+            metrics.incr("sessions.evicted", evicted)
+        return token
+
+    def get(self, token):
+        now = self._clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user, created_ms, seen_ms FROM sessions WHERE token = ?", (token,)
+            ).fetchone()
+            if row is None:
+                return None
+            user, created_ms, seen_ms = row
+            if now - created_ms > self.ttl_ms or now - seen_ms > self.idle_ms:
+                self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+                self.expirations += 1
+                return None
+            if now - seen_ms > TOUCH_INTERVAL_SECONDS * 1000:
+                self._conn.execute("UPDATE sessions SET seen_ms = ? WHERE token = ?", (now, token))
+        return json.loads(user)
+
+    def delete(self, token):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def sweep(self):
+        now = self._clock()
+        with self._lock:
+            dropped = self._conn.execute(
+                "DELETE FROM sessions WHERE created_ms < ? OR seen_ms < ?", (now - self.ttl_ms, now - self.idle_ms)
+            ).rowcount
+            self.expirations += dropped
+        return dropped
+
+    def live_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class KeyValueSessionStore(SessionBackend):
+    """Session store on a redis-compatible key-value client.
+
+    Args:
+        client: redis.Redis, LocalKeyValue or anything with the same calls.
+        ttl, idle_ttl: As for SessionStore.
+        sweep_interval: Seconds between refreshes of the live-session gauge
+            (the server expires keys itself).
+        clock: Wall-clock time source in epoch ms.
+    """
+
+    def __init__(self, client, ttl=SESSION_TTL_SECONDS, idle_ttl=SESSION_IDLE_SECONDS,
+                 sweep_interval=SWEEP_INTERVAL_SECONDS, clock=now_ms):
+        self.client = client
+        self.ttl_ms = int(ttl * 1000)
+        self.idle_ms = int(idle_ttl * 1000)
+        self._clock = clock
+        self._live = 0
+        self.expirations = 0
+        self._start_sweeper(sweep_interval)
+
+    def create(self, user):
+        token = new_token()
+        value = json.dumps({"user": user, "created_ms": self._clock()})
+        self.client.set(KEY_PREFIX + token, value, px=min(self.idle_ms, self.ttl_ms))
+        self._live += 1
+        return token
+
+    def get(self, token):
+        value = self.client.get(KEY_PREFIX + token)
+        if value is None:
+            return None
+        session = json.loads(value)
+        remaining = session["created_ms"] + self.ttl_ms - self._clock()
+        if remaining <= 0:
+            self.client.delete(KEY_PREFIX + token)
+            self.expirations += 1
+            return None
+        self.client.pexpire(KEY_PREFIX + token, min(self.idle_ms, remaining))
+        return session["user"]
+
+    def delete(self, token):
+        self.client.delete(KEY_PREFIX + token)
+
+    def sweep(self):
+        self._live = sum(1 for _ in self.client.scan_iter(match=KEY_PREFIX + "*"))
+        return 0
+
+    def live_count(self):
+        return self._live
+
+
+class LocalKeyValue:
+    """In-process stand-in for the redis-py calls KeyValueSessionStore makes."""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._data = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._live_item(key)
+            return None if item is None else item[0]
+
+    def set(self, key, value, px=None):
+        with self._lock:
+            self._data[key] = (value, None if px is None else self._clock() + px / 1000)
+        return True
+
+    def pexpire(self, key, milliseconds):
+        with self._lock:
+            item = self._live_item(key)
+            if item is None:
+                return False
+            self._data[key] = (item[0], self._clock() + milliseconds / 1000)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            keys = [key for key in list(self._data) if self._live_item(key) and fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def _live_item(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= self._clock():
+            del self._data[key]
+            return None
+        return item
+
+
+def redis_client(url):
+    """redis.Redis for `url`, or None if the redis package is not installed."""
+    try:
+        import redis
+    except ImportError:  # optional dependency
+        return None
+    return redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
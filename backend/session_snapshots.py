@@ -0,0 +1,206 @@
+"""Per-session snapshots of the user's listings for instant restores.
+
+A page refresh used to rebuild chat_sessions, flashcard_sets and
+custom_personas with a full round of Firestore loads before anything was
+drawn. Now the end of a script run stores a snapshot of those structures
+under the session token, and a refresh with a known token:
+
+1. hydrates session state from the snapshot immediately, then
+2. reconciles in the background: documents written since the snapshot's
+   sync watermark are loaded (backend.hydration.load_changes) and merged on
+   a later rerun. A snapshot whose watermark is older than
+   CACHE_TTL_SECONDS may have missed deletions made elsewhere and is
+   replaced by a full load instead.
+
+Encoding a snapshot costs time proportional to the user's history, so it
+only happens when the listings changed: code that changes them calls
+mark_changed(), which bumps a per-session version, and a run whose version
+and sync watermark match the stored snapshot skips the save.
+
+Snapshots are zlib-compressed JSON with a leading version byte; a snapshot
+of an unknown version is ignored. They live in a process-wide LRU cache
+capped at SNAPSHOT_MAX_ENTRIES entries and SNAPSHOT_MAX_BYTES in total, so
+a refresh served by another process simply falls back to a normal load.
+"""
+import json
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from backend import metrics
+from backend.lru import LRUCache
+from backend.timeutil import now_ms
+from backend.user_data_cache import CACHE_TTL_SECONDS
+
+SNAPSHOT_V1 = 0x01
+SNAPSHOT_MAX_ENTRIES = 1000
+SNAPSHOT_MAX_BYTES = 32 * 1024 * 1024
+
+# session_state key -> snapshot key
+STATE_KEYS = {
+    "chat_sessions": "chats",
+    "chat_list_cursor": "chat_list_cursor",
+    "flashcard_sets": "flashcards",
+    "flashcard_list_cursor": "flashcard_list_cursor",
+    "custom_personas": "personas",
+    "sync_watermark": "watermark",
+}
+
+# session_state key of the listings version bumped by mark_changed()
+VERSION_KEY = "snapshot_version"
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="reconcile")
+
+
+def mark_changed(state):
+    """Record that the listings in `state` changed, so the next save encodes them."""
+    state[VERSION_KEY] = state.get(VERSION_KEY, 0) + 1
+
+
+def _portable_cursor(cursor):
+    """JSON form of a listing cursor: a SQLite (time, id) tuple or a Firestore snapshot."""
+    if cursor is None:
+        return None
+    if isinstance(cursor, (tuple, list)):
+        return {"values": list(cursor)}
+    # A Firestore snapshot: resume after the same (updated_ms, document id)
+    return {"fields": {"updated_ms": cursor.get("updated_ms"), "__name__": cursor.id}}
+
+
+def _restore_cursor(cursor):
+    if cursor is None:
+        return None
+    if "values" in cursor:
+        return tuple(cursor["values"])
+    return cursor["fields"]
+
+
+def encode_snapshot(state):
+    """Versioned, compressed bytes of the STATE_KEYS entries of `state`."""
+    snapshot = {key: state.get(name) for name, key in STATE_KEYS.items()}
+    snapshot["chat_list_cursor"] = _portable_cursor(snapshot["chat_list_cursor"])
+    snapshot["flashcard_list_cursor"] = _portable_cursor(snapshot["flashcard_list_cursor"])
+    raw = json.dumps(snapshot, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return bytes([SNAPSHOT_V1]) + zlib.compress(raw, 1)
+
+
+def decode_snapshot(data):
+    """Inverse of encode_snapshot as {session_state key: value}, or None for an unknown version."""
+    if not data or data[0] != SNAPSHOT_V1:
+        return None
+    snapshot = json.loads(zlib.decompress(data[1:]))
+    snapshot["chat_list_cursor"] = _restore_cursor(snapshot["chat_list_cursor"])
+    snapshot["flashcard_list_cursor"] = _restore_cursor(snapshot["flashcard_list_cursor"])
+    return {name: snapshot[key] for name, key in STATE_KEYS.items()}
+
+
+class SnapshotCache:
+    """Encoded snapshots by session token, bounded by count and bytes."""
+
+    def __init__(self, max_entries=SNAPSHOT_MAX_ENTRIES, max_bytes=SNAPSHOT_MAX_BYTES):
+        # token -> (user_id, data, marker)
+        self._entries = LRUCache(max_entries, max_bytes=max_bytes, sizeof=lambda entry: len(entry[1]))
+        self._lock = threading.Lock()
+
+    def save(self, token, user_id, state):
+        """Store a snapshot of `state` unless its listings are unchanged since the last save."""
+        marker = (state.get(VERSION_KEY, 0), state.get("sync_watermark"))
+        with self._lock:
+            entry = self._entries.peek(token)
+        if entry is not None and entry[0] == user_id and entry[2] == marker:
+            return
+        try:
+            data = encode_snapshot(state)
+        except (TypeError, ValueError) as e:
+            print(f"Error encoding session snapshot: {e}")
+            return
+        with self._lock:
+            self._entries.put(token, (user_id, data, marker))
+        metrics.incr("snapshots.saved")
+
+    def load(self, token, user_id):
+        """Decoded snapshot of `token` if it belongs to `user_id`, else None."""
+        with self._lock:
+            entry = self._entries.get(token)
+        if entry is None or entry[0] != user_id:
+            return None
+        try:
+            return decode_snapshot(entry[1])
+        except (ValueError, KeyError, zlib.error) as e:
+            print(f"Error decoding session snapshot: {e}")
+            return None
+
+    def drop(self, token):
+        with self._lock:
+            self._entries.pop(token)
+
+
+@st.cache_resource
+def get_snapshot_cache():
+    """Process-wide SnapshotCache shared by all sessions."""
+    return SnapshotCache()
+
+
+def _reconcile(user, watermark, ctx):
+    add_script_run_ctx(threading.current_thread(), ctx)
+    from backend.hydration import hydrate_user, load_changes
+    from backend.storage_service import get_storage
+
+    get_storage().flush()  # make saves from before the refresh visible to the loads
+    if watermark is None or now_ms() - watermark > CACHE_TTL_SECONDS * 1000:
+        metrics.incr("snapshots.full_reconciles")
+        data = hydrate_user(user)
+        if data["incomplete"]:  # keep the snapshot rather than merge partial listings
+            raise TimeoutError(f"Loading {', '.join(data['incomplete'])} timed out")
+        return {"full": True, **data}
+    chats, flashcards, personas, new_watermark = load_changes(user["user_id"], watermark)
+    metrics.incr("snapshots.delta_reconciles")
+    return {
+        "full": False, "chat_sessions": chats, "flashcard_sets": flashcards,
+        "custom_personas": personas, "watermark": new_watermark,
+    }
+
+
+def start_reconcile(user, watermark):
+    """Reconcile a restored snapshot in the background; returns a Future of the changes."""
+    return _executor.submit(_reconcile, user, watermark, get_script_run_ctx())
+
+
+def _newer(local, loaded):
+    """Listing entries of `loaded`, keeping local entries that were saved later."""
+    merged = dict(loaded)
+    for key, item in local.items():
+        if item.get("updated_ms", 0) > merged.get(key, {}).get("updated_ms", 0):
+            merged[key] = item
+    return merged
+
+
+def apply_reconciled(state, result):
+    """Merge a start_reconcile result into session state. Returns whether anything changed."""
+    chats = state.get("chat_sessions") or {}
+    flashcards = state.get("flashcard_sets") or {}
+    personas = state.get("custom_personas") or {}
+    if result["full"]:
+        # Chats saved after the load started may not be in it yet
+        since = result["watermark"]
+        new_chats = _newer({key: item for key, item in chats.items() if item.get("updated_ms", 0) > since},
+                           result["chat_sessions"])
+        new_flashcards = _newer({key: item for key, item in flashcards.items() if item.get("updated_ms", 0) > since},
+                                result["flashcard_sets"])
+        new_personas = result["custom_personas"]
+        state["chat_list_cursor"] = result["chat_list_cursor"]
+        state["flashcard_list_cursor"] = result["flashcard_list_cursor"]
+    else:
+        new_chats = {**chats, **_newer(chats, result["chat_sessions"])}
+        new_flashcards = {**flashcards, **_newer(flashcards, result["flashcard_sets"])}
+        new_personas = {**personas, **result["custom_personas"]}
+    changed = (new_chats, new_flashcards, new_personas) != (chats, flashcards, personas)
+    state["chat_sessions"] = new_chats
+    state["flashcard_sets"] = new_flashcards
+    state["custom_personas"] = new_personas
+    state["sync_watermark"] = result["watermark"]
+    mark_changed(state)
+    return changed
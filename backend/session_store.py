@@ -1,35 +1,268 @@
 """Server-side session store for persisting user sessions across page refreshes.
 
 How it works:
-- A cached dict maps session tokens (UUIDs) to user data.
-- @st.cache_resource ensures the dict persists across reruns/refreshes.
+- A process-wide session store maps session tokens (UUIDs) to user data.
+- @st.cache_resource ensures the store persists across reruns/refreshes.
 - The token is passed via st.query_params so it survives page refreshes.
 - On login: generate token -> store user -> set query param -> rerun.
 - On refresh: read token from query param -> look up user in store.
 - On sign-out: delete token from store -> clear query param -> rerun.
+
+Sessions expire SESSION_TTL_SECONDS after sign-in (absolute) or
+SESSION_IDLE_SECONDS after their last lookup (sliding). At most
+SESSION_MAX_ENTRIES sessions are kept; beyond that the least recently used
+one is evicted and its user signs in again. Expired sessions are dropped when
+looked up and by a background sweep every SWEEP_INTERVAL_SECONDS.
+
+Backends, chosen with the `session_store` setting:
+
+- "memory" (default): SessionStore below, private to one server process.
+- "sqlite": a SQLite file shared by every process on the host
+  (`session_store_path`; put it on /dev/shm to keep it in shared memory).
+- "redis": a network key-value store (`session_store_url`) shared by every
+  host, with sliding expiry done by key TTLs.
+
+The last two live in backend/session_backends.py and let several Streamlit
+processes behind a load balancer restore each other's sessions.
+
+With `session_tokens = "signed"` no store is used at all: the token itself
+carries the signed user profile (backend/session_tokens.py).
+
+Gauges: sessions.live, sessions.evictions, sessions.expirations (see
+backend/metrics.py).
 """
-import streamlit as st
+import threading
+import time
 import uuid
 
+import streamlit as st
+
+from backend import metrics
+from backend.config import get_setting
+from backend.lru import LRUCache
+
+SESSION_TTL_SECONDS = 7 * 24 * 60 * 60
+SESSION_IDLE_SECONDS = 24 * 60 * 60
+SESSION_MAX_ENTRIES = 10_000
+SWEEP_INTERVAL_SECONDS = 60
+# Sessions checked per lock acquisition during a sweep
+SWEEP_CHUNK = 500
+
+
+def new_token():
+    """A fresh, unguessable session token."""
+    return str(uuid.uuid4())
+
+
+class SessionBackend:
+    """Interface implemented by every session store.
+
+    Subclasses set `expirations` and `evictions` counters and call
+    _start_sweeper() if expired sessions need active reclaiming.
+    """
+
+    expirations = 0
+    evictions = 0
+
+    def create(self, user):
+        """Store user data and return a new session token."""
+        raise NotImplementedError
+
+    def get(self, token):
+        """User data of a live session (refreshing its idle timer), or None."""
+        raise NotImplementedError
+
+    def delete(self, token):
+        """Remove a session token from the store."""
+        raise NotImplementedError
+
+    def sweep(self):
+        """Drop every expired session. Returns how many were dropped."""
+        return 0
+
+    def live_count(self):
+        """Number of sessions currently stored."""
+        raise NotImplementedError
+
+    def stats(self):
+        """{"live", "evictions", "expirations"} of this store (counters are per process)."""
+        return {"live": self.live_count(), "evictions": self.evictions, "expirations": self.expirations}
+
+    def close(self):
+        """Stop the background sweep."""
+        self._stopped.set()
+
+    def _start_sweeper(self, interval):
+        self._stopped = threading.Event()
+        if interval:
+            threading.Thread(target=self._sweep_loop, args=(interval,), name="session-sweep", daemon=True).start()
+
+    def _sweep_loop(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                dropped = self.sweep()
+                if dropped:
+                    metrics.incr("sessions.expired", dropped)
+                self._publish()
+            except Exception as e:
+                print(f"Error sweeping sessions: {e}")
+
+    def _publish(self):
+        for name, value in self.stats().items():
+            metrics.set_gauge(f"sessions.{name}", value)
+
+
+class SessionStore(SessionBackend):
+    """Bounded, thread-safe token -> user mapping with absolute and idle expiry.
+
+    Args:
+        ttl: Seconds a session lives after creation, however active.
+        idle_ttl: Seconds a session lives after its last lookup.
+        max_entries: Sessions kept before the least recently used is evicted.
+        sweep_interval: Seconds between background sweeps (None: no thread).
+        clock: Monotonic time source, in seconds.
+    """
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS, idle_ttl=SESSION_IDLE_SECONDS, max_entries=SESSION_MAX_ENTRIES,
+                 sweep_interval=SWEEP_INTERVAL_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._entries = LRUCache(max_entries)  # recency order == idle order
+        self._lock = threading.Lock()
+        self.expirations = 0
+        self._start_sweeper(sweep_interval)
+
+    @property
+    def evictions(self):
+        return self._entries.evictions
+
+    def create(self, user):
+        token = new_token()
+        now = self._clock()
+        with self._lock:
+            evictions = self._entries.evictions
+            self._entries.put(token, {"user": user, "created": now, "seen": now})
+            evicted = self._entries.evictions - evictions
+        if evicted:
+            metrics.incr("sessions.evicted", evicted)
+        self._publish()
+        return token
+
+    def get(self, token):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.peek(token)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                self._entries.pop(token)
+                self.expirations += 1
+                expired = True
+            else:
+                entry["seen"] = now
+                self._entries.get(token)  # mark most recently used
+                expired = False
+        if expired:
+            self._publish()
+            return None
+        return entry["user"]
+
+    def delete(self, token):
+        with self._lock:
+            self._entries.pop(token)
+        self._publish()
+
+    def sweep(self):
+        """Drop expired sessions in chunks of SWEEP_CHUNK, releasing the lock in between."""
+        tokens = self._entries.keys()
+        dropped = 0
+        for start in range(0, len(tokens), SWEEP_CHUNK):
+            now = self._clock()
+            with self._lock:
+                for token in tokens[start:start + SWEEP_CHUNK]:
+                    entry = self._entries.peek(token)
+                    if entry is not None and self._expired(entry, now):
+                        self._entries.pop(token)
+                        self.expirations += 1
+                        dropped += 1
+        return dropped
+
+    def live_count(self):
+        return len(self._entries)
+
+    def _expired(self, entry, now):
+        return now - entry["created"] > self.ttl or now - entry["seen"] > self.idle_ttl
+
+
+def create_session_store(name, path=None, url=None):
+    """Build a session store by name ("memory", "sqlite" or "redis")."""
+    limits = {
+        "ttl": float(get_setting("session_ttl_hours", SESSION_TTL_SECONDS / 3600)) * 3600,
+        "idle_ttl": float(get_setting("session_idle_hours", SESSION_IDLE_SECONDS / 3600)) * 3600,
+        "max_entries": int(get_setting("session_max_entries", SESSION_MAX_ENTRIES)),
+    }
+    if name == "memory":
+        return SessionStore(**limits)
+    if name == "sqlite":
+        from backend.session_backends import SQLiteSessionStore
+        return SQLiteSessionStore(path or get_setting("session_store_path", "buddy_sessions.db"), **limits)
+    if name == "redis":
+        from backend.session_backends import KeyValueSessionStore, redis_client
+        client = redis_client(url or get_setting("session_store_url", "redis://localhost:6379/0"))
+        if client is None:
+            print("session_store = redis but the redis package is not installed; using memory")
+            return SessionStore(**limits)
+        limits.pop("max_entries")  # bounded by the server's maxmemory policy
+        return KeyValueSessionStore(client, **limits)
+    raise ValueError(f"Unknown session store: {name}")
+
 
 @st.cache_resource
 def _get_store():
-    """Internal persistent dict. Survives reruns and page refreshes."""
-    return {}
+    """Process-wide session store. Survives reruns and page refreshes."""
+    return create_session_store(get_setting("session_store", "memory"))
+
+
+@st.cache_resource
+def _get_signer():
+    """TokenSigner when `session_tokens = "signed"`, else None (stored sessions)."""
+    if str(get_setting("session_tokens", "store")).lower() != "signed":
+        return None
+    from backend.session_tokens import DenyList, TokenSigner, parse_keys
+    try:
+        return TokenSigner(
+            parse_keys(get_setting("session_signing_keys")),
+            current_key_id=get_setting("session_signing_key_id"),
+            ttl=float(get_setting("session_ttl_hours", SESSION_TTL_SECONDS / 3600)) * 3600,
+            deny_list=DenyList(get_setting("session_deny_list_path")),
+        )
+    except ValueError as e:
+        print(f"Error setting up signed session tokens, using stored sessions: {e}")
+        return None
 
 
 def create_session(user: dict) -> str:
     """Store user data and return a new session token."""
-    token = str(uuid.uuid4())
-    _get_store()[token] = user
-    return token
+    signer = _get_signer()
+    if signer is not None:
+        return signer.issue(user)
+    return _get_store().create(user)
 
 
 def get_session(token: str) -> dict | None:
     """Look up user data by session token. Returns None if invalid/expired."""
+    signer = _get_signer()
+    if signer is not None:
+        payload = signer.verify(token)
+        return payload["user"] if payload else None
     return _get_store().get(token)
 
 
 def delete_session(token: str):
     """Remove a session token from the store."""
-    _get_store().pop(token, None)
+    signer = _get_signer()
+    if signer is not None:
+        signer.revoke(token)
+    else:
+        _get_store().delete(token)
@@ -0,0 +1,180 @@
+"""Stateless session tokens: the signed user profile travels in `?session=`.
+
+With `session_tokens = "signed"` the session query param is
+
+    base64url(payload JSON) "." base64url(HMAC-SHA256(key, payload))
+
+where the payload holds the user profile, the signing key id, issue and
+expiry times (epoch ms) and a random token id. Any worker holding the keys
+verifies a token without touching the session store, so workers are
+interchangeable and a restart signs nobody out.
+
+Keys come from the `session_signing_keys` setting: a table {key_id =
+"secret"} in secrets.toml, or "key_id=secret,..." in the environment.
+`session_signing_key_id` names the key new tokens are signed with (default:
+the first). To rotate, add a new key, make it current and drop the old one
+once its tokens have expired (`session_ttl_hours`).
+
+Signing out, or revoking a leaked key, puts the token id or key id on a deny
+list kept until the affected tokens would have expired anyway. The list lives
+in memory and, when `session_deny_list_path` is set, in a SQLite file shared
+by every process on the host, which each process re-reads at most every
+DENY_LIST_REFRESH_SECONDS. Tokens have an absolute lifetime only; the idle
+timeout of stored sessions does not apply.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import sqlite3
+import threading
+import time
+
+from backend import metrics
+from backend.timeutil import now_ms
+
+TOKEN_VERSION = 1
+DENY_LIST_REFRESH_SECONDS = 5
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class DenyList:
+    """Revoked token ids and key ids, each kept until a given epoch ms.
+
+    Args:
+        path: Optional SQLite file shared with other processes.
+    """
+
+    def __init__(self, path=None):
+        self._denied = {}  # id -> until_ms
+        self._lock = threading.Lock()
+        self._conn = None
+        self._refreshed = 0.0
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS denied (id TEXT PRIMARY KEY, until_ms INTEGER NOT NULL)")
+
+    def add(self, denied_id, until_ms):
+        with self._lock:
+            now = now_ms()
+            self._denied = {key: until for key, until in self._denied.items() if until > now}
+            self._denied[denied_id] = max(until_ms, self._denied.get(denied_id, 0))
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT INTO denied (id, until_ms) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET until_ms = MAX(until_ms, excluded.until_ms)",
+                    (denied_id, until_ms),
+                )
+
+    def __contains__(self, denied_id):
+        with self._lock:
+            if self._conn is not None and time.monotonic() - self._refreshed > DENY_LIST_REFRESH_SECONDS:
+                self._refresh()
+            until_ms = self._denied.get(denied_id)
+            return until_ms is not None and until_ms > now_ms()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._denied)
+
+    def _refresh(self):
+        """Re-read the shared file and forget entries that no longer matter."""
+        now = now_ms()
+        try:
+            self._conn.execute("DELETE FROM denied WHERE until_ms <= ?", (now,))
+            rows = self._conn.execute("SELECT id, until_ms FROM denied").fetchall()
+            self._denied = {denied_id: until_ms for denied_id, until_ms in self._denied.items() if until_ms > now}
+            self._denied.update(rows)
+        except sqlite3.Error as e:
+            print(f"Error reading the session deny list: {e}")
+        self._refreshed = time.monotonic()
+
+
+class TokenSigner:
+    """Issues and verifies signed session tokens.
+
+    Args:
+        keys: {key_id: secret}; secrets shorter than 32 bytes are refused.
+        current_key_id: Key new tokens are signed with (default: the first).
+        ttl: Token lifetime in seconds.
+        deny_list: DenyList consulted on every verification.
+    """
+
+    def __init__(self, keys, current_key_id=None, ttl=7 * 24 * 60 * 60, deny_list=None):
+        if not keys:
+            raise ValueError("No session signing keys configured")
+        self._keys = {key_id: secret.encode("utf-8") for key_id, secret in keys.items()}
+        short = [key_id for key_id, secret in self._keys.items() if len(secret) < 32]
+        if short:
+            raise ValueError(f"Session signing keys must be at least 32 bytes: {', '.join(short)}")
+        self.current_key_id = current_key_id or next(iter(keys))
+        if self.current_key_id not in self._keys:
+            raise ValueError(f"Unknown session signing key: {self.current_key_id}")
+        self.ttl_ms = int(ttl * 1000)
+        self.deny_list = deny_list if deny_list is not None else DenyList()
+
+    def issue(self, user):
+        """Return a signed token carrying `user`."""
+        issued_ms = now_ms()
+        payload = {
+            "v": TOKEN_VERSION, "kid": self.current_key_id, "jti": secrets.token_urlsafe(12),
+            "iat": issued_ms, "exp": issued_ms + self.ttl_ms, "user": user,
+        }
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        metrics.incr("sessions.tokens.issued")
+        return f"{body}.{self._sign(self.current_key_id, body)}"
+
+    def verify(self, token):
+        """The token's payload if it is authentic, unexpired and not revoked, else None."""
+        payload = self._decode(token)
+        if payload is None or payload["exp"] <= now_ms() or payload["jti"] in self.deny_list \
+                or f"kid:{payload['kid']}" in self.deny_list:
+            metrics.incr("sessions.tokens.rejected")
+            return None
+        metrics.incr("sessions.tokens.verified")
+        return payload
+
+    def revoke(self, token):
+        """Deny an authentic token until it expires (sign-out)."""
+        payload = self._decode(token)
+        if payload is not None:
+            self.deny_list.add(payload["jti"], payload["exp"])
+
+    def revoke_key(self, key_id):
+        """Deny every token signed with `key_id` that has not expired yet."""
+        self.deny_list.add(f"kid:{key_id}", now_ms() + self.ttl_ms)
+
+    def _sign(self, key_id, body):
+        return _b64encode(hmac.new(self._keys[key_id], body.encode("ascii"), hashlib.sha256).digest())
+
+    def _decode(self, token):
+        """Payload of a token with a valid signature, or None."""
+        try:
+            body, signature = token.split(".")
+            payload = json.loads(_b64decode(body))
+            key_id = payload["kid"]
+            if payload.get("v") != TOKEN_VERSION or key_id not in self._keys:
+                return None
+            if not hmac.compare_digest(signature, self._sign(key_id, body)):
+                return None
+            return payload
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+
+def parse_keys(value):
+    """{key_id: secret} from a settings table or a "key_id=secret,..." string."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        return dict(item.strip().split("=", 1) for item in value.split(",") if item.strip())
+    return {str(key_id): str(secret) for key_id, secret in dict(value).items()}
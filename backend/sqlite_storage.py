@@ -0,0 +1,412 @@
+"""Embedded SQLite storage backend for single-node deployments.
+
+The database runs in WAL mode so readers never block the writer, and every
+per-user listing is served from an index on (user_id, updated_at). Reads and
+writes stay in the single-digit millisecond range instead of paying a WAN
+round trip to Firestore.
+
+Timestamps are stored and returned as integer epoch milliseconds (see
+backend/timeutil.py), so this backend needs no timestamp migration. Long
+message content is stored compressed (see backend/message_codec.py).
+"""
+import json
+import sqlite3
+import threading
+
+from backend.analytics_cache import get_analytics_cache
+from backend.analytics_service import CHAT_COUNTER_FIELDS, chat_counters
+from backend.message_codec import decode_content, encode_content
+from backend.personas import get_persona_registry
+from backend.storage_service import CHAT_PAGE_SIZE, FLASHCARD_PAGE_SIZE, StorageBackend
+from backend.timeutil import now_ms, to_ms
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    profile TEXT NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chats (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    persona TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    updated_at INTEGER NOT NULL,
+    user_message_count INTEGER,  -- per-chat counters, NULL for chats saved before they existed
+    assistant_message_count INTEGER,
+    user_chars INTEGER,
+    assistant_chars INTEGER,
+    user_words INTEGER,
+    PRIMARY KEY (user_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS chats_user_updated ON chats (user_id, updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,  -- plain text, or a BLOB from encode_content
+    PRIMARY KEY (user_id, chat_id, position)
+);
+CREATE TABLE IF NOT EXISTS chat_files (
+    user_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    PRIMARY KEY (user_id, chat_id, file_name)
+);
+CREATE TABLE IF NOT EXISTS flashcard_sets (
+    user_id TEXT NOT NULL,
+    set_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    cards TEXT NOT NULL,
+    card_count INTEGER NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, set_id)
+);
+CREATE INDEX IF NOT EXISTS flashcard_sets_user_updated ON flashcard_sets (user_id, updated_at);
+CREATE TABLE IF NOT EXISTS personas (
+    user_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    instructions TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE INDEX IF NOT EXISTS personas_user_updated ON personas (user_id, updated_at);
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    """StorageBackend on a local SQLite file (one connection per thread)."""
+
+    remote = False
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(chats)")}
+        for field in CHAT_COUNTER_FIELDS:
+            if field not in columns:  # database created before the counters existed
+                conn.execute(f"ALTER TABLE chats ADD COLUMN {field} INTEGER")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    # --- users ---
+    def save_user(self, user_info):
+        user_id = user_info.get('user_id') or user_info.get('sub')
+        if not user_id:
+            return
+        with self._conn() as conn:
+            row = conn.execute("SELECT profile FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            profile = {**json.loads(row["profile"]), **user_info} if row else dict(user_info)
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_id, profile, updated_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(profile, default=str), now_ms()),
+            )
+
+    def list_user_ids(self):
+        return [row["user_id"] for row in self._conn().execute("SELECT user_id FROM users")]
+
+    # --- chats and messages ---
+    def save_chat(self, user_id, chat_id, messages, title, persona=None, updated_ms=None):
+        updated_at = to_ms(updated_ms) or now_ms()
+        counters = chat_counters(messages)
+        with self._conn() as conn:
+            conn.execute(
+                f"""INSERT INTO chats (user_id, chat_id, title, persona, message_count, updated_at,
+                                       {", ".join(CHAT_COUNTER_FIELDS)})
+                   VALUES (?, ?, ?, ?, ?, ?{", ?" * len(CHAT_COUNTER_FIELDS)})
+                   ON CONFLICT (user_id, chat_id) DO UPDATE SET
+                       title = excluded.title,
+                       persona = COALESCE(excluded.persona, chats.persona),
+                       message_count = excluded.message_count,
+                       updated_at = excluded.updated_at,
+                       {", ".join(f"{field} = excluded.{field}" for field in CHAT_COUNTER_FIELDS)}""",
+                (user_id, chat_id, title, persona, len(messages), updated_at, *counters.values()),
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND chat_id = ? AND position >= ?",
+                (user_id, chat_id, len(messages)),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO messages (user_id, chat_id, position, role, content) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (user_id, chat_id, i, m.get("role", ""), encode_content(m.get("content", "")))
+                    for i, m in enumerate(messages)
+                ],
+            )
+        get_analytics_cache().update_chat(
+            user_id, chat_id, [updated_at, persona or "Default", title, *counters.values()]
+        )
+
+    @staticmethod
+    def _chat_metadata(row):
+        return {
+            "title": row["title"],
+            "persona": row["persona"] or "Default",
+            "message_count": row["message_count"],
+            "updated_ms": row["updated_at"],
+        }
+
+    def load_chat_list(self, user_id, page_size=CHAT_PAGE_SIZE, cursor=None, since=None):
+        sql = "SELECT * FROM chats WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND updated_at > ?"
+            params.append(to_ms(since))
+        if cursor is not None:
+            sql += " AND (updated_at < ? OR (updated_at = ? AND chat_id > ?))"
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql += " ORDER BY updated_at DESC, chat_id"
+        if since is None:
+            sql += " LIMIT ?"
+            params.append(page_size)
+        rows = self._conn().execute(sql, params).fetchall()
+        chats = {row["chat_id"]: self._chat_metadata(row) for row in rows}
+        next_cursor = None
+        if since is None and len(rows) == page_size:
+            next_cursor = (rows[-1]["updated_at"], rows[-1]["chat_id"])
+        return chats, next_cursor
+
+    def load_chats(self, user_id):
+        conn = self._conn()
+        chats = {}
+        for row in conn.execute("SELECT * FROM chats WHERE user_id = ? ORDER BY updated_at DESC", (user_id,)):
+            chats[row["chat_id"]] = {**self._chat_metadata(row), "messages": []}
+        for row in conn.execute(
+            "SELECT chat_id, role, content FROM messages WHERE user_id = ? ORDER BY chat_id, position", (user_id,)
+        ):
+            if row["chat_id"] in chats:
+                chats[row["chat_id"]]["messages"].append({"role": row["role"], "content": decode_content(row["content"])})
+        self._backfill_counters(user_id, chats)
+        return chats
+
+    def _backfill_counters(self, user_id, chats):
+        """Store counters of chats saved before they existed, from loaded messages."""
+        missing = [row["chat_id"] for row in self._conn().execute(
+            "SELECT chat_id FROM chats WHERE user_id = ? AND user_message_count IS NULL", (user_id,)
+        ) if row["chat_id"] in chats]
+        if not missing:
+            return
+        assignments = ", ".join(f"{field} = ?" for field in CHAT_COUNTER_FIELDS)
+        with self._conn() as conn:
+            conn.executemany(
+                f"UPDATE chats SET {assignments} WHERE user_id = ? AND chat_id = ?",
+                [(*chat_counters(chats[chat_id]["messages"]).values(), user_id, chat_id) for chat_id in missing],
+            )
+
+    def chat_totals(self, user_id, since=None):
+        sums = ", ".join(f"COALESCE(SUM({field}), 0) AS {field}" for field in CHAT_COUNTER_FIELDS)
+        sql = f"SELECT COUNT(*) AS chats, COUNT(user_message_count) AS counted, {sums} FROM chats WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND updated_at >= ?"
+            params.append(to_ms(since))
+        return dict(self._conn().execute(sql, params).fetchone())
+
+    def load_chat_stats(self, user_id):
+        # The counter columns of the chats table are the stored records
+        rows = self._conn().execute(
+            f"SELECT chat_id, updated_at, persona, title, {', '.join(CHAT_COUNTER_FIELDS)} FROM chats WHERE user_id = ?",
+            (user_id,),
+        ).fetchall()
+        if any(row["user_message_count"] is None for row in rows):
+            return None
+        return {
+            row["chat_id"]: [row["updated_at"], row["persona"] or "Default", row["title"],
+                             *(row[field] for field in CHAT_COUNTER_FIELDS)]
+            for row in rows
+        }
+
+    def save_chat_stats(self, user_id, records):
+        pass  # load_chats() has already backfilled the counter columns
+
+    def load_chat_messages(self, user_id, chat_id):
+        rows = self._conn().execute(
+            "SELECT role, content FROM messages WHERE user_id = ? AND chat_id = ? ORDER BY position",
+            (user_id, chat_id),
+        )
+        return [{"role": row["role"], "content": decode_content(row["content"])} for row in rows]
+
+    def delete_chat(self, user_id, chat_id):
+        self.delete_chats(user_id, [chat_id])
+
+    def link_chat_files(self, user_id, chat_id, file_names):
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO chat_files (user_id, chat_id, file_name) VALUES (?, ?, ?)",
+                [(user_id, chat_id, name) for name in file_names],
+            )
+
+    def list_chat_ids(self, user_id, before=None):
+        sql = "SELECT chat_id FROM chats WHERE user_id = ?"
+        params = [user_id]
+        if before is not None:
+            sql += " AND updated_at < ?"
+            params.append(to_ms(before))
+        return [row["chat_id"] for row in self._conn().execute(sql, params)]
+
+    def delete_chats(self, user_id, chat_ids, progress=None, chunk_size=500):
+        chat_ids = list(chat_ids)
+        file_names = []
+        for start in range(0, len(chat_ids), chunk_size):
+            keys = [(user_id, chat_id) for chat_id in chat_ids[start:start + chunk_size]]
+            with self._conn() as conn:
+                for key in keys:
+                    file_names.extend(row["file_name"] for row in conn.execute(
+                        "SELECT file_name FROM chat_files WHERE user_id = ? AND chat_id = ?", key
+                    ))
+                for table in ("messages", "chat_files", "chats"):
+                    conn.executemany(f"DELETE FROM {table} WHERE user_id = ? AND chat_id = ?", keys)
+            get_analytics_cache().remove_chats(user_id, [chat_id for _, chat_id in keys])
+            if progress:
+                progress(start + len(keys), len(chat_ids))
+        return file_names
+
+    # --- flashcards ---
+    def save_flashcard_set(self, user_id, set_id, cards, title, updated_ms=None):
+        updated_at = to_ms(updated_ms) or now_ms()
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    """INSERT INTO flashcard_sets (user_id, set_id, title, cards, card_count, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (user_id, set_id) DO UPDATE SET
+                           title = excluded.title, cards = excluded.cards,
+                           card_count = excluded.card_count, updated_at = excluded.updated_at""",
+                    (user_id, set_id, title, json.dumps(cards), len(cards), updated_at, updated_at),
+                )
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving flashcards: {e}")
+            return False
+
+    def load_flashcard_sets(self, user_id, since=None):
+        sql = "SELECT * FROM flashcard_sets WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND updated_at > ?"
+            params.append(to_ms(since))
+        sql += " ORDER BY updated_at DESC"
+        return {
+            row["set_id"]: {
+                "title": row["title"],
+                "cards": json.loads(row["cards"]),
+                "updated_ms": row["updated_at"],
+            }
+            for row in self._conn().execute(sql, params)
+        }
+
+    def load_flashcard_list(self, user_id, page_size=FLASHCARD_PAGE_SIZE, cursor=None, since=None):
+        sql = "SELECT set_id, title, card_count, updated_at FROM flashcard_sets WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND updated_at > ?"
+            params.append(to_ms(since))
+        if cursor is not None:
+            sql += " AND (updated_at < ? OR (updated_at = ? AND set_id > ?))"
+            params += [cursor[0], cursor[0], cursor[1]]
+        sql += " ORDER BY updated_at DESC, set_id"
+        if since is None:
+            sql += " LIMIT ?"
+            params.append(page_size)
+        rows = self._conn().execute(sql, params).fetchall()
+        sets = {
+            row["set_id"]: {"title": row["title"], "card_count": row["card_count"], "updated_ms": row["updated_at"]}
+            for row in rows
+        }
+        next_cursor = None
+        if since is None and len(rows) == page_size:
+            next_cursor = (rows[-1]["updated_at"], rows[-1]["set_id"])
+        return sets, next_cursor
+
+    def load_flashcard_cards(self, user_id, set_id):
+        row = self._conn().execute(
+            "SELECT cards FROM flashcard_sets WHERE user_id = ? AND set_id = ?", (user_id, set_id)
+        ).fetchone()
+        return json.loads(row["cards"]) if row else []
+
+    def delete_flashcard_set(self, user_id, set_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM flashcard_sets WHERE user_id = ? AND set_id = ?", (user_id, set_id))
+        return True
+
+    # --- personas ---
+    def save_persona(self, user_id, name, instructions, updated_ms=None):
+        updated_at = to_ms(updated_ms) or now_ms()
+        try:
+            with self._conn() as conn:
+                conn.execute(
+                    """INSERT INTO personas (user_id, name, instructions, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT (user_id, name) DO UPDATE SET
+                           instructions = excluded.instructions, updated_at = excluded.updated_at""",
+                    (user_id, name, instructions, updated_at, updated_at),
+                )
+            get_persona_registry().update(user_id, name, instructions)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error saving persona: {e}")
+            return False
+
+    def load_personas(self, user_id, since=None):
+        sql = "SELECT name, instructions FROM personas WHERE user_id = ?"
+        params = [user_id]
+        if since is not None:
+            sql += " AND updated_at > ?"
+            params.append(to_ms(since))
+        return {row["name"]: row["instructions"] for row in self._conn().execute(sql, params)}
+
+    def delete_persona(self, user_id, name):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM personas WHERE user_id = ? AND name = ?", (user_id, name))
+        get_persona_registry().remove(user_id, name)
+        return True
+
+    # --- maintenance ---
+    def export_user(self, user_id):
+        conn = self._conn()
+        row = conn.execute("SELECT profile FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        chats = {
+            chat_id: {
+                "title": chat["title"],
+                "persona": chat["persona"],
+                "messages": chat["messages"],
+                "updated_ms": chat["updated_ms"],
+            }
+            for chat_id, chat in self.load_chats(user_id).items()
+        }
+        flashcards = self.load_flashcard_sets(user_id)
+        personas = {
+            persona["name"]: {"instructions": persona["instructions"], "updated_ms": persona["updated_at"]}
+            for persona in conn.execute("SELECT * FROM personas WHERE user_id = ?", (user_id,))
+        }
+        return {
+            "profile": json.loads(row["profile"]) if row else None,
+            "chats": chats,
+            "flashcards": flashcards,
+            "personas": personas,
+        }
+
+    def import_user(self, user_id, data):
+        if data.get("profile"):
+            self.save_user({**data["profile"], "user_id": user_id})
+        for chat_id, chat in data.get("chats", {}).items():
+            self.save_chat(user_id, chat_id, chat["messages"], chat["title"], chat.get("persona"), chat.get("updated_ms"))
+        for set_id, flashcard_set in data.get("flashcards", {}).items():
+            self.save_flashcard_set(user_id, set_id, flashcard_set["cards"], flashcard_set["title"], flashcard_set.get("updated_ms"))
+        for name, persona in data.get("personas", {}).items():
+            self.save_persona(user_id, name, persona["instructions"], persona.get("updated_ms"))
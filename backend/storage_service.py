@@ -0,0 +1,307 @@
+"""Storage backend abstraction for users, chats, messages, flashcards and personas.
+
+The app talks to a StorageBackend returned by get_storage() instead of calling
+Firestore directly. Two implementations exist:
+
+- FirestoreStorage (default): the existing Firestore code in
+  backend/firebase_service.py, including the write-behind buffer and the
+  shared user data cache.
+- SQLiteStorage (backend/sqlite_storage.py): an embedded database in WAL
+  mode for single-node, self-hosted deployments.
+
+Select one with the `storage_backend` setting ("firestore" or "sqlite") and,
+for SQLite, `sqlite_path`. backend/migrate_storage.py copies data between
+backends using export_user/import_user.
+
+Timestamps handed to and returned from backends are integer epoch
+milliseconds (`updated_ms`, see backend/timeutil.py); `since`/`before`
+arguments also accept datetimes.
+"""
+import streamlit as st
+
+from backend.config import get_setting
+
+CHAT_PAGE_SIZE = 30
+FLASHCARD_PAGE_SIZE = 30
+
+
+class StorageBackend:
+    """Repository interface implemented by every storage backend.
+
+    `remote` tells callers whether reads cross the network and are worth
+    caching process-wide (see backend/user_data_cache.py).
+    """
+
+    remote = False
+
+    # --- users ---
+    def save_user(self, user_info):
+        raise NotImplementedError
+
+    def list_user_ids(self):
+        raise NotImplementedError
+
+    # --- chats and messages ---
+    def save_chat(self, user_id, chat_id, messages, title, persona=None):
+        raise NotImplementedError
+
+    def load_chat_list(self, user_id, page_size=CHAT_PAGE_SIZE, cursor=None, since=None):
+        """Return ({chat_id: metadata}, next_cursor); metadata has no messages."""
+        raise NotImplementedError
+
+    def load_chats(self, user_id):
+        """Return {chat_id: chat} including messages, newest first (archived chats excluded)."""
+        raise NotImplementedError
+
+    def load_chat_messages(self, user_id, chat_id):
+        raise NotImplementedError
+
+    def chat_totals(self, user_id, since=None):
+        """Sum the per-chat counters (see backend/analytics_service.py) without reading messages.
+
+        Returns {"chats", "counted", <counter field>: total, ...} over chats
+        saved at or after `since` (all chats by default); "counted" is how
+        many of them carry counters. Returns None if unavailable.
+        """
+        raise NotImplementedError
+
+    def load_chat_stats(self, user_id):
+        """Per-chat stats records {chat_id: record} (see backend/analytics_service.py) without reading messages.
+
+        Returns None when they are missing or incomplete; backend/analytics_cache.py
+        then rebuilds them from the full chats.
+        """
+        return None
+
+    def save_chat_stats(self, user_id, records):
+        """Store stats records rebuilt from the full chats."""
+
+    def delete_chat(self, user_id, chat_id):
+        raise NotImplementedError
+
+    def link_chat_files(self, user_id, chat_id, file_names):
+        """Remember Gemini file names uploaded in a chat."""
+        raise NotImplementedError
+
+    def list_chat_ids(self, user_id, before=None):
+        """Ids of all chats, or of those last saved before `before`."""
+        raise NotImplementedError
+
+    def delete_chats(self, user_id, chat_ids, progress=None):
+        """Delete chats with all their messages; progress(done, total) is
+        called as chunks complete. Returns the linked Gemini file names."""
+        raise NotImplementedError
+
+    # --- cold archive (see backend/chat_archive.py) ---
+    # Backends without a cold tier keep every chat hot; these are no-ops there.
+    def archive_chats(self, user_id, days=None):
+        """Archive chats inactive for `days` days. Returns how many were archived."""
+        return 0
+
+    def load_archived_chat_list(self, user_id):
+        """Return {chat_id: metadata} of archived chats."""
+        return {}
+
+    def search_archived_chats(self, user_id, text):
+        """Return {chat_id: metadata} of archived chats containing `text`."""
+        return {}
+
+    def load_archived_chat_stats(self, user_id):
+        """Stats records {chat_id: record} of archived chats, or None if unavailable."""
+        return {}
+
+    def restore_chat(self, user_id, chat_id):
+        """Move an archived chat back; returns (metadata, messages) or None."""
+        return None
+
+    # --- flashcards ---
+    def save_flashcard_set(self, user_id, set_id, cards, title):
+        raise NotImplementedError
+
+    def load_flashcard_sets(self, user_id, since=None):
+        """Return {set_id: {"title", "cards", "updated_ms"}} for every set."""
+        raise NotImplementedError
+
+    def load_flashcard_list(self, user_id, page_size=FLASHCARD_PAGE_SIZE, cursor=None, since=None):
+        """Return ({set_id: {"title", "card_count", "updated_ms"}}, next_cursor), newest first."""
+        raise NotImplementedError
+
+    def load_flashcard_cards(self, user_id, set_id):
+        raise NotImplementedError
+
+    def delete_flashcard_set(self, user_id, set_id):
+        raise NotImplementedError
+
+    # --- personas ---
+    def save_persona(self, user_id, name, instructions):
+        raise NotImplementedError
+
+    def update_persona(self, user_id, name, instructions):
+        return self.save_persona(user_id, name, instructions)
+
+    def load_personas(self, user_id, since=None):
+        raise NotImplementedError
+
+    def delete_persona(self, user_id, name):
+        raise NotImplementedError
+
+    # --- maintenance ---
+    def flush(self, timeout=10):
+        """Wait until buffered writes are durable. No-op for synchronous backends."""
+        return True
+
+    def hydration_loaders(self):
+        """{"chats", "flashcards", "personas"} loaders used by backend/hydration.py.
+
+        They take the arguments of load_chat_list, load_flashcard_list and
+        load_personas; a backend may return coroutine functions instead, which
+        then run on the shared async Firestore loop.
+        """
+        return {"chats": self.load_chat_list, "flashcards": self.load_flashcard_list, "personas": self.load_personas}
+
+    def prepare_user(self, user_id):
+        """Bring the user's stored documents up to the current schema before
+        the hydration loaders list them. No-op unless the backend needs it."""
+
+    def export_user(self, user_id):
+        """Return all data of one user in a backend-neutral dict.
+
+        {"profile": dict | None,
+         "chats": {chat_id: {"title", "persona", "messages", "updated_ms"}},
+         "flashcards": {set_id: {"title", "cards", "updated_ms"}},
+         "personas": {name: {"instructions", "updated_ms"}}}
+        """
+        raise NotImplementedError
+
+    def import_user(self, user_id, data):
+        """Write a dict produced by export_user, preserving timestamps."""
+        raise NotImplementedError
+
+
+class FirestoreStorage(StorageBackend):
+    """Firestore implementation backed by backend/firebase_service.py."""
+
+    remote = True
+
+    def __init__(self):
+        from backend import firebase_service
+        self._fs = firebase_service
+
+    def save_user(self, user_info):
+        self._fs.save_user_to_firestore(user_info)
+
+    def list_user_ids(self):
+        return [ref.id for ref in self._fs.get_db().collection("users").list_documents()]
+
+    def save_chat(self, user_id, chat_id, messages, title, persona=None):
+        self._fs.save_chat_to_firestore(user_id, chat_id, messages, title, persona)
+
+    def load_chat_list(self, user_id, page_size=CHAT_PAGE_SIZE, cursor=None, since=None):
+        return self._fs.load_chat_list(user_id, page_size, cursor, since)
+
+    def load_chats(self, user_id):
+        return self._fs.load_user_chats(user_id)
+
+    def load_chat_messages(self, user_id, chat_id):
+        return self._fs.load_chat_messages(user_id, chat_id)
+
+    def chat_totals(self, user_id, since=None):
+        return self._fs.load_chat_totals(user_id, since)
+
+    def load_chat_stats(self, user_id):
+        return self._fs.load_chat_stats(user_id)
+
+    def save_chat_stats(self, user_id, records):
+        self._fs.save_chat_stats(user_id, records)
+
+    def delete_chat(self, user_id, chat_id):
+        self._fs.delete_chat_from_firestore(user_id, chat_id)
+
+    def link_chat_files(self, user_id, chat_id, file_names):
+        self._fs.link_chat_files(user_id, chat_id, file_names)
+
+    def list_chat_ids(self, user_id, before=None):
+        return self._fs.list_chat_ids(user_id, before)
+
+    def delete_chats(self, user_id, chat_ids, progress=None):
+        return self._fs.delete_chats(user_id, chat_ids, progress)
+
+    def archive_chats(self, user_id, days=None):
+        return self._fs.archive_inactive_chats(user_id, days)
+
+    def load_archived_chat_list(self, user_id):
+        return self._fs.load_archived_chat_list(user_id)
+
+    def search_archived_chats(self, user_id, text):
+        return self._fs.search_archived_chats(user_id, text)
+
+    def load_archived_chat_stats(self, user_id):
+        return self._fs.load_archived_chat_stats(user_id)
+
+    def restore_chat(self, user_id, chat_id):
+        return self._fs.restore_archived_chat(user_id, chat_id)
+
+    def save_flashcard_set(self, user_id, set_id, cards, title):
+        return self._fs.save_flashcards_to_firestore(user_id, set_id, cards, title)
+
+    def load_flashcard_sets(self, user_id, since=None):
+        return self._fs.load_user_flashcards(user_id, since)
+
+    def load_flashcard_list(self, user_id, page_size=FLASHCARD_PAGE_SIZE, cursor=None, since=None):
+        return self._fs.load_flashcard_list(user_id, page_size, cursor, since)
+
+    def load_flashcard_cards(self, user_id, set_id):
+        return self._fs.load_flashcard_cards(user_id, set_id)
+
+    def delete_flashcard_set(self, user_id, set_id):
+        return self._fs.delete_flashcards_from_firestore(user_id, set_id)
+
+    def save_persona(self, user_id, name, instructions):
+        return self._fs.save_persona_to_firestore(user_id, name, instructions)
+
+    def update_persona(self, user_id, name, instructions):
+        return self._fs.update_persona_in_firestore(user_id, name, instructions)
+
+    def load_personas(self, user_id, since=None):
+        return self._fs.load_user_personas(user_id, since)
+
+    def delete_persona(self, user_id, name):
+        return self._fs.delete_persona_from_firestore(user_id, name)
+
+    def flush(self, timeout=10):
+        return self._fs.flush_pending_writes(timeout)
+
+    def prepare_user(self, user_id):
+        self._fs.ensure_timestamps(user_id)
+
+    def hydration_loaders(self):
+        from backend import async_firestore
+        if not async_firestore.enabled():
+            return super().hydration_loaders()
+        return {
+            "chats": async_firestore.load_chat_list,
+            "flashcards": async_firestore.load_flashcard_list,
+            "personas": async_firestore.load_personas,
+        }
+
+    def export_user(self, user_id):
+        return self._fs.export_user_data(user_id)
+
+    def import_user(self, user_id, data):
+        self._fs.import_user_data(user_id, data)
+
+
+def create_storage(name, sqlite_path=None):
+    """Build a backend by name ("firestore" or "sqlite")."""
+    if name == "firestore":
+        return FirestoreStorage()
+    if name == "sqlite":
+        from backend.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(sqlite_path or get_setting("sqlite_path", "buddy.db"))
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+@st.cache_resource
+def get_storage() -> StorageBackend:
+    """Process-wide storage backend chosen by the `storage_backend` setting."""
+    return create_storage(get_setting("storage_backend", "firestore"))
@@ -0,0 +1,53 @@
+"""Canonical timestamps: integer epoch milliseconds.
+
+Every stored document carries its time as an int field (`updated_ms`, and
+`created_ms` where it matters), which is what queries order and filter on and
+what the UI sorts and groups by. The matching Firestore timestamp field
+(`timestamp` / `updated_at`) is written as a server timestamp for console
+readability and server-side tooling only.
+
+Older documents hold ISO strings or naive local datetimes instead; to_ms()
+accepts all of them and backend/migrate_timestamps.py rewrites them.
+"""
+import datetime
+import time
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(value):
+    """Convert an int, float, datetime or ISO string to epoch ms (None passes).
+
+    Naive datetimes and strings are taken as local time, which is how the app
+    used to write them.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    return int(value.timestamp() * 1000)
+
+
+def from_ms(value):
+    """Naive local datetime for display and calendar grouping."""
+    return datetime.datetime.fromtimestamp(value / 1000)
+
+
+def utc_datetime(value):
+    """Timezone-aware UTC datetime, for storing in datetime-typed fields."""
+    return datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+
+
+def start_of_day_ms(day=None) -> int:
+    """Epoch ms of local midnight starting `day` (default: today)."""
+    return to_ms(day or datetime.date.today())
@@ -0,0 +1,145 @@
+"""Process-wide read-through cache of per-user Firestore data.
+
+Every sign-in, new tab and page refresh used to download the chat list,
+flashcard sets and personas from scratch. This cache keeps one entry per user
+id for the whole server process (via @st.cache_resource):
+
+- Entries younger than CACHE_TTL_SECONDS are refreshed with delta queries
+  that only fetch documents written after the entry's sync watermark.
+- Older entries are dropped and reloaded in full, which also picks up
+  deletions made by other processes.
+- Local saves and deletes update the cached entry write-through.
+- Entries are evicted least-recently-used once the cache exceeds
+  CACHE_MAX_USERS entries or CACHE_MAX_BYTES of estimated memory.
+"""
+import copy
+import threading
+import time
+
+import streamlit as st
+
+from backend.lru import LRUCache, estimate_size
+from backend.timeutil import now_ms
+
+CACHE_TTL_SECONDS = 600
+CACHE_MAX_USERS = 500
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Delta queries start this far before the previous sync to cover clock skew
+# between workers and writes still in flight when the last sync ran.
+WATERMARK_OVERLAP_MS = 30_000
+
+
+def _item_size(items, key):
+    """Estimated size of one item of an entry section (0 if absent)."""
+    return estimate_size(key) + estimate_size(items[key]) if key in items else 0
+
+
+class UserDataCache:
+    """Per-user cache entries: chats, chat_list_cursor, flashcards,
+    flashcard_list_cursor, personas. Chats and flashcards hold listing
+    metadata only; messages and cards are fetched when opened."""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_users=CACHE_MAX_USERS, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self._entries = LRUCache(max_users, max_bytes=max_bytes)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def new_watermark():
+        """Watermark (epoch ms) for a sync that starts now."""
+        return now_ms() - WATERMARK_OVERLAP_MS
+
+    def lookup(self, user_id):
+        """Return the live entry for a user, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["loaded_at"] > self.ttl:
+                self._entries.pop(user_id)
+                return None
+            return entry
+
+    def copy_entry(self, user_id):
+        """Deep copy of a live entry that a session may mutate freely."""
+        with self._lock:
+            entry = self.lookup(user_id)
+            if entry is None:
+                return None
+            return {
+                "chats": copy.deepcopy(entry["chats"]),
+                "chat_list_cursor": entry["chat_list_cursor"],
+                "flashcards": copy.deepcopy(entry["flashcards"]),
+                "flashcard_list_cursor": entry["flashcard_list_cursor"],
+                "personas": dict(entry["personas"]),
+            }
+
+    def store(self, user_id, chats, chat_list_cursor, flashcards, personas, watermark, flashcard_list_cursor=None):
+        """Replace a user's entry with the result of a full load."""
+        with self._lock:
+            self._entries.put(user_id, {
+                "chats": chats,
+                "chat_list_cursor": chat_list_cursor,
+                "flashcards": flashcards,
+                "flashcard_list_cursor": flashcard_list_cursor,
+                "personas": personas,
+                "watermark": watermark,
+                "loaded_at": time.monotonic(),
+            })
+
+    def apply_delta(self, user_id, chats, flashcards, personas, watermark):
+        """Merge documents changed since the last sync into a user's entry."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            delta = 0
+            for section, changes in (("chats", chats), ("flashcards", flashcards), ("personas", personas)):
+                items = entry[section]
+                delta -= sum(_item_size(items, key) for key in changes)
+                items.update(changes)
+                delta += sum(_item_size(items, key) for key in changes)
+            entry["watermark"] = watermark
+            self._entries.adjust_size(user_id, delta)
+
+    def _update(self, user_id, section, key, value=None, remove=False):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            items = entry[section]
+            before = _item_size(items, key)
+            if remove:
+                items.pop(key, None)
+            else:
+                items[key] = {**items.get(key, {}), **value} if isinstance(value, dict) else value
+            # Only the changed item is re-measured, so a save costs the same whatever the history size
+            self._entries.adjust_size(user_id, _item_size(items, key) - before)
+
+    def update_chat(self, user_id, chat_id, metadata):
+        self._update(user_id, "chats", chat_id, metadata)
+
+    def remove_chat(self, user_id, chat_id):
+        self._update(user_id, "chats", chat_id, remove=True)
+
+    def update_flashcard_set(self, user_id, set_id, set_data):
+        self._update(user_id, "flashcards", set_id, set_data)
+
+    def remove_flashcard_set(self, user_id, set_id):
+        self._update(user_id, "flashcards", set_id, remove=True)
+
+    def update_persona(self, user_id, persona_name, instructions):
+        self._update(user_id, "personas", persona_name, instructions)
+
+    def remove_persona(self, user_id, persona_name):
+        self._update(user_id, "personas", persona_name, remove=True)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id)
+
+
+@st.cache_resource
+def get_user_data_cache():
+    """Process-wide UserDataCache shared by all sessions."""
+    return UserDataCache()
@@ -0,0 +1,232 @@
+"""Write-behind buffer that coalesces Firestore writes per document.
+
+A single chat turn saves the same chat document several times in a row (user
+message, partial-response recovery, final response). Instead of issuing each
+save synchronously on the script thread, writes are queued here, merged per
+document path within a short window and committed from a background thread
+with Firestore batched writes.
+"""
+import threading
+import time
+
+from google.cloud.firestore_v1.transforms import DELETE_FIELD
+
+from backend import metrics
+
+FLUSH_WINDOW_SECONDS = 0.5
+MAX_PENDING_DOCUMENTS = 200
+BATCH_LIMIT = 500  # Firestore's maximum number of writes per batch
+MAX_RETRIES = 3
+
+
+def _deep_merge(base: dict, update: dict, keep_deletes: bool = True) -> dict:
+    """Merge two field maps the way Firestore's set(..., merge=True) does.
+
+    With keep_deletes=False the result is a full document for a replacing set:
+    DELETE_FIELD removes the key instead of being carried over, since Firestore
+    rejects the sentinel in a set without merge.
+    """
+    merged = dict(base)
+    for key, value in update.items():
+        if value is DELETE_FIELD and not keep_deletes:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _deep_merge(merged[key], value, keep_deletes)
+        elif isinstance(value, dict) and not keep_deletes:
+            merged[key] = _deep_merge({}, value, keep_deletes)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _combine(old: dict, new: dict) -> dict:
+    """Collapse two consecutive writes to the same document into one."""
+    if new["op"] == "delete" or not new["merge"]:
+        return new
+    if old["op"] == "delete":
+        # Delete followed by a merge-set leaves exactly the new fields.
+        return {"op": "set", "data": _deep_merge({}, new["data"], keep_deletes=False), "merge": False}
+    return {"op": "set", "data": _deep_merge(old["data"], new["data"], keep_deletes=old["merge"]),
+            "merge": old["merge"]}
+
+
+class WriteBehindBuffer:
+    """Coalesces writes per document path and commits them in batches.
+
+    Args:
+        get_db: Callable returning the Firestore client.
+        window: Seconds a write may wait for later writes to the same document.
+        max_pending: Maximum number of distinct documents queued. Writers to a
+            new document block until the flusher makes room (backpressure).
+    """
+
+    def __init__(self, get_db, window=FLUSH_WINDOW_SECONDS, max_pending=MAX_PENDING_DOCUMENTS):
+        self._get_db = get_db
+        self._window = window
+        self._max_pending = max_pending
+        self._pending = {}  # path -> {"op", "data", "merge"}, insertion-ordered
+        self._committing = {}  # the batch being committed, same shape
+        self._oldest = None
+        self._inflight = 0
+        self._flush_requested = False
+        self._flush_prefixes = []  # paths of prefix flushes in progress
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+        self._thread.start()
+
+    def set(self, path: str, data: dict, merge: bool = True):
+        """Queue a set() of `data` on the document at `path`."""
+        self._enqueue(path, {"op": "set", "data": dict(data), "merge": merge})
+
+    def delete(self, path: str):
+        """Queue a delete of the document at `path`."""
+        self._enqueue(path, {"op": "delete", "data": None, "merge": False})
+
+    def flush(self, timeout: float | None = None, prefix: str | None = None) -> bool:
+        """Commit everything queued so far. Returns False on timeout.
+
+        With `prefix`, only writes to paths starting with it are committed
+        early (and waited for); other documents keep their window.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if prefix is None:
+                self._flush_requested = True
+            else:
+                self._flush_prefixes.append(prefix)
+            self._cond.notify_all()
+            try:
+                while self._unflushed(prefix):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                if prefix is not None:
+                    self._flush_prefixes.remove(prefix)
+        return True
+
+    def _unflushed(self, prefix):
+        """Whether writes (under `prefix`) are queued or committing. Caller holds the lock."""
+        if prefix is None:
+            return bool(self._pending or self._inflight)
+        return any(path.startswith(prefix) for path in (*self._pending, *self._committing))
+
+    def close(self, timeout: float | None = 10):
+        """Flush outstanding writes and stop the background thread."""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def pending(self, path: str):
+        """The write to `path` not yet committed ({"op", "data", "merge"}), or None."""
+        with self._cond:
+            write = self._pending.get(path) or self._committing.get(path)
+            return None if write is None else dict(write)
+
+    def pending_count(self) -> int:
+        """Number of distinct documents waiting to be committed."""
+        with self._cond:
+            return len(self._pending)
+
+    def _enqueue(self, path, write):
+        metrics.incr("firestore.writes.requested")
+        with self._cond:
+            while path not in self._pending and len(self._pending) >= self._max_pending:
+                metrics.incr("firestore.writes.backpressure_waits")
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait()
+            if path in self._pending:
+                metrics.incr("firestore.writes.merged")
+                self._pending[path] = _combine(self._pending[path], write)
+            else:
+                self._pending[path] = write
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify_all()
+
+    def _take_batch(self):
+        """Wait for work, then pop up to BATCH_LIMIT writes. Caller holds the lock."""
+        early = False  # only the writes of a prefix flush, the rest keep their window
+        while True:
+            if self._pending:
+                due = self._oldest + self._window
+                now = time.monotonic()
+                if self._flush_requested or self._closed or now >= due:
+                    paths = list(self._pending)[:BATCH_LIMIT]
+                    break
+                if self._flush_prefixes:
+                    prefixes = tuple(self._flush_prefixes)
+                    paths = [path for path in self._pending if path.startswith(prefixes)][:BATCH_LIMIT]
+                    if paths:
+                        early = True
+                        break
+                self._cond.wait(due - now)
+            elif self._closed:
+                return None
+            else:
+                self._flush_requested = False
+                self._cond.wait()
+        batch = [(path, self._pending.pop(path)) for path in paths]
+        self._committing = dict(batch)
+        if not self._pending:
+            self._oldest = None
+        elif not early:
+            self._oldest = time.monotonic()
+        self._inflight += 1
+        self._cond.notify_all()  # wake writers blocked on backpressure
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            finally:
+                with self._cond:
+                    self._committing = {}
+                    self._inflight -= 1
+                    if not self._pending:
+                        self._flush_requested = False
+                    self._cond.notify_all()
+
+    def _commit(self, batch):
+        db = self._get_db()
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                started = time.perf_counter()
+                wb = db.batch()
+                for path, write in batch:
+                    ref = db.document(path)
+                    if write["op"] == "delete":
+                        wb.delete(ref)
+                    else:
+                        wb.set(ref, write["data"], merge=write["merge"])
+                wb.commit()
+                metrics.record_timing("firestore.batch_commit", time.perf_counter() - started)
+                metrics.incr("firestore.batches.committed")
+                metrics.incr("firestore.writes.issued", len(batch))
+                return
+            except ValueError as e:
+                # The client rejected a write before sending anything; retrying
+                # cannot help, so commit the writes one by one and lose only that one.
+                if len(batch) == 1:
+                    metrics.incr("firestore.writes.dropped")
+                    print(f"Dropped invalid buffered write to {batch[0][0]}: {e}")
+                    return
+                print(f"Invalid write in batch, committing {len(batch)} writes one by one: {e}")
+                for write in batch:
+                    self._commit([write])
+                return
+            except Exception as e:
+                print(f"Error committing write batch (attempt {attempt}/{MAX_RETRIES}): {e}")
+                if attempt < MAX_RETRIES:
+                    time.sleep(0.2 * 2 ** attempt)
+        metrics.incr("firestore.writes.dropped", len(batch))
+        print(f"Dropped {len(batch)} buffered writes after {MAX_RETRIES} attempts")
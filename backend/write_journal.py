@@ -0,0 +1,268 @@
+"""Durable local journal of chat saves, replayed to Firestore in the background.
+
+A chat save first lands here: the entry is appended to a local SQLite file and
+fsynced before the save returns, so a slow or unreachable Firestore neither
+blocks the UI nor loses the answer that was just generated. Appends arriving
+within `group_window` of each other share one transaction and one fsync.
+
+A replay thread applies entries to the remote store. Every entry holds the
+full state of its document (a whole chat), so applying one twice is harmless
+and only the newest entry per key is applied; older ones are superseded.
+Applied entries are deleted, and the file is checkpointed whenever the
+journal runs empty. A failed apply is retried with exponential backoff, for
+as long as it takes; entries left over at exit are replayed by the next
+process that opens the journal.
+
+The file is opened in exclusive locking mode, so every worker process needs
+its own `write_journal_path`.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from backend import metrics
+from backend.timeutil import now_ms
+
+GROUP_COMMIT_SECONDS = 0.005
+REPLAY_WINDOW_SECONDS = 0.5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_ms INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_ms INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_key ON entries (key, seq);
+"""
+
+
+class WriteJournal:
+    """Append-only journal with group commit and an idempotent replayer.
+
+    Args:
+        path: SQLite file of the journal.
+        appliers: {kind: callable(payload)} writing one entry to the remote
+            store. An applier must raise if the write did not happen.
+        group_window: Seconds an append waits for others to share its fsync.
+        replay_window: Seconds new entries wait before replay, so repeated
+            saves of the same chat are applied once.
+    """
+
+    def __init__(self, path, appliers, group_window=GROUP_COMMIT_SECONDS, replay_window=REPLAY_WINDOW_SECONDS):
+        self._appliers = appliers
+        self._group_window = group_window
+        self._replay_window = replay_window
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = FULL")
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._apply_lock = threading.Lock()  # held while an entry is being applied
+        self._cond = threading.Condition()
+        self._queue = []  # rows waiting for the next group commit
+        self._tickets = 0  # appends queued so far
+        self._durable = 0  # appends committed (or failed) so far
+        self._failures = {}  # ticket -> error of a failed group commit
+        self._replay_requested = True  # replay what an earlier process left behind
+        self._flush_requested = False
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="write-journal", daemon=True)
+        self._replayer = threading.Thread(target=self._replay_loop, name="journal-replay", daemon=True)
+        self._writer.start()
+        self._replayer.start()
+
+    def append(self, kind, key, payload):
+        """Durably record `payload` as the newest state of `key`.
+
+        Returns once the entry is fsynced; raises sqlite3.Error if it could
+        not be written.
+        """
+        row = (kind, key, json.dumps(payload), now_ms())
+        started = time.perf_counter()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write journal is closed")
+            self._queue.append(row)
+            self._tickets += 1
+            ticket = self._tickets
+            self._cond.notify_all()
+            while self._durable < ticket:
+                self._cond.wait()
+            error = self._failures.pop(ticket, None)
+        if error is not None:
+            raise error
+        metrics.incr("journal.appended")
+        metrics.record_timing("journal.append", time.perf_counter() - started)
+        return ticket
+
+    def pending(self, key):
+        """Payload of the newest entry for `key` not yet applied, or None."""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT payload FROM entries WHERE key = ? ORDER BY seq DESC LIMIT 1", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending_count(self):
+        """Number of entries not yet applied."""
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def discard(self, keys):
+        """Drop unapplied entries of `keys` (their documents are being deleted).
+
+        Waits for an apply in progress, so nothing is recreated afterwards.
+        """
+        keys = list(keys)
+        with self._apply_lock, self._db_lock:
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+
+    def flush(self, timeout=None):
+        """Wait until every entry is applied. Returns False on timeout.
+
+        Also returns False as soon as an entry is waiting for a retry: the
+        remote store is failing, and the entry is safe here meanwhile, so
+        waiting would only block the caller.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+        while self.pending_count():
+            if self._retrying():
+                return False
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            with self._cond:
+                self._flush_requested = True
+                self._cond.notify_all()
+                self._cond.wait(min(remaining, 0.1) if remaining is not None else 0.1)
+        return True
+
+    def _retrying(self):
+        """Whether an entry failed to apply and waits for its next attempt."""
+        with self._db_lock:
+            return self._conn.execute("SELECT 1 FROM entries WHERE attempts > 0 LIMIT 1").fetchone() is not None
+
+    def close(self, timeout=10):
+        """Try to apply outstanding entries, then stop both threads."""
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join(timeout)
+        self._replayer.join(timeout)
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+            time.sleep(self._group_window)  # let concurrent appends join this fsync
+            with self._cond:
+                batch, self._queue = self._queue, []
+            error = None
+            try:
+                with self._db_lock:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        self._conn.executemany(
+                            "INSERT INTO entries (kind, key, payload, created_ms) VALUES (?, ?, ?, ?)", batch
+                        )
+                        self._conn.execute("COMMIT")
+                    except sqlite3.Error:
+                        self._conn.execute("ROLLBACK")
+                        raise
+                metrics.incr("journal.group_commits")
+            except sqlite3.Error as e:
+                print(f"Error writing to the write journal: {e}")
+                error = e
+            with self._cond:
+                first = self._durable + 1
+                self._durable += len(batch)
+                if error is not None:
+                    self._failures.update({ticket: error for ticket in range(first, self._durable + 1)})
+                else:
+                    self._replay_requested = True
+                self._cond.notify_all()
+
+    def _replay_loop(self):
+        next_retry = None
+        while True:
+            with self._cond:
+                while not (self._replay_requested or self._flush_requested or self._closed):
+                    timeout = None if next_retry is None else max(next_retry - time.monotonic(), 0)
+                    if timeout == 0:
+                        break
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                if self._replay_requested:
+                    deadline = time.monotonic() + self._replay_window  # coalesce back-to-back saves
+                    while not (self._flush_requested or self._closed) and deadline > time.monotonic():
+                        self._cond.wait(deadline - time.monotonic())
+                self._replay_requested = self._flush_requested = False
+            delay = self._replay_due()
+            next_retry = None if delay is None else time.monotonic() + delay
+            with self._cond:
+                self._cond.notify_all()
+
+    def _replay_due(self):
+        """Apply the newest due entry of every key. Returns seconds until the next retry."""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT e.seq, e.kind, e.key, e.payload, e.attempts, e.next_attempt_ms FROM entries e "
+                "JOIN (SELECT key, MAX(seq) AS seq FROM entries GROUP BY key) latest ON e.seq = latest.seq "
+                "ORDER BY e.seq"
+            ).fetchall()
+        next_retry_ms = None
+        for seq, kind, key, payload, attempts, next_attempt_ms in rows:
+            if next_attempt_ms > now_ms():
+                next_retry_ms = min(next_retry_ms or next_attempt_ms, next_attempt_ms)
+                continue
+            with self._apply_lock:
+                with self._db_lock:
+                    if self._conn.execute("SELECT 1 FROM entries WHERE seq = ?", (seq,)).fetchone() is None:
+                        continue  # discarded meanwhile
+                try:
+                    started = time.perf_counter()
+                    self._appliers[kind](json.loads(payload))
+                    metrics.record_timing("journal.replay", time.perf_counter() - started)
+                except Exception as e:
+                    attempts += 1
+                    retry_at = now_ms() + int(min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS) * 1000)
+                    print(f"Error replaying journal entry for {key} (attempt {attempts}): {e}")
+                    metrics.incr("journal.replay_failures")
+                    with self._db_lock:
+                        self._conn.execute(
+                            "UPDATE entries SET attempts = ?, next_attempt_ms = ? WHERE seq = ?",
+                            (attempts, retry_at, seq),
+                        )
+                    next_retry_ms = min(next_retry_ms or retry_at, retry_at)
+                    continue
+                with self._db_lock:
+                    superseded = self._conn.execute(
+                        "DELETE FROM entries WHERE key = ? AND seq <= ?", (key, seq)
+                    ).rowcount
+                metrics.incr("journal.replayed")
+                metrics.incr("journal.superseded", superseded - 1)
+        if rows:
+            self._compact()
+        return None if next_retry_ms is None else max(next_retry_ms - now_ms(), 0) / 1000
+
+    def _compact(self):
+        """Shrink the WAL file back to zero once every entry is applied."""
+        with self._db_lock:
+            if self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
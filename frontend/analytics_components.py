@@ -1,27 +1,20 @@
 """Analytics page - renders usage statistics in the main content area."""
 import streamlit as st
 import pandas as pd
-from backend.analytics_service import compute_analytics
+from backend.analytics_cache import get_analytics_cache, load_aggregates
+from backend.analytics_service import compute_analytics, headline_stats
+from backend.timeutil import start_of_day_ms
 
 
-def render_analytics_page():
-    """Render the full analytics dashboard in the main content area."""
-
-    st.markdown("# Analytics")
-    st.caption("Your usage overview")
+def _load_headline(user_id):
+    """Top-row numbers from the storage backend's counters (aggregation queries)."""
+    from backend.storage_service import get_storage
+    storage = get_storage()
+    storage.flush()
+    return headline_stats(storage.chat_totals(user_id), storage.chat_totals(user_id, since=start_of_day_ms()))
 
-    user = st.session_state.get("user")
-    if not user:
-        st.info("Sign in to view your analytics.")
-        return
-
-    chat_sessions = st.session_state.get("chat_sessions", {})
-    stats = compute_analytics(chat_sessions)
-
-    if stats["total_chats"] == 0:
-        st.info("No chat data yet. Start a conversation to see your stats!")
-        return
 
+def _render_headline(stats):
     # ── Summary cards ──
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("Total Chats", stats["total_chats"])
@@ -37,6 +30,44 @@ def render_analytics_page():
     t2.metric("Today's Messages", stats["today_msgs"])
     t3.metric("Words Written", f"{stats['total_user_words']:,}")
 
+
+def render_analytics_page():
+    """Render the full analytics dashboard in the main content area."""
+
+    st.markdown("# Analytics")
+    st.caption("Your usage overview")
+
+    user = st.session_state.get("user")
+    if not user:
+        st.info("Sign in to view your analytics.")
+        return
+
+    # Everything below comes from the user's running aggregates (see
+    # backend/analytics_cache.py), kept up to date as chats are saved and
+    # deleted, so a rerun never reads message bodies. When they are not in
+    # this process's cache yet, the top row renders first from the stored
+    # per-chat counters (aggregation queries) while the aggregates load;
+    # for large histories those are built by the columnar engine of
+    # backend/analytics_frame.py.
+    headline = st.empty()
+    aggregates = get_analytics_cache().lookup(user["user_id"])
+    if aggregates is None:
+        early = _load_headline(user["user_id"])
+        if early and early["total_chats"]:
+            with headline.container():
+                _render_headline(early)
+        with st.spinner("Loading your stats..."):
+            aggregates = load_aggregates(user["user_id"])
+    stats = compute_analytics(aggregates)
+
+    if stats["total_chats"] == 0:
+        headline.empty()
+        st.info("No chat data yet. Start a conversation to see your stats!")
+        return
+
+    with headline.container():
+        _render_headline(stats)
+
     st.markdown("")
     st.markdown("---")
 
@@ -96,3 +127,9 @@ def render_analytics_page():
             "Chats": list(stats["persona_usage"].values()),
         })
         st.bar_chart(df_persona, x="Persona", y="Chats", color="#f59e0b", height=200)
+
+    st.markdown("---")
+    if st.button("🔄 Recount from all chats", key="rebuild_analytics"):
+        with st.spinner("Recounting..."):
+            load_aggregates(user["user_id"], rebuild=True)
+        st.rerun()
@@ -2,7 +2,51 @@
 from pkgutil import get_data
 import streamlit as st
 import uuid
-import datetime
+from backend.lru import LRUCache
+from backend.session_snapshots import mark_changed
+from backend.timeutil import from_ms, now_ms
+
+# Card lists of studied sets kept per session; others are re-fetched on demand
+STUDIED_SETS_LIMIT = 20
+
+
+def _card_cache():
+    """Per-session LRU of card lists, keyed by flashcard set id."""
+    if 'flashcard_cards' not in st.session_state:
+        st.session_state.flashcard_cards = LRUCache(STUDIED_SETS_LIMIT)
+    return st.session_state.flashcard_cards
+
+
+def get_flashcard_cards(set_id):
+    """Return the cards of a saved set, fetching them on first use."""
+    cache = _card_cache()
+    cards = cache.get(set_id)
+    if cards is None:
+        user = st.session_state.get('user')
+        cards = []
+        if user:
+            from backend.storage_service import get_storage
+            cards = get_storage().load_flashcard_cards(user['user_id'], set_id)
+        cache.put(set_id, cards)
+    return cards
+
+
+def remember_flashcard_set(set_id, title, cards):
+    """Record a just-saved set in the listing and the card cache."""
+    st.session_state.flashcard_sets[set_id] = {
+        'title': title,
+        'card_count': len(cards),
+        'updated_ms': now_ms()
+    }
+    mark_changed(st.session_state)
+    _card_cache().put(set_id, list(cards))
+
+
+def forget_flashcard_set(set_id):
+    st.session_state.flashcard_sets.pop(set_id, None)
+    mark_changed(st.session_state)
+    _card_cache().pop(set_id)
+
 
 def render_flashcard_interface():
     """Render the flashcard study interface."""
@@ -250,21 +294,15 @@ def render_flashcard_interface():
                         # Auto-save if user is logged in
                         user = st.session_state.get('user')
                         if user:
-                            from backend.firebase_service import save_flashcards_to_firestore, load_user_flashcards
-                            st.session_state.flashcard_sets = load_user_flashcards(user['user_id'])
+                            from backend.storage_service import get_storage
                             title = topic[:50] if topic else "Flashcard Set"
-                            save_flashcards_to_firestore(
+                            get_storage().save_flashcard_set(
                                 user['user_id'],
                                 st.session_state.current_flashcard_id,
                                 flashcards,
                                 title
                             )
-                            # Add to local session
-                            st.session_state.flashcard_sets[st.session_state.current_flashcard_id] = {
-                                'title': title,
-                                'cards': flashcards,
-                                'timestamp': datetime.datetime.now()
-                            }
+                            remember_flashcard_set(st.session_state.current_flashcard_id, title, flashcards)
                             st.success(f"✅ Flashcards saved!")
                         
                         st.rerun()
@@ -278,24 +316,35 @@ def render_flashcard_interface():
                 with st.expander(f"📖 {set_data.get('title', 'Untitled Set')}", expanded=False):
                     col1, col2 = st.columns([3, 1])
                     with col1:
-                        cards_in_set = set_data.get('cards', [])
-                        st.write(f"Total cards: {len(set_data.get('cards', []))}")
-                        st.caption(f"Created: {set_data.get('timestamp')}")
+                        st.write(f"Total cards: {set_data.get('card_count', 0)}")
+                        if set_data.get('updated_ms'):
+                            st.caption(f"Updated: {from_ms(set_data['updated_ms']):%b %d, %Y %H:%M}")
                     with col2:
-                        # LOADING LOGIC: Clicking this loads the set into the active session
+                        # LOADING LOGIC: cards are fetched only when a set is studied
                         if st.button("Study Now", key=f"load_{set_id}", use_container_width=True):
-                            st.session_state.flashcards = set_data['cards']
+                            st.session_state.flashcards = get_flashcard_cards(set_id)
                             st.session_state.current_flashcard_id = set_id
                             st.session_state.current_card_index = 0
                             st.session_state.card_flipped = False
                             st.rerun()
                         
                         if st.button("Delete", key=f"del_{set_id}", use_container_width=True):
-                            from backend.firebase_service import delete_flashcards_from_firestore
-                            delete_flashcards_from_firestore(st.session_state.user['user_id'], set_id)
-                            del st.session_state.flashcard_sets[set_id]
+                            from backend.storage_service import get_storage
+                            get_storage().delete_flashcard_set(st.session_state.user['user_id'], set_id)
+                            forget_flashcard_set(set_id)
                             st.rerun()
                     st.markdown("---")
+
+            if st.session_state.get('flashcard_list_cursor') is not None:
+                if st.button("Load more sets", key="load_more_flashcards"):
+                    from backend.storage_service import get_storage
+                    more_sets, next_cursor = get_storage().load_flashcard_list(
+                        user['user_id'], cursor=st.session_state.flashcard_list_cursor
+                    )
+                    st.session_state.flashcard_sets.update(more_sets)
+                    st.session_state.flashcard_list_cursor = next_cursor
+                    mark_changed(st.session_state)
+                    st.rerun()
                             
         # Tips section
         st.markdown("---")
@@ -329,7 +378,7 @@ def render_flashcard_interface():
             with col2:
                 user = st.session_state.get('user')
                 if user and st.button("💾 Save Set", key="save_flashcards", help="Save this flashcard set"):
-                    from backend.firebase_service import save_flashcards_to_firestore
+                    from backend.storage_service import get_storage
                     
                     # Get or create flashcard ID
                     if not st.session_state.current_flashcard_id:
@@ -338,20 +387,15 @@ def render_flashcard_interface():
                     # Generate title from first card
                     title = st.session_state.flashcards[0]['question'][:50] + "..."
                     
-                    # Save to Firestore
-                    save_flashcards_to_firestore(
+                    # Save to storage
+                    get_storage().save_flashcard_set(
                         user['user_id'],
                         st.session_state.current_flashcard_id,
                         st.session_state.flashcards,
                         title
                     )
                     
-                    # Add to local session
-                    st.session_state.flashcard_sets[st.session_state.current_flashcard_id] = {
-                        'title': title,
-                        'cards': st.session_state.flashcards,
-                        'timestamp': datetime.datetime.now()
-                    }
+                    remember_flashcard_set(st.session_state.current_flashcard_id, title, st.session_state.flashcards)
                     
                     st.success("✅ Flashcards saved!")
                     st.rerun()
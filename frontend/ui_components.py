@@ -2,62 +2,206 @@
 import streamlit as st
 import datetime
 import uuid
-import textwrap
 import os
 import json
 from backend.auth_service import get_authorization_url
+from backend.lru import LRUCache
+from backend.personas import PERSONAS, get_persona_registry
+from backend.session_snapshots import mark_changed
+from backend.timeutil import from_ms, start_of_day_ms
 
+# Number of opened chats whose messages are kept in memory per session
+OPEN_CHATS_LIMIT = 20
+
+# Archived chats listed in the sidebar at most (search finds the rest)
+ARCHIVED_CHATS_SHOWN = 50
+
+
+def _open_chats():
+    """Per-session LRU of message lists for chats the user has opened."""
+    if 'open_chats' not in st.session_state:
+        st.session_state.open_chats = LRUCache(OPEN_CHATS_LIMIT)
+    return st.session_state.open_chats
+
+
+def get_chat_messages(session_id):
+    """Return a chat's messages, fetching them from Firestore on first open."""
+    session_data = st.session_state.chat_sessions.get(session_id, {})
+    if "messages" in session_data:
+        # Guest chats only exist in session state
+        return session_data["messages"]
+    cache = _open_chats()
+    messages = cache.get(session_id)
+    if messages is None:
+        user = st.session_state.get('user')
+        if user:
+            from backend.storage_service import get_storage
+            messages = get_storage().load_chat_messages(user['user_id'], session_id)
+        else:
+            messages = []
+        cache.put(session_id, messages)
+    return messages
+
+
+def remember_chat_messages(session_id, messages):
+    """Record the latest messages of a chat after it changed locally."""
+    session_data = st.session_state.chat_sessions[session_id]
+    session_data["message_count"] = len(messages)
+    mark_changed(st.session_state)
+    if st.session_state.get('user'):
+        # Signed-in chats can be re-fetched, so keep them in the bounded LRU
+        _open_chats().put(session_id, messages.copy())
+        session_data.pop("messages", None)
+    else:
+        session_data["messages"] = messages.copy()
+
+
+def forget_chat(session_id):
+    """Drop a chat from the sidebar list and the opened-chat cache."""
+    st.session_state.chat_sessions.pop(session_id, None)
+    mark_changed(st.session_state)
+    _open_chats().pop(session_id)
+
+
+def _delete_chat(user, session_id):
+    """Sidebar "×": drop the chat now and delete it in the background."""
+    forget_chat(session_id)
+    if user:
+        from backend.chat_cleanup import start_chat_deletion
+        st.session_state.chat_cleanup_job = start_chat_deletion(user['user_id'], [session_id])
+    if st.session_state.current_session_id == session_id:
+        st.session_state.current_session_id = None
+        st.session_state.messages = []
+    st.rerun()
+
+
+def _finish_chat_cleanup(job):
+    """Apply a finished bulk deletion to session state."""
+    for session_id in job.deleted_ids:
+        forget_chat(session_id)
+        if st.session_state.get('current_session_id') == session_id:
+            st.session_state.current_session_id = None
+            st.session_state.messages = []
+    if job.state == "failed":
+        st.session_state.chat_cleanup_notice = f"❌ Deleted {len(job.deleted_ids)} chats, then failed: {job.error}"
+    else:
+        notice = f"✅ Deleted {len(job.deleted_ids)} chat{'' if len(job.deleted_ids) == 1 else 's'}"
+        if job.files_deleted:
+            notice += f" and {job.files_deleted} uploaded files"
+        st.session_state.chat_cleanup_notice = notice
+    st.session_state.pop('cleanup_selected', None)
+    st.session_state.pop('archived_chats', None)
+    st.session_state.pop('archive_results', None)
+    del st.session_state.chat_cleanup_job
+
+
+@st.fragment(run_every=1)
+def _render_chat_cleanup_progress():
+    """Poll the running bulk deletion without rerunning the whole app."""
+    job = st.session_state.get('chat_cleanup_job')
+    if job is None:
+        return
+    if not job.finished:
+        label = "Removing uploaded files..." if job.state == "deleting_files" else f"Deleting chats... {job.done}/{job.total}"
+        st.progress(job.fraction, text=label)
+        return
+    _finish_chat_cleanup(job)
+    st.rerun()
+
+
+def render_chat_cleanup(user):
+    """Sidebar expander to delete selected chats, or all chats older than a date."""
+    if 'chat_cleanup_job' in st.session_state:
+        with st.sidebar:
+            _render_chat_cleanup_progress()
+        return
+    notice = st.session_state.pop('chat_cleanup_notice', None)
+    if notice:
+        st.sidebar.caption(notice)
+
+    with st.sidebar.expander("🗑️ Clean up chats"):
+        sessions = st.session_state.get('chat_sessions', {})
+        selected = st.multiselect(
+            "Chats to delete",
+            options=list(sessions),
+            format_func=lambda session_id: sessions[session_id].get('title', 'Untitled'),
+            key="cleanup_selected",
+        )
+        by_date = st.checkbox("Instead, delete all chats older than:", key="cleanup_by_date")
+        cutoff = st.date_input(
+            "Cutoff date",
+            value=datetime.date.today() - datetime.timedelta(days=30),
+            key="cleanup_before",
+            disabled=not by_date,
+            label_visibility="collapsed",
+        )
+        label = f"Delete chats before {cutoff:%b %d, %Y}" if by_date else f"Delete {len(selected)} chats"
+        if st.button(label, key="cleanup_start", disabled=not (by_date or selected), use_container_width=True):
+            from backend.chat_cleanup import start_chat_deletion
+            if by_date:
+                job = start_chat_deletion(user['user_id'], before=start_of_day_ms(cutoff))
+            else:
+                job = start_chat_deletion(user['user_id'], chat_ids=selected)
+            st.session_state.chat_cleanup_job = job
+            st.rerun()
+
+
+def _open_archived_chat(user, session_id):
+    """Restore an archived chat to the hot collection and open it."""
+    from backend.storage_service import get_storage
+    restored = get_storage().restore_chat(user['user_id'], session_id)
+    if restored is None:
+        st.session_state.archive_notice = "❌ Could not restore this chat."
+        st.rerun()
+    metadata, messages = restored
+    st.session_state.chat_sessions[session_id] = metadata
+    mark_changed(st.session_state)
+    _open_chats().put(session_id, messages.copy())
+    st.session_state.get('archived_chats', {}).pop(session_id, None)
+    st.session_state.pop('archive_results', None)
+    st.session_state.current_session_id = session_id
+    st.session_state.messages = messages.copy()
+    st.session_state.flashcard_mode = False
+    st.rerun()
+
+
+def render_archived_chats(user):
+    """Sidebar expander to search and reopen chats moved to the cold archive."""
+    notice = st.session_state.pop('archive_notice', None)
+    if notice:
+        st.sidebar.caption(notice)
+
+    with st.sidebar.expander("🗄️ Archived chats"):
+        from backend.storage_service import get_storage
+        search = st.text_input(
+            "Search archived chats", key="archive_search",
+            placeholder="Search titles and messages", label_visibility="collapsed",
+        ).strip()
+        if search:
+            # Searching decompresses the archives, so keep the last result
+            if st.session_state.get('archive_results', (None,))[0] != search:
+                st.session_state.archive_results = (
+                    search, get_storage().search_archived_chats(user['user_id'], search)
+                )
+            chats = st.session_state.archive_results[1]
+        elif 'archived_chats' in st.session_state:
+            chats = st.session_state.archived_chats
+        else:
+            if st.button("Show archived chats", key="archive_show", use_container_width=True):
+                st.session_state.archived_chats = get_storage().load_archived_chat_list(user['user_id'])
+                st.rerun()
+            return
+
+        if not chats:
+            st.caption("No matches" if search else "No archived chats")
+            return
+        for session_id, chat in list(chats.items())[:ARCHIVED_CHATS_SHOWN]:
+            label = chat.get('title') or 'Untitled'
+            if chat.get('updated_ms'):
+                label += f" · {from_ms(chat['updated_ms']):%b %d, %Y}"
+            if st.button(label, key=f"archived_{session_id}", use_container_width=True):
+                _open_archived_chat(user, session_id)
 
-# Predefined personas - detailed descriptions from backup
-PERSONAS = {
-    "Default": textwrap.dedent("""
-        - You are Buddy, an advanced multimodal AI assistant functioning as an "Instant Second Brain."
-        - You can help with general questions, coding, problem-solving, explanations, and any topic the user needs assistance with.
-        - When users upload files (PDFs, videos, audio), you excel at analyzing them with specific timestamped references, direct citations, and page numbers.
-        - For video and audio files, include timestamps (e.g., "At 12:35") when referencing specific moments.
-        - For PDFs, cite page numbers and quote relevant text directly from the document.
-        - Be helpful, clear, and informative whether answering general questions or analyzing uploaded content.
-        - Use markdown formatting including headers (##), bullet points, code blocks, and emphasis.
-        - For general questions, provide concise yet thorough answers with examples when helpful.
-        - For uploaded content, be thorough and precise - users rely on you for accurate information extraction.
-        - Support analysis of large files: PDFs up to 100+ pages, videos up to 2 hours, and extensive audio files.
-        - Leverage multimodal capabilities for deep visual and audio understanding when files are provided.
-    """),
-    
-    "Academic": textwrap.dedent("""
-        - You are Professor Buddy, an academic AI assistant with expertise across multiple disciplines.
-        - Adopt a scholarly, formal tone with precise terminology and well-structured explanations.
-        - Always cite sources, provide references, and explain concepts with academic rigor.
-        - Break down complex topics into logical steps, define technical terms, and use examples from research.
-        - When analyzing documents, provide critical analysis, identify methodologies, and evaluate arguments.
-        - For PDFs and papers, reference page numbers, quote directly, and analyze academic writing style.
-        - Support students and researchers with literature reviews, study assistance, and research guidance.
-        - Use markdown for structured content: headers for sections, bullet points for key concepts, and code blocks for formulas.
-    """),
-    
-    "Friendly": textwrap.dedent("""
-        - You are Buddy, a warm and approachable AI friend who's here to help with anything!
-        - Use a casual, conversational tone - like chatting with a supportive friend over coffee.
-        - Be encouraging, empathetic, and add a touch of humor when appropriate (but never offensive).
-        - Use emojis occasionally to add personality and warmth to responses. ✨
-        - When explaining things, use everyday language and relatable analogies.
-        - Celebrate user's progress and achievements, offer encouragement during challenges.
-        - For document analysis, maintain thoroughness but present findings in an accessible, friendly way.
-        - Make learning fun and engaging - you're not just informative, you're a joy to interact with!
-    """),
-    
-    "Personal Therapist": textwrap.dedent("""
-        - You are Dr. Buddy, a compassionate and empathetic AI therapist providing emotional support.
-        - Use a gentle, understanding, and non-judgmental tone in all interactions.
-        - Practice active listening - acknowledge feelings, validate emotions, and show genuine care.
-        - Ask thoughtful questions to help users explore their thoughts and feelings deeper.
-        - Provide coping strategies, mindfulness techniques, and emotional regulation tools when appropriate.
-        - Maintain boundaries: remind users you're an AI and encourage professional help for serious concerns.
-        - Be patient, supportive, and create a safe space for users to express themselves.
-        - Use reflective statements and empathetic language: "I hear that...", "It sounds like...", "That must feel..."
-        - Note: For document analysis in this mode, maintain therapeutic tone while providing insights.
-    """)
-}
 
 def load_css(file_path):
     """Read css file and return as markdown string."""
@@ -362,41 +506,17 @@ def render_sidebar(user):
         st.sidebar.markdown("##### Chat History")
         
         if st.session_state.get('chat_sessions'):
-            def get_sortable_timestamp(timestamp):
-                """Convert various timestamp formats to a sortable value."""
-                if timestamp is None:
-                    return 0
-                if isinstance(timestamp, str):
-                    try:
-                        return datetime.datetime.fromisoformat(timestamp).timestamp()
-                    except Exception:
-                        return 0
-                if hasattr(timestamp, 'timestamp'):
-                    return timestamp.timestamp()
-                return 0
-            
             today_chats = []
             older_chats = []
-            today = datetime.datetime.now().date()
-            
+            today_start = start_of_day_ms()
+            deleting = 'chat_cleanup_job' in st.session_state  # one deletion job at a time
+
             for session_id, session_data in sorted(
                 st.session_state.chat_sessions.items(),
-                key=lambda x: get_sortable_timestamp(x[1].get("timestamp")),
+                key=lambda x: x[1].get("updated_ms") or 0,
                 reverse=True
             ):
-                timestamp = session_data.get("timestamp")
-                if timestamp:
-                    try:
-                        if isinstance(timestamp, str):
-                            chat_date = datetime.datetime.fromisoformat(timestamp).date()
-                        else:
-                            chat_date = timestamp.date() if hasattr(timestamp, 'date') else datetime.datetime.now().date()
-                    except Exception:
-                        chat_date = datetime.datetime.now().date()
-                else:
-                    chat_date = datetime.datetime.now().date()
-                
-                if chat_date == today:
+                if (session_data.get("updated_ms") or 0) >= today_start:
                     today_chats.append((session_id, session_data))
                 else:
                     older_chats.append((session_id, session_data))
@@ -412,20 +532,13 @@ def render_sidebar(user):
                             use_container_width=True
                         ):
                             st.session_state.current_session_id = session_id
-                            st.session_state.messages = session_data["messages"].copy()
+                            st.session_state.messages = get_chat_messages(session_id).copy()
                             if 'flashcard_mode' in st.session_state:
                                 st.session_state.flashcard_mode = False
                             st.rerun()
                     with col2:
-                        if st.button("×", key=f"delete_{session_id}", help="Delete"):
-                            del st.session_state.chat_sessions[session_id]
-                            if user:
-                                from backend.firebase_service import delete_chat_from_firestore
-                                delete_chat_from_firestore(user['user_id'], session_id)
-                            if st.session_state.current_session_id == session_id:
-                                st.session_state.current_session_id = None
-                                st.session_state.messages = []
-                            st.rerun()
+                        if st.button("×", key=f"delete_{session_id}", help="Delete", disabled=deleting):
+                            _delete_chat(user, session_id)
             
             if older_chats:
                 st.sidebar.markdown("**Earlier**")
@@ -438,29 +551,37 @@ def render_sidebar(user):
                             use_container_width=True
                         ):
                             st.session_state.current_session_id = session_id
-                            st.session_state.messages = session_data["messages"].copy()
+                            st.session_state.messages = get_chat_messages(session_id).copy()
                             if 'flashcard_mode' in st.session_state:
                                 st.session_state.flashcard_mode = False
                             st.rerun()
                     with col2:
-                        if st.button("×", key=f"delete_{session_id}", help="Delete"):
-                            del st.session_state.chat_sessions[session_id]
-                            if user:
-                                from backend.firebase_service import delete_chat_from_firestore
-                                delete_chat_from_firestore(user['user_id'], session_id)
-                            if st.session_state.current_session_id == session_id:
-                                st.session_state.current_session_id = None
-                                st.session_state.messages = []
-                            st.rerun()
+                        if st.button("×", key=f"delete_{session_id}", help="Delete", disabled=deleting):
+                            _delete_chat(user, session_id)
+
+            if user and st.session_state.get('chat_list_cursor') is not None:
+                if st.sidebar.button("Load more", key="load_more_chats", use_container_width=True):
+                    from backend.storage_service import get_storage
+                    more_chats, next_cursor = get_storage().load_chat_list(
+                        user['user_id'], cursor=st.session_state.chat_list_cursor
+                    )
+                    st.session_state.chat_sessions.update(more_chats)
+                    st.session_state.chat_list_cursor = next_cursor
+                    mark_changed(st.session_state)
+                    st.rerun()
         else:
             st.sidebar.caption("No chats yet")
 
+        if user:
+            render_archived_chats(user)
+            render_chat_cleanup(user)
+
                 # Show saved flashcard sets if user is logged in
         if st.user and st.session_state.get('flashcard_sets'):
             st.sidebar.markdown("##### 📚 Saved Flashcard Sets")
             for flashcard_id, flashcard_data in sorted(
                 st.session_state.flashcard_sets.items(),
-                key=lambda x: x[1].get("timestamp", datetime.datetime.now()),
+                key=lambda x: x[1].get("updated_ms") or 0,
                 reverse=True
                 )[:5]:  # Show only 5 most recent
                 col1, col2 = st.sidebar.columns([4, 1])
@@ -470,7 +591,8 @@ def render_sidebar(user):
                         key=f"flashcard_{flashcard_id}",
                         use_container_width=True
                 ):
-                        st.session_state.flashcards = flashcard_data['cards']
+                        from frontend.flashcard_components import get_flashcard_cards
+                        st.session_state.flashcards = get_flashcard_cards(flashcard_id)
                         st.session_state.current_card_index = 0
                         st.session_state.card_flipped = False
                         st.session_state.current_flashcard_id = flashcard_id
@@ -478,10 +600,11 @@ def render_sidebar(user):
                         st.rerun()
                 with col2:
                     if st.sidebar.button("×", key=f"delete_flashcard_{flashcard_id}", help="Delete"):
-                        from backend.firebase_service import delete_flashcards_from_firestore
-                        delete_flashcards_from_firestore(st.user['user_id'], flashcard_id)
-                        del st.session_state.flashcard_sets[flashcard_id]
-                st.rerun()
+                        from backend.storage_service import get_storage
+                        from frontend.flashcard_components import forget_flashcard_set
+                        get_storage().delete_flashcard_set(st.user['user_id'], flashcard_id)
+                        forget_flashcard_set(flashcard_id)
+                        st.rerun()
 
     
     elif active_tab == 'analytics':
@@ -493,18 +616,19 @@ def render_sidebar(user):
         if user:
             st.sidebar.markdown("##### 🎭 Prompt Model")
             
-            # Combine default personas with custom personas from Firebase
-            all_personas = {**PERSONAS, **st.session_state.get('custom_personas', {})}
+            # Default and custom personas, merged once per version by the registry
+            personas = get_persona_registry().resolve(user['user_id'], st.session_state.get('custom_personas', {}))
+            current = st.session_state.get('selected_persona', 'Default')
             selected = st.sidebar.selectbox(
                 "Choose a persona:",
-                options=list(all_personas.keys()),
-                index=list(all_personas.keys()).index(st.session_state.get('selected_persona', 'Default')),
+                options=personas.names,
+                index=personas.names.index(current) if current in personas.merged else 0,
                 label_visibility="collapsed"
             )
             st.session_state.selected_persona = selected
             
             # Show current persona description
-            current_desc = all_personas.get(selected, "")
+            current_desc = personas.merged.get(selected, "")
             preview = current_desc.strip().split('\n')[0][:80] + "..." if current_desc.strip() else ""
             if preview:
                 st.sidebar.caption(preview)
@@ -535,11 +659,10 @@ def render_sidebar(user):
                             if persona_name in PERSONAS:
                                 st.error("❌ Can't override default personas!")
                             else:
-                                # Import Firebase functions
-                                from backend.firebase_service import save_persona_to_firestore
+                                from backend.storage_service import get_storage
                                 
-                                # Save to Firebase
-                                success = save_persona_to_firestore(
+                                # Save to storage
+                                success = get_storage().save_persona(
                                     user['user_id'],
                                     persona_name,
                                     persona_instructions
@@ -550,6 +673,7 @@ def render_sidebar(user):
                                     if 'custom_personas' not in st.session_state:
                                         st.session_state.custom_personas = {}
                                     st.session_state.custom_personas[persona_name] = persona_instructions
+                                    mark_changed(st.session_state)
                                     st.session_state.selected_persona = persona_name
                                     
                                     st.success(f"✅ Persona '{persona_name}' saved!")
@@ -561,22 +685,22 @@ def render_sidebar(user):
                 
                 with col2:
                     # Only show delete for custom personas (not default ones)
-                    if st.session_state.selected_persona in st.session_state.get('custom_personas', {}):
+                    if st.session_state.selected_persona in personas.custom:
                         if st.button("🗑️ Delete", key="delete_persona_btn", use_container_width=True):
-                            # Import Firebase functions
-                            from backend.firebase_service import delete_persona_from_firestore
+                            from backend.storage_service import get_storage
                             
                             persona_to_delete = st.session_state.selected_persona
                             
-                            # Delete from Firebase
-                            success = delete_persona_from_firestore(
+                            # Delete from storage
+                            success = get_storage().delete_persona(
                                 user['user_id'],
                                 persona_to_delete
                             )
                             
                             if success:
                                 # Remove from local session state
-                                del st.session_state.custom_personas[persona_to_delete]
+                                st.session_state.get('custom_personas', {}).pop(persona_to_delete, None)
+                                mark_changed(st.session_state)
                                 st.session_state.selected_persona = 'Default'
                                 
                                 st.success(f"✅ Persona '{persona_to_delete}' deleted!")
@@ -759,7 +883,7 @@ def render_chat_interface():
                             st.session_state.pending_user_input = edited
                             # Update session store
                             if st.session_state.current_session_id:
-                                st.session_state.chat_sessions[st.session_state.current_session_id]["messages"] = st.session_state.messages.copy()
+                                remember_chat_messages(st.session_state.current_session_id, st.session_state.messages)
                             st.rerun()
                     with ec2:
                         if st.button("✖ Cancel", key=f"cancel_edit_{idx}", use_container_width=True):
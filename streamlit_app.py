@@ -7,18 +7,19 @@ import streamlit as st
 import datetime
 import uuid
 import time
-from backend.firebase_service import (
-    save_user_to_firestore, save_chat_to_firestore, load_user_chats, 
-    load_user_flashcards, delete_flashcards_from_firestore,
-    load_user_personas, save_persona_to_firestore, delete_persona_from_firestore,
-    get_db
-)
-from backend.auth_service import (
-    init_google_oauth, get_authorization_url, exchange_code_for_token, verify_google_token
-)
+from backend.storage_service import get_storage
+from backend.hydration import hydrate_user
+from backend.analytics_cache import get_analytics_cache
+from backend.timeutil import now_ms
+from backend.auth_service import init_google_oauth, get_authorization_url
+from backend.login_pipeline import sign_in
+from backend.personas import get_persona_registry
 from backend.gemini_service import get_gemini_client, get_response, get_response_streaming
 from backend.session_store import create_session, get_session, delete_session
-from frontend.ui_components import render_auth_button, render_sidebar, render_chat_interface, PERSONAS
+from backend.session_snapshots import apply_reconciled, get_snapshot_cache, mark_changed, start_reconcile
+from frontend.ui_components import (
+    render_auth_button, render_sidebar, render_chat_interface, remember_chat_messages
+)
 from frontend.flashcard_components import render_flashcard_interface
 from frontend.analytics_components import render_analytics_page
 
@@ -69,6 +70,73 @@ def generate_chat_title(first_message: str, max_length: int = 20) -> str:
     
     return title if title else "New Chat"
 
+
+def save_current_chat(user):
+    """Persist the active chat of a signed-in user."""
+    session_id = st.session_state.current_session_id
+    session_data = st.session_state.chat_sessions[session_id]
+    session_data["updated_ms"] = now_ms()
+    mark_changed(st.session_state)
+    get_storage().save_chat(
+        user['user_id'], session_id, st.session_state.messages,
+        session_data["title"], session_data.get("persona")
+    )
+
+def load_user_data(user, save_profile=False):
+    """Hydrate session state for a signed-in user (reads run in parallel)."""
+    apply_user_data(hydrate_user(user, save_profile=save_profile))
+
+def apply_user_data(data):
+    """Put a hydrate_user result into session state."""
+    st.session_state.chat_sessions = data["chat_sessions"]
+    st.session_state.chat_list_cursor = data["chat_list_cursor"]
+    st.session_state.flashcard_sets = data["flashcard_sets"]
+    st.session_state.flashcard_list_cursor = data["flashcard_list_cursor"]
+    st.session_state.custom_personas = data["custom_personas"]
+    st.session_state.sync_watermark = data["watermark"]
+    st.session_state.hydration_timings = data["timings"]
+    if data["incomplete"]:
+        st.session_state.load_warning = (
+            f"Some of your data took too long to load ({', '.join(data['incomplete'])}). "
+            "Refresh the page to try again."
+        )
+    mark_changed(st.session_state)
+
+def restore_snapshot(token, user):
+    """Hydrate from the session's snapshot and reconcile it in the background.
+
+    Returns False if there is no snapshot for this token.
+    """
+    snapshot = get_snapshot_cache().load(token, user['user_id'])
+    if snapshot is None:
+        return False
+    for key, value in snapshot.items():
+        st.session_state[key] = value
+    st.session_state.snapshot_reconcile = start_reconcile(user, snapshot["sync_watermark"])
+    return True
+
+def finish_reconcile():
+    """Merge a finished background reconcile into session state."""
+    future = st.session_state.get('snapshot_reconcile')
+    if future is None or not future.done():
+        return
+    del st.session_state.snapshot_reconcile
+    try:
+        result = future.result()
+    except Exception as e:
+        print(f"Error reconciling session snapshot: {e}")
+        return
+    if apply_reconciled(st.session_state, result):
+        # Changes came from another process; reload the stored analytics records
+        get_analytics_cache().invalidate(st.session_state.user['user_id'])
+
+@st.fragment(run_every=1)
+def _await_reconcile():
+    """Rerun the app once the background reconcile has finished."""
+    future = st.session_state.get('snapshot_reconcile')
+    if future is not None and future.done():
+        st.rerun()
+
 # Initialize session state
 if "chat_sessions" not in st.session_state:
     st.session_state.chat_sessions = {}
@@ -130,10 +198,24 @@ if st.session_state.get('_signing_out'):
     token = st.query_params.get('session')
     if token:
         delete_session(token)
+        get_snapshot_cache().drop(token)
+    # Start committing chat saves still sitting in the write-behind buffer;
+    # they go out in the background, so signing out never waits on Firestore
+    if st.session_state.user:
+        get_storage().flush(timeout=0)
     # Reset user-related session state
     st.session_state.user = None
     st.session_state.messages = []
     st.session_state.chat_sessions = {}
+    st.session_state.chat_list_cursor = None
+    st.session_state.pop('open_chats', None)
+    st.session_state.pop('flashcard_sets', None)
+    st.session_state.pop('flashcard_list_cursor', None)
+    st.session_state.pop('flashcard_cards', None)
+    st.session_state.pop('archived_chats', None)
+    st.session_state.pop('archive_results', None)
+    st.session_state.pop('snapshot_reconcile', None)
+    st.session_state.pop('sync_watermark', None)
     st.session_state.current_session_id = None
     st.session_state.selected_persona = "Default"
     st.session_state.flashcard_mode = False
@@ -153,17 +235,17 @@ if not user:
         if stored_user:
             st.session_state.user = stored_user
             user = stored_user
-            # Load chats from Firestore for the restored user
-            chats = load_user_chats(stored_user['user_id'])
-            st.session_state.chat_sessions = chats
-
-            # Load user's flashcard sets
-            from backend.firebase_service import load_user_flashcards
-            flashcard_sets = load_user_flashcards(user['user_id'])
-            st.session_state.flashcard_sets = flashcard_sets
-
-            custom_personas = load_user_personas(user['user_id'])
-            st.session_state.custom_personas = custom_personas  
+            if not restore_snapshot(token, user):
+                # Make sure saves from before the refresh are visible to the loads,
+                # without holding up the page for long if Firestore is down
+                get_storage().flush(timeout=2)
+                load_user_data(user)
+
+# Apply the background reconcile of a snapshot restore once it is done
+if 'snapshot_reconcile' in st.session_state:
+    finish_reconcile()
+    if 'snapshot_reconcile' in st.session_state:
+        _await_reconcile()
 
 # Check for OAuth callback
 query_params = st.query_params
@@ -223,59 +305,37 @@ if 'code' in query_params and not user:
     </div>
     """, unsafe_allow_html=True)
 
-    code = query_params['code']
-    token_response = exchange_code_for_token(code)
-    
-    if token_response and 'id_token' in token_response:
-        user_info = verify_google_token(token_response['id_token'])
-        if user_info:
-            # Format user info
-            user = {
-                'user_id': user_info.get('sub', user_info.get('email')),
-                'email': user_info.get('email'),
-                'name': user_info.get('name', ''),
-                'picture': user_info.get('picture', ''),
-                'email_verified': user_info.get('email_verified', False)
-            }
-            
-            st.session_state.user = user
-
-            from backend.firebase_service import load_user_flashcards
-            flash_sets = load_user_flashcards(user['user_id'])
-            st.session_state.flashcard_sets = flash_sets
-            
-            # Save user to Firestore
-            save_user_to_firestore(user)
-            
-            # Load user's previous chats from Firestore
-            chats = load_user_chats(user['user_id'])
-            st.session_state.chat_sessions = chats
-
-            flashcard_sets = load_user_flashcards(user['user_id'])
-            st.session_state.flashcard_sets = flashcard_sets
-
-            # Load user's custom personas  ← ADD THIS
-            custom_personas = load_user_personas(user['user_id'])
-            st.session_state.custom_personas = custom_personas
-            
-            # Create server-side session and put token in URL
-            session_token = create_session(user)
-            st.query_params.clear()
-            st.query_params['session'] = session_token
-            st.rerun()
-        else:
-            st.error("Failed to verify token")
+    # Exchange, verify, save the profile and load data with the steps overlapped
+    login = sign_in(query_params['code'])
+    st.session_state.login_timings = login["timings"]
+    if login["user"]:
+        user = login["user"]
+        st.session_state.user = user
+        apply_user_data(login["data"])
+
+        # Create server-side session and put token in URL
+        session_token = create_session(user)
+        st.query_params.clear()
+        st.query_params['session'] = session_token
+        st.rerun()
+    elif login["error"] == "verify":
+        st.error("Failed to verify token")
 
 # Main layout
 # Always render sidebar on the left
 render_sidebar(user)
 
+if 'load_warning' in st.session_state:
+    st.warning(st.session_state.pop('load_warning'))
+
 if st.session_state.get('sidebar_tab') == 'analytics':
     render_analytics_page()
 elif st.session_state.get('flashcard_mode', False):
-    if user and not st.session_state.get('flashcard_sets'):
-        from backend.firebase_service import load_user_flashcards
-        st.session_state.flashcard_sets = load_user_flashcards(user['user_id'])
+    # Only load if hydration never ran; an empty dict means the user has no sets
+    if user and 'flashcard_sets' not in st.session_state:
+        st.session_state.flashcard_sets, st.session_state.flashcard_list_cursor = \
+            get_storage().load_flashcard_list(user['user_id'])
+        mark_changed(st.session_state)
     render_flashcard_interface()
 else:
 
@@ -307,18 +367,19 @@ else:
             st.session_state.chat_sessions[new_id] = {
                 "title": generate_chat_title(message_to_process),
                 "messages": [],
-                "timestamp": datetime.datetime.now().isoformat(),
+                "updated_ms": now_ms(),
                 "persona": st.session_state.get('selected_persona', 'Default')
             }
+            mark_changed(st.session_state)
         
         # Add user message (only if not already the last message)
         if not st.session_state.messages or st.session_state.messages[-1].get("content") != message_to_process:
             st.session_state.messages.append({"role": "user", "content": message_to_process})
-            st.session_state.chat_sessions[st.session_state.current_session_id]["messages"] = st.session_state.messages.copy()
+            remember_chat_messages(st.session_state.current_session_id, st.session_state.messages)
         
         # Save user part to Firestore
         if user:
-            save_chat_to_firestore(user['user_id'], st.session_state.current_session_id, st.session_state.messages, st.session_state.chat_sessions[st.session_state.current_session_id]["title"])
+            save_current_chat(user)
 
     # STEP 1.5: Recover partial response if generation was stopped mid-stream
     if st.session_state.get('partial_response') and not message_to_process:
@@ -327,9 +388,9 @@ else:
         if partial.strip():
             st.session_state.messages.append({"role": "assistant", "content": partial})
             if st.session_state.current_session_id:
-                st.session_state.chat_sessions[st.session_state.current_session_id]["messages"] = st.session_state.messages.copy()
+                remember_chat_messages(st.session_state.current_session_id, st.session_state.messages)
                 if user:
-                    save_chat_to_firestore(user['user_id'], st.session_state.current_session_id, st.session_state.messages, st.session_state.chat_sessions[st.session_state.current_session_id]["title"])
+                    save_current_chat(user)
         st.session_state.stop_processing = False
         st.session_state.is_processing = False
 
@@ -377,8 +438,11 @@ else:
 
                 # GET STREAMING RESPONSE (Only if not stopped)
                 if not st.session_state.stop_processing:
-                    all_personas = {**PERSONAS, **st.session_state.get('custom_personas', {})}
-                    instruction = all_personas.get(st.session_state.selected_persona, PERSONAS["Default"])
+                    personas = get_persona_registry().resolve(
+                        (st.session_state.user or {}).get('user_id'), st.session_state.get('custom_personas', {})
+                    )
+                    instruction = personas.instruction(st.session_state.selected_persona)
+                    instruction_key = personas.instruction_key(st.session_state.selected_persona)
 
                     # Show "Buddy is thinking..." while waiting for first chunk
                     status_container.markdown("""
@@ -422,7 +486,7 @@ else:
                     # Stream the response in real-time
                     full_response = ""
                     first_chunk = True
-                    for chunk in get_response_streaming(message_to_process, client, gemini_files, system_instruction=instruction, chat_history=history_for_gemini):
+                    for chunk in get_response_streaming(message_to_process, client, gemini_files, system_instruction=instruction, instruction_key=instruction_key, chat_history=history_for_gemini):
                         if st.session_state.stop_processing:
                             break
                         if first_chunk:
@@ -439,13 +503,18 @@ else:
                     if full_response:
                         st.session_state.partial_response = None
                         st.session_state.messages.append({"role": "assistant", "content": full_response})
-                        st.session_state.chat_sessions[st.session_state.current_session_id]["messages"] = st.session_state.messages.copy()
+                        remember_chat_messages(st.session_state.current_session_id, st.session_state.messages)
 
                         st.session_state.queued_files = []
                         st.session_state.uploaded_files = None
 
                         if user:
-                            save_chat_to_firestore(user['user_id'], st.session_state.current_session_id, st.session_state.messages, st.session_state.chat_sessions[st.session_state.current_session_id]["title"])
+                            save_current_chat(user)
+                            if gemini_files:
+                                get_storage().link_chat_files(
+                                    user['user_id'], st.session_state.current_session_id,
+                                    [gemini_file.name for gemini_file in gemini_files]
+                                )
 
                     st.session_state.last_request_time = datetime.datetime.now()
                     st.session_state.is_processing = False
@@ -461,4 +530,9 @@ else:
                 st.session_state.is_processing = False
                 st.session_state.partial_response = None
                 if 'stop_btn_container' in locals():
-                    stop_btn_container.empty()
\ No newline at end of file
+                    stop_btn_container.empty()
+
+# Snapshot the listings so a refresh of this session can restore them instantly
+# (skipped unless they changed, see backend/session_snapshots.py)
+if user and st.query_params.get('session'):
+    get_snapshot_cache().save(st.query_params['session'], user['user_id'], st.session_state)
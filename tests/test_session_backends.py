@@ -0,0 +1,95 @@
+"""Shared session stores (backend/session_backends.py)."""
+from backend.session_backends import KeyValueSessionStore, LocalKeyValue, SQLiteSessionStore
+
+HOUR_MS = 60 * 60 * 1000
+
+
+class Clock:
+    """Wall clock in epoch ms, advanced by hand."""
+
+    def __init__(self):
+        self.now = 1_700_000_000_000
+
+    def __call__(self):
+        return self.now
+
+    def seconds(self):
+        return self.now / 1000
+
+
+def test_sqlite_sessions_are_shared_between_processes(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "sessions.db")
+    first = SQLiteSessionStore(path, sweep_interval=None, clock=clock)
+    second = SQLiteSessionStore(path, sweep_interval=None, clock=clock)
+    token = first.create({"user_id": "u"})
+    assert second.get(token) == {"user_id": "u"}
+    second.delete(token)
+    assert first.get(token) is None
+
+
+def test_sqlite_sessions_expire_and_evict(tmp_path):
+    clock = Clock()
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=10 * 3600, idle_ttl=3600, max_entries=2,
+                               sweep_interval=None, clock=clock)
+    idle = store.create({"user_id": "idle"})
+    clock.now += 2 * 60 * 1000
+    active = store.create({"user_id": "active"})
+    clock.now += 59 * 60 * 1000
+    assert store.get(active) is not None
+    clock.now += 2 * 60 * 1000
+    assert store.get(idle) is None  # idle for more than an hour
+    assert store.get(active) is not None
+    assert store.expirations == 1
+
+    store.create({"user_id": "b"})
+    store.create({"user_id": "c"})
+    assert store.evictions == 1
+    assert store.live_count() == 2
+    clock.now += 10 * HOUR_MS
+    assert store.sweep() == 2
+    assert store.live_count() == 0
+
+
+def test_local_key_value_expires_keys():
+    clock = Clock()
+    client = LocalKeyValue(clock=clock.seconds)
+    client.set("a", "1", px=1000)
+    client.set("b", "2")
+    assert client.get("a") == "1"
+    clock.now += 500
+    assert client.pexpire("a", 1000)
+    clock.now += 900
+    assert client.get("a") == "1"
+    clock.now += 200
+    assert client.get("a") is None
+    assert not client.pexpire("a", 1000)
+    assert list(client.scan_iter(match="*")) == ["b"]
+    assert client.delete("a", "b") == 1
+
+
+def test_key_value_store_slides_idle_expiry_up_to_the_lifetime():
+    clock = Clock()
+    store = KeyValueSessionStore(LocalKeyValue(clock=clock.seconds), ttl=3 * 3600, idle_ttl=3600,
+                                 sweep_interval=None, clock=clock)
+    token = store.create({"user_id": "u"})
+    for _ in range(2):
+        clock.now += 50 * 60 * 1000
+        assert store.get(token) == {"user_id": "u"}
+    clock.now += 50 * 60 * 1000
+    assert store.get(token) == {"user_id": "u"}
+    # 2.5 hours in: the key now expires at the absolute lifetime, not an hour later
+    clock.now += 31 * 60 * 1000
+    assert store.get(token) is None
+
+
+def test_key_value_store_drops_idle_sessions():
+    clock = Clock()
+    store = KeyValueSessionStore(LocalKeyValue(clock=clock.seconds), idle_ttl=3600, sweep_interval=None, clock=clock)
+    token = store.create({"user_id": "u"})
+    store.create({"user_id": "v"})
+    assert store.live_count() == 2
+    clock.now += HOUR_MS + 1
+    assert store.get(token) is None
+    store.sweep()
+    assert store.live_count() == 0
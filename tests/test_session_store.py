@@ -0,0 +1,71 @@
+"""In-process SessionStore (backend/session_store.py): expiry and LRU eviction."""
+from backend.session_store import SessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(**kwargs):
+    clock = Clock()
+    return clock, SessionStore(sweep_interval=None, clock=clock, **kwargs)
+
+
+def test_session_expires_after_its_absolute_lifetime_despite_activity():
+    clock, store = make_store(ttl=100, idle_ttl=60)
+    token = store.create({"user_id": "u"})
+    for _ in range(3):
+        clock.now += 30
+        assert store.get(token) == {"user_id": "u"}
+    clock.now += 30
+    assert store.get(token) is None
+    assert store.expirations == 1
+    assert store.live_count() == 0
+
+
+def test_lookups_slide_the_idle_timeout():
+    clock, store = make_store(ttl=1000, idle_ttl=60)
+    token = store.create({"user_id": "u"})
+    clock.now += 50
+    assert store.get(token) is not None
+    clock.now += 50
+    assert store.get(token) is not None
+    clock.now += 61
+    assert store.get(token) is None
+
+
+def test_least_recently_used_session_is_evicted():
+    _, store = make_store(max_entries=2)
+    first = store.create({"user_id": "a"})
+    second = store.create({"user_id": "b"})
+    store.get(first)  # `second` is now the least recently used
+    third = store.create({"user_id": "c"})
+    assert store.get(second) is None
+    assert store.get(first) == {"user_id": "a"}
+    assert store.get(third) == {"user_id": "c"}
+    assert store.evictions == 1
+    assert store.live_count() == 2
+
+
+def test_sweep_drops_only_expired_sessions():
+    clock, store = make_store(ttl=1000, idle_ttl=60)
+    idle = store.create({"user_id": "idle"})
+    clock.now += 40
+    active = store.create({"user_id": "active"})
+    clock.now += 30
+    assert store.sweep() == 1
+    assert store.get(idle) is None
+    assert store.get(active) == {"user_id": "active"}
+    assert store.stats() == {"live": 1, "evictions": 0, "expirations": 1}
+
+
+def test_delete_signs_the_session_out():
+    _, store = make_store()
+    token = store.create({"user_id": "u"})
+    store.delete(token)
+    assert store.get(token) is None
+    assert store.live_count() == 0
@@ -0,0 +1,81 @@
+"""Signed session tokens (backend/session_tokens.py): verification and revocation."""
+import pytest
+
+from backend import session_tokens
+from backend.session_tokens import DenyList, TokenSigner, parse_keys
+
+KEYS = {"k1": "a" * 32, "k2": "b" * 32}
+USER = {"user_id": "u", "email": "u@example.com"}
+
+
+def test_issued_token_verifies_and_carries_the_user():
+    signer = TokenSigner(KEYS)
+    payload = signer.verify(signer.issue(USER))
+    assert payload["user"] == USER
+    assert payload["kid"] == "k1"
+
+
+def test_tampered_or_foreign_tokens_are_rejected():
+    signer = TokenSigner(KEYS)
+    body, signature = signer.issue(USER).split(".")
+    other = TokenSigner({"k1": "c" * 32})
+    assert signer.verify(f"{body}.{signature[:-2]}xx") is None
+    assert signer.verify(body[:-2] + "xx." + signature) is None
+    assert other.verify(f"{body}.{signature}") is None
+    assert signer.verify("not-a-token") is None
+
+
+def test_token_expires_after_its_lifetime(monkeypatch):
+    signer = TokenSigner(KEYS, ttl=60)
+    token = signer.issue(USER)
+    issued = signer.verify(token)["iat"]
+    monkeypatch.setattr(session_tokens, "now_ms", lambda: issued + 60_000)
+    assert signer.verify(token) is None
+
+
+def test_revoked_token_is_denied_until_it_expires(monkeypatch):
+    signer = TokenSigner(KEYS, ttl=60)
+    token, other = signer.issue(USER), signer.issue(USER)
+    signer.revoke(token)
+    assert signer.verify(token) is None
+    assert signer.verify(other) is not None
+    expires = signer.verify(other)["exp"]
+    monkeypatch.setattr(session_tokens, "now_ms", lambda: expires)
+    signer.revoke(other)
+    assert len(signer.deny_list) == 1  # the first entry lapsed with its token
+
+
+def test_revoking_a_key_denies_its_tokens_only():
+    signer = TokenSigner(KEYS)
+    old = signer.issue(USER)
+    signer.current_key_id = "k2"
+    new = signer.issue(USER)
+    signer.revoke_key("k1")
+    assert signer.verify(old) is None
+    assert signer.verify(new) is not None
+
+
+def test_shared_deny_list_reaches_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_tokens, "DENY_LIST_REFRESH_SECONDS", 0)
+    path = str(tmp_path / "deny.db")
+    worker_a = TokenSigner(KEYS, deny_list=DenyList(path))
+    worker_b = TokenSigner(KEYS, deny_list=DenyList(path))
+    token = worker_a.issue(USER)
+    assert worker_b.verify(token) is not None
+    worker_a.revoke(token)
+    assert worker_b.verify(token) is None
+
+
+def test_short_or_unknown_keys_are_refused():
+    with pytest.raises(ValueError):
+        TokenSigner({"k1": "short"})
+    with pytest.raises(ValueError):
+        TokenSigner(KEYS, current_key_id="k3")
+    with pytest.raises(ValueError):
+        TokenSigner({})
+
+
+def test_parse_keys_accepts_a_table_or_a_string():
+    assert parse_keys("k1=secret-one, k2=secret=two") == {"k1": "secret-one", "k2": "secret=two"}
+    assert parse_keys({"k1": "secret"}) == {"k1": "secret"}
+    assert parse_keys("") == {}
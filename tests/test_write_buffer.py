@@ -0,0 +1,83 @@
+"""WriteBehindBuffer (backend/write_buffer.py) against the in-memory Firestore."""
+from google.cloud.firestore_v1.transforms import DELETE_FIELD
+
+from backend.fake_firestore import FakeFirestore
+from backend.write_buffer import WriteBehindBuffer
+
+
+def make_buffer(window=60):
+    db = FakeFirestore()
+    return db, WriteBehindBuffer(lambda: db, window=window)
+
+
+def test_writes_to_one_document_are_coalesced_into_one_commit():
+    db, buffer = make_buffer()
+    buffer.set("users/u/chats/c", {"title": "New chat", "message_count": 1})
+    buffer.set("users/u/chats/c", {"message_count": 2})
+    buffer.set("users/u/chats/c", {"message_count": 3, "persona": "Tutor"})
+    assert buffer.pending_count() == 1
+    assert buffer.flush(timeout=5)
+    assert db.stats["commit_calls"] == 1
+    assert db.stats["documents_written"] == 1
+    assert db.document("users/u/chats/c").get().to_dict() == {
+        "title": "New chat", "message_count": 3, "persona": "Tutor",
+    }
+    buffer.close()
+
+
+def test_nested_merges_keep_sibling_fields():
+    db, buffer = make_buffer()
+    buffer.set("users/u/stats/chats-01", {"chats": {"a": [1]}})
+    buffer.set("users/u/stats/chats-01", {"chats": {"b": [2]}})
+    buffer.flush(timeout=5)
+    assert db.document("users/u/stats/chats-01").get().to_dict() == {"chats": {"a": [1], "b": [2]}}
+    buffer.close()
+
+
+def test_delete_then_merge_replaces_the_document():
+    db, buffer = make_buffer()
+    db.document("users/u/chats/c").set({"title": "Old", "messages": ["x"]})
+    buffer.delete("users/u/chats/c")
+    buffer.set("users/u/chats/c", {"title": "New", "gone": DELETE_FIELD})
+    buffer.flush(timeout=5)
+    assert db.document("users/u/chats/c").get().to_dict() == {"title": "New"}
+    buffer.close()
+
+
+def test_replace_followed_by_field_delete_stays_a_valid_replace():
+    db, buffer = make_buffer()
+    buffer.set("users/u/chats/c", {"title": "T", "messages": ["x"]}, merge=False)
+    buffer.set("users/u/chats/c", {"messages": DELETE_FIELD})
+    buffer.flush(timeout=5)
+    assert db.document("users/u/chats/c").get().to_dict() == {"title": "T"}
+    buffer.close()
+
+
+def test_pending_reports_the_merged_write():
+    _, buffer = make_buffer()
+    buffer.set("users/u/chats/c", {"title": "T"})
+    buffer.set("users/u/chats/c", {"message_count": 2})
+    assert buffer.pending("users/u/chats/c")["data"] == {"title": "T", "message_count": 2}
+    buffer.flush(timeout=5)
+    assert buffer.pending("users/u/chats/c") is None
+    buffer.close()
+
+
+def test_window_expiry_commits_without_a_flush():
+    db, buffer = make_buffer(window=0.05)
+    buffer.set("users/u", {"name": "A"})
+    buffer.set("users/u", {"email": "a@example.com"})
+    buffer.close(timeout=5)
+    assert db.document("users/u").get().to_dict() == {"name": "A", "email": "a@example.com"}
+    assert db.stats["commit_calls"] == 1
+
+
+def test_prefix_flush_commits_only_that_users_writes():
+    db, buffer = make_buffer()
+    buffer.set("users/a/chats/c", {"title": "A"})
+    buffer.set("users/b/chats/c", {"title": "B"})
+    assert buffer.flush(timeout=5, prefix="users/a/")
+    assert db.document("users/a/chats/c").get().exists
+    assert not db.document("users/b/chats/c").get().exists
+    assert buffer.pending_count() == 1
+    buffer.close()
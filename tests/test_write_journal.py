@@ -0,0 +1,70 @@
+"""WriteJournal (backend/write_journal.py): durability, replay and retries."""
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+from backend.write_journal import WriteJournal
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def crash_after_appending(path, entries):
+    """Append `entries` in another process that dies before replaying them."""
+    script = textwrap.dedent(f"""
+        import os
+        from backend.write_journal import WriteJournal
+        def unreachable(payload):
+            raise ConnectionError("Firestore is down")
+        journal = WriteJournal({path!r}, {{"chat": unreachable}}, replay_window=60)
+        for key, payload in {entries!r}:
+            journal.append("chat", key, payload)
+        os._exit(0)
+    """)
+    subprocess.run([sys.executable, "-c", script], cwd=REPO, check=True, timeout=30)
+
+
+def test_entries_left_by_a_crash_are_replayed_on_reopen(tmp_path):
+    path = str(tmp_path / "journal.db")
+    crash_after_appending(path, [
+        ("users/u/chats/a", {"n": 1}),
+        ("users/u/chats/b", {"n": 1}),
+        ("users/u/chats/a", {"n": 2}),
+    ])
+    applied = []
+    journal = WriteJournal(path, {"chat": applied.append}, replay_window=0)
+    assert journal.flush(timeout=5)
+    # Only the newest entry per key is applied; the older one is superseded
+    assert sorted(applied, key=lambda payload: payload["n"]) == [{"n": 1}, {"n": 2}]
+    assert journal.pending_count() == 0
+    journal.close()
+
+
+def test_pending_returns_the_newest_unapplied_payload(tmp_path):
+    journal = WriteJournal(str(tmp_path / "journal.db"), {"chat": lambda payload: None}, replay_window=60)
+    journal.append("chat", "users/u/chats/a", {"n": 1})
+    journal.append("chat", "users/u/chats/a", {"n": 2})
+    assert journal.pending("users/u/chats/a") == {"n": 2}
+    journal.discard(["users/u/chats/a"])
+    assert journal.pending("users/u/chats/a") is None
+    journal.close()
+
+
+def test_failing_store_keeps_the_entry_and_does_not_block_flush(tmp_path):
+    calls = []
+
+    def failing(payload):
+        calls.append(payload)
+        raise ConnectionError("Firestore is down")
+
+    journal = WriteJournal(str(tmp_path / "journal.db"), {"chat": failing}, replay_window=0)
+    journal.append("chat", "users/u/chats/a", {"n": 1})
+    deadline = time.monotonic() + 5
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    started = time.monotonic()
+    assert not journal.flush(timeout=5)
+    assert time.monotonic() - started < 1
+    assert journal.pending("users/u/chats/a") == {"n": 1}
+    journal.close(timeout=0)